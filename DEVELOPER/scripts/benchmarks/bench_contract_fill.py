@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark del relleno de placeholders en las plantillas DOCX de contratos.
+
+Para cada plantilla de `static/contracts/templates` compara:
+  - legacy: `Document(path)` + `extract_placeholders_from_docx` (segundo parseo)
+    + bucle párrafos × placeholders (y celdas × placeholders) con `paragraph.text`
+    y `str.replace` (implementación previa)
+  - loop:   copia de la plantilla en caché (`_contract_template(...).clone()`)
+    con el mismo bucle anidado; aísla el coste del bucle
+  - engine: copia en caché + `_fill_contract_placeholders` (una regex por párrafo
+    con placeholders, edición por runs)
+Muestra la mediana por contrato y cuántos runs en negrita sobreviven.
+
+Uso (desde la raíz del repo):
+  python DEVELOPER/scripts/benchmarks/bench_contract_fill.py --runs 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('JWT_SECRET_KEY', 'bench-contracts-' + 'x' * 32)
+sys.path.insert(0, PROJECT_ROOT)
+import app as facturer  # noqa: E402
+from docx import Document  # noqa: E402
+
+TEMPLATES_DIR = os.path.join(facturer.STATIC_FOLDER, 'contracts', 'templates')
+
+
+def _legacy_fill(doc, original_tokens: dict, values: dict) -> None:
+    for paragraph in doc.paragraphs:
+        for name, token in original_tokens.items():
+            if name in values and token in paragraph.text:
+                paragraph.text = paragraph.text.replace(token, values[name])
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                for paragraph in cell.paragraphs:
+                    for name, token in original_tokens.items():
+                        if name in values and token in paragraph.text:
+                            paragraph.text = paragraph.text.replace(token, values[name])
+
+
+def fill(mode: str, path: str, values: dict):
+    if mode == 'legacy':
+        doc = Document(path)
+        info = facturer.extract_placeholders_from_docx(os.path.basename(path))
+        _legacy_fill(doc, info['original_tokens'], values)
+        return doc
+    template = facturer._contract_template(path)
+    doc = template.clone()
+    if mode == 'loop':
+        _legacy_fill(doc, template.original_tokens, values)
+    else:
+        facturer._fill_contract_placeholders(template, doc, values)
+    return doc
+
+
+def bold_runs(doc) -> int:
+    paragraphs = list(doc.paragraphs)
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                paragraphs.extend(cell.paragraphs)
+    return sum(1 for p in paragraphs for r in p.runs if r.bold and r.text.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--modes', nargs='+', choices=['legacy', 'loop', 'engine'], default=['legacy', 'loop', 'engine'])
+    args = parser.parse_args()
+
+    print(f"{'plantilla':<48} {'modo':<7} {'p50 ms':>8} {'negritas':>9}")
+    for filename in sorted(os.listdir(TEMPLATES_DIR)):
+        if not filename.endswith('.docx'):
+            continue
+        path = os.path.join(TEMPLATES_DIR, filename)
+        placeholders = facturer._contract_template(path).placeholders
+        values = {name: f'Valor de {name}' for name in placeholders}
+        for mode in args.modes:
+            doc = fill(mode, path, values)  # calentamiento
+            timings = []
+            for _ in range(args.runs):
+                t0 = time.perf_counter()
+                fill(mode, path, values)
+                timings.append((time.perf_counter() - t0) * 1000)
+            print(f'{filename:<48} {mode:<7} {statistics.median(timings):>8.2f} {bold_runs(doc):>9}')
+
+
+if __name__ == '__main__':
+    main()
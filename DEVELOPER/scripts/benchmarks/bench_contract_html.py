@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Benchmark de conversión DOCX→HTML de contratos (`_docx_to_html`) por contrato.
+
+Para cada plantilla de `static/contracts/templates` rellena una copia con
+valores de ejemplo y mide la mediana de `_docx_to_html` en tres modos:
+  - debug:     `CONTRACT_HTML_DEBUG` activo (un log INFO por párrafo) y sin
+               plantilla: clasifica cada párrafo y resuelve su estilo con
+               python-docx; equivale al comportamiento anterior
+  - sin_plantilla: sin logs, `_docx_to_html(doc)`
+  - plantilla: sin logs, `_docx_to_html(doc, template)`: títulos y estilos
+               precalculados al cargar la plantilla
+Todas las variantes deben producir el mismo HTML (se comprueba).
+
+Uso (desde la raíz del repo; los logs del modo debug van a stderr):
+  python DEVELOPER/scripts/benchmarks/bench_contract_html.py --runs 200 2>/dev/null
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('JWT_SECRET_KEY', 'bench-contracts-' + 'x' * 32)
+sys.path.insert(0, PROJECT_ROOT)
+import app as facturer  # noqa: E402
+
+TEMPLATES_DIR = os.path.join(facturer.STATIC_FOLDER, 'contracts', 'templates')
+MODES = ('debug', 'sin_plantilla', 'plantilla')
+
+
+def render(mode: str, doc, template) -> str:
+    facturer.CONTRACT_HTML_DEBUG = mode == 'debug'
+    return facturer._docx_to_html(doc, template if mode == 'plantilla' else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    facturer.app.logger.setLevel(logging.INFO)
+    print(f"{'plantilla':<48} {'modo':<14} {'p50 ms':>8} {'párrafos':>9}")
+    for filename in sorted(os.listdir(TEMPLATES_DIR)):
+        if not filename.endswith('.docx'):
+            continue
+        template = facturer._contract_template(os.path.join(TEMPLATES_DIR, filename))
+        doc = template.clone()
+        facturer._fill_contract_placeholders(template, doc, {name: f'Valor de {name}' for name in template.placeholders})
+        outputs = set()
+        for mode in args.modes:
+            outputs.add(render(mode, doc, template))  # calentamiento
+            timings = []
+            for _ in range(args.runs):
+                t0 = time.perf_counter()
+                render(mode, doc, template)
+                timings.append((time.perf_counter() - t0) * 1000)
+            print(f'{filename:<48} {mode:<14} {statistics.median(timings):>8.2f} {len(doc.paragraphs):>9}')
+        if len(outputs) != 1:
+            print(f'{filename}: ¡los modos producen HTML distinto!')
+    facturer.CONTRACT_HTML_DEBUG = False
+
+
+if __name__ == '__main__':
+    main()
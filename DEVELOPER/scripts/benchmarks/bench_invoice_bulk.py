@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark de alta de facturas: N × `POST /api/invoices` vs un `POST /api/invoices/bulk`.
+
+Cada modo usa su propio SQLite temporal (mismo cliente, facturas de 3 líneas,
+una con producto) y mide el tiempo total y las sentencias SQL ejecutadas.
+
+Uso (desde la raíz del repo):
+  python DEVELOPER/scripts/benchmarks/bench_invoice_bulk.py --sizes 100 1000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir))
+
+
+def run_mode(mode: str, size: int, db_url: str) -> dict:
+    os.environ['DATABASE_URL'] = db_url
+    os.environ['ENABLE_TALISMAN'] = 'false'
+    os.environ.setdefault('JWT_SECRET_KEY', 'bench-bulk-' + 'x' * 32)
+    sys.path.insert(0, PROJECT_ROOT)
+    import app as facturer  # noqa: E402
+    from flask_jwt_extended import create_access_token  # noqa: E402
+    from sqlalchemy import event  # noqa: E402
+
+    facturer.limiter.enabled = False
+    facturer.INVOICE_BULK_MAX = max(facturer.INVOICE_BULK_MAX, size)
+    with facturer.app.app_context():
+        facturer.db.create_all()
+        headers = {'Authorization': f'Bearer {create_access_token(identity="bench")}'}
+        engine = facturer.db.engine
+    client = facturer.app.test_client()
+    client_id = client.post('/api/clients', json={'name': 'Bench', 'cif': 'B00000000', 'address': 'Calle 1',
+                                                  'email': 'b@example.com', 'phone': '600000000'},
+                            headers=headers).get_json()['id']
+    product_id = client.post('/api/products', json={'category': 'tv', 'model': 'Bench', 'price_net': 10,
+                                                    'tax_rate': 21, 'stock_qty': size * 10},
+                             headers=headers).get_json()['id']
+    rows = [{
+        'date': '2026-05-10', 'type': 'factura', 'client_id': client_id, 'paid': bool(i % 2),
+        'items': [{'description': 'Cuota renting', 'units': 1, 'unit_price': 50, 'tax_rate': 21},
+                  {'description': 'Mantenimiento', 'units': 1, 'unit_price': 10, 'tax_rate': 21},
+                  {'description': 'Soporte', 'units': 1, 'unit_price': 10, 'tax_rate': 21, 'product_id': product_id}],
+    } for i in range(size)]
+
+    statements = 0
+
+    def count(*_args):
+        nonlocal statements
+        statements += 1
+
+    event.listen(engine, 'before_cursor_execute', count)
+    t0 = time.perf_counter()
+    if mode == 'single':
+        ok = sum(client.post('/api/invoices', json=row, headers=headers).status_code == 201 for row in rows)
+    else:
+        ok = client.post('/api/invoices/bulk', json={'invoices': rows}, headers=headers).get_json()['created']
+    return {'mode': mode, 'created': ok, 'seconds': round(time.perf_counter() - t0, 3), 'statements': statements}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--mode', choices=['single', 'bulk'], help='(interno) ejecutar un modo')
+    parser.add_argument('--size', type=int)
+    parser.add_argument('--db')
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.size, args.db)))
+        return
+
+    print(f"{'facturas':>9} {'modo':<7} {'segundos':>9} {'sentencias SQL':>15}")
+    for size in args.sizes:
+        for mode in ('single', 'bulk'):
+            with tempfile.TemporaryDirectory() as tmp:
+                db_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+                out = subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', mode, '--size', str(size),
+                                      '--db', db_url], capture_output=True, text=True, cwd=PROJECT_ROOT)
+                try:
+                    res = json.loads(out.stdout.strip().splitlines()[-1])
+                except Exception:
+                    print(f'{size:>9} {mode:<7} fallo: {out.stderr.strip()[-300:]}')
+                    continue
+                print(f"{size:>9} {mode:<7} {res['seconds']:>9} {res['statements']:>15}")
+
+
+if __name__ == '__main__':
+    main()
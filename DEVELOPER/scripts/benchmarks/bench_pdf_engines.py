@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark de motores PDF de facturas: wkhtmltopdf (pdfkit) vs ReportLab.
+
+Mide la latencia por PDF y el pico de memoria (RSS) de cada motor.  Cada
+motor se ejecuta en un subproceso propio para que el RSS no se contamine:
+  - rss_self: pico del proceso Python (ReportLab dibuja aquí)
+  - rss_children: pico de los procesos hijos (wkhtmltopdf se lanza uno por PDF)
+
+Uso (desde la raíz del repo):
+  python DEVELOPER/scripts/benchmarks/bench_pdf_engines.py --runs 20 --lines 10
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date
+from types import SimpleNamespace
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir))
+
+
+def _sample_invoice(lines: int):
+    items = [
+        SimpleNamespace(
+            description=f'Pantalla publicitaria {i}\nSoporte de pared incluido',
+            units=1 + i % 3, unit_price=120.0 + i, tax_rate=21.0,
+            subtotal=(1 + i % 3) * (120.0 + i), total=(1 + i % 3) * (120.0 + i) * 1.21,
+        )
+        for i in range(lines)
+    ]
+    invoice = SimpleNamespace(
+        id=1, number='F2501001', date=date(2025, 1, 15), type='factura', notes='Pago a 30 días',
+        payment_method='transferencia', total=sum(i.total for i in items),
+        tax_total=sum(i.total - i.subtotal for i in items),
+    )
+    client = SimpleNamespace(name='Cliente Demo S.L.', cif='B00000000', address='Calle Demo 1, Madrid',
+                             email='demo@example.com', phone='600000000', iban='ES00 0000 0000 0000 0000 0000')
+    return invoice, client, items
+
+
+def run_engine(engine: str, runs: int, lines: int) -> dict:
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    sys.path.insert(0, PROJECT_ROOT)
+    import app as facturer  # noqa: E402
+
+    invoice, client, items = _sample_invoice(lines)
+    company = facturer._company_from_env()
+    with facturer.app.app_context():
+        if engine == 'wkhtmltopdf':
+            if facturer.pdfkit is None or not facturer._resolve_pdfkit_configuration():
+                return {'engine': engine, 'error': 'wkhtmltopdf no disponible'}
+
+            def render():
+                html = facturer._render_invoice_html(invoice, client, company, items)
+                return facturer._html_to_pdf(html, facturer.INVOICE_PDF_OPTIONS)
+        else:
+            def render():
+                return facturer._generate_invoice_pdf_reportlab(invoice, client, company, items)
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        try:
+            render()  # calentamiento (imports perezosos, fuentes)
+        except Exception as e:
+            return {'engine': engine, 'error': str(e)}
+        timings = []
+        size = 0
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            size = len(render())
+            timings.append((time.perf_counter() - t0) * 1000)
+
+    timings.sort()
+    return {
+        'engine': engine,
+        'runs': runs,
+        'lines': lines,
+        'pdf_bytes': size,
+        'ms_mean': round(statistics.mean(timings), 1),
+        'ms_p50': round(timings[len(timings) // 2], 1),
+        'ms_p95': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 1),
+        'rss_self_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'rss_self_before_kb': rss_before,
+        'rss_children_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--lines', type=int, default=10, help='líneas por factura')
+    parser.add_argument('--engine', choices=['wkhtmltopdf', 'reportlab'], help='(interno) ejecutar un solo motor')
+    args = parser.parse_args()
+
+    if args.engine:
+        print(json.dumps(run_engine(args.engine, args.runs, args.lines)))
+        return
+
+    print(f"{'motor':<12} {'media ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'RSS py MB':>10} {'RSS hijos MB':>13} {'bytes':>8}")
+    for engine in ('wkhtmltopdf', 'reportlab'):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--engine', engine, '--runs', str(args.runs), '--lines', str(args.lines)],
+            capture_output=True, text=True, cwd=PROJECT_ROOT,
+        )
+        try:
+            res = json.loads(out.stdout.strip().splitlines()[-1])
+        except Exception:
+            print(f"{engine:<12} fallo: {out.stderr.strip()[-300:]}")
+            continue
+        if 'error' in res:
+            print(f"{engine:<12} {res['error']}")
+            continue
+        print(f"{engine:<12} {res['ms_mean']:>9} {res['ms_p50']:>8} {res['ms_p95']:>8} "
+              f"{res['rss_self_kb'] / 1024:>10.1f} {res['rss_children_kb'] / 1024:>13.1f} {res['pdf_bytes']:>8}")
+
+
+if __name__ == '__main__':
+    main()
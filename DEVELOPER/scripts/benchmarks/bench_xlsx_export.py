@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmark de exportación XLSX de facturas: Workbook en memoria vs write_only.
+
+Para cada tamaño crea un SQLite temporal con N facturas y mide, en un
+subproceso propio (para que el RSS no se contamine entre ejecuciones):
+  - legacy: `Workbook()` + `Query.all()` + `wb.save(BytesIO)` (implementación previa)
+  - write_only: `GET /api/invoices/export_xlsx` (`_xlsx_export_response`)
+Muestra el tiempo total y el pico de RSS del proceso (ru_maxrss).
+
+Uso (desde la raíz del repo):
+  python DEVELOPER/scripts/benchmarks/bench_xlsx_export.py --sizes 10000 100000 1000000
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir))
+
+
+def populate(db_url: str, rows: int, chunk: int = 20000) -> None:
+    os.environ['DATABASE_URL'] = db_url
+    sys.path.insert(0, PROJECT_ROOT)
+    import app as facturer  # noqa: E402
+    from sqlalchemy import insert  # noqa: E402
+
+    rng = random.Random(7)
+    with facturer.app.app_context():
+        db = facturer.db
+        db.session.execute(insert(facturer.Client), [
+            dict(name=f'Cliente {i}', cif=f'B{i:08d}', address='Calle Demo 1', email=f'c{i}@example.com', phone='600000000')
+            for i in range(1, 101)
+        ])
+        for base in range(0, rows, chunk):
+            db.session.execute(insert(facturer.Invoice), [
+                dict(number=f'B{i:09d}', date=date(2024, 1, 1) + timedelta(days=i % 730),
+                     type='factura', client_id=rng.randint(1, 100), total=121.0, tax_total=21.0, paid=True)
+                for i in range(base, min(rows, base + chunk))
+            ])
+        db.session.commit()
+
+
+def run_mode(mode: str, db_url: str) -> dict:
+    os.environ['DATABASE_URL'] = db_url
+    os.environ.setdefault('JWT_SECRET_KEY', 'bench-xlsx-' + 'x' * 32)
+    os.environ['ENABLE_TALISMAN'] = 'false'
+    sys.path.insert(0, PROJECT_ROOT)
+    import app as facturer  # noqa: E402
+    from flask_jwt_extended import create_access_token  # noqa: E402
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    with facturer.app.app_context():
+        if mode == 'legacy':
+            from openpyxl import Workbook
+            wb = Workbook()
+            ws = wb.active
+            ws.title = 'Facturas'
+            ws.append(['id', 'number', 'date', 'type', 'client_id', 'total', 'tax_total'])
+            for inv in facturer.Invoice.query.order_by(facturer.Invoice.id).all():
+                ws.append([inv.id, inv.number, inv.date.isoformat(), inv.type, inv.client_id, inv.total, inv.tax_total])
+            bio = io.BytesIO()
+            wb.save(bio)
+            size = bio.tell()
+        else:
+            token = create_access_token(identity='bench')
+            facturer.limiter.enabled = False
+            resp = facturer.app.test_client().get('/api/invoices/export_xlsx', headers={'Authorization': f'Bearer {token}'},
+                                                  buffered=False)
+            size = sum(len(chunk) for chunk in resp.response)
+            resp.close()
+    return {
+        'mode': mode,
+        'seconds': round(time.perf_counter() - t0, 2),
+        'xlsx_bytes': size,
+        'rss_peak_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'rss_import_mb': round(rss_before / 1024, 1),
+    }
+
+
+def _child(args: list) -> dict:
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), *args], capture_output=True, text=True,
+                         cwd=PROJECT_ROOT)
+    try:
+        return json.loads(out.stdout.strip().splitlines()[-1])
+    except Exception:
+        return {'error': out.stderr.strip()[-300:]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--modes', nargs='+', choices=['legacy', 'write_only'], default=['legacy', 'write_only'])
+    parser.add_argument('--populate', type=int, help='(interno) cargar N facturas en --db')
+    parser.add_argument('--mode', choices=['legacy', 'write_only'], help='(interno) ejecutar un modo en --db')
+    parser.add_argument('--db')
+    args = parser.parse_args()
+
+    if args.populate is not None:
+        populate(args.db, args.populate)
+        print(json.dumps({'rows': args.populate}))
+        return
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.db)))
+        return
+
+    print(f"{'filas':>9} {'modo':<11} {'segundos':>9} {'RSS pico MB':>12} {'RSS import MB':>14} {'bytes':>11}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+            loaded = _child(['--populate', str(size), '--db', db_url])
+            if 'error' in loaded:
+                print(f'{size:>9} carga fallida: {loaded["error"]}')
+                continue
+            for mode in args.modes:
+                res = _child(['--mode', mode, '--db', db_url])
+                if 'error' in res:
+                    print(f'{size:>9} {mode:<11} fallo: {res["error"]}')
+                    continue
+                print(f"{size:>9} {mode:<11} {res['seconds']:>9} {res['rss_peak_mb']:>12} "
+                      f"{res['rss_import_mb']:>14} {res['xlsx_bytes']:>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Prueba de estrés de la numeración de facturas bajo concurrencia.
+
+Lanza N hilos que crean facturas a la vez con `POST /api/invoices` (fechas
+repartidas en varios meses, facturas y proformas) y comprueba después, por
+cada serie (tipo + AAMM):
+  - sin duplicados ni huecos: los números emitidos son exactamente 1..n
+  - `document_sequence.last_number` == n
+  - todas las peticiones respondieron 201
+Modos:
+  - allocator: `_allocate_sequence` (upsert `ON CONFLICT DO UPDATE RETURNING`)
+  - legacy:    SELECT ... FOR UPDATE + crear fila si falta (implementación previa)
+
+Uso (desde la raíz del repo; por defecto un SQLite temporal):
+  python DEVELOPER/scripts/benchmarks/stress_invoice_numbers.py --threads 16 --invoices 4000
+  python DEVELOPER/scripts/benchmarks/stress_invoice_numbers.py --database-url postgresql+psycopg://u:p@host/db_vacia
+Sale con código 1 si encuentra duplicados, huecos o errores.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir))
+MONTHS = ('2026-01-15', '2026-02-15', '2026-03-15')
+
+
+def legacy_next_sequence(facturer):
+    def _next(doc_type, at_date=None):
+        at = at_date or facturer.datetime.utcnow()
+        seq = (facturer.DocumentSequence.query
+               .filter_by(doc_type=doc_type, year=at.year, month=at.month)
+               .with_for_update(nowait=False)
+               .first())
+        if not seq:
+            seq = facturer.DocumentSequence(doc_type=doc_type, year=at.year, month=at.month, last_number=0)
+            facturer.db.session.add(seq)
+            facturer.db.session.flush()
+        seq.last_number += 1
+        facturer.db.session.flush()
+        return facturer._format_number_for_type(doc_type, seq.last_number, at.year, at.month)
+    return _next
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--invoices', type=int, default=4000, help='total de facturas a crear')
+    parser.add_argument('--mode', choices=['allocator', 'legacy'], default='allocator')
+    parser.add_argument('--database-url', help='base de datos VACÍA (por defecto SQLite temporal)')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='facturer-stress-')
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tmp, 'stress.db')}"
+    os.environ['ENABLE_TALISMAN'] = 'false'
+    os.environ.setdefault('JWT_SECRET_KEY', 'stress-numbers-' + 'x' * 32)
+    sys.path.insert(0, PROJECT_ROOT)
+    import app as facturer  # noqa: E402
+    from flask_jwt_extended import create_access_token  # noqa: E402
+
+    if args.mode == 'legacy':
+        facturer._next_sequence_atomic = legacy_next_sequence(facturer)
+    facturer.limiter.enabled = False
+    with facturer.app.app_context():
+        facturer.db.create_all()
+        headers = {'Authorization': f'Bearer {create_access_token(identity="stress")}'}
+    client = facturer.app.test_client()
+    r = client.post('/api/clients', json={'name': 'Estrés', 'cif': 'B00000000', 'address': 'Calle 1',
+                                          'email': 'stress@example.com', 'phone': '600000000'}, headers=headers)
+    client_id = r.get_json()['id']
+
+    statuses = Counter()
+    errors = Counter()
+    lock = threading.Lock()
+    counter = iter(range(args.invoices))
+
+    def worker():
+        http = facturer.app.test_client()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            payload = {
+                'date': MONTHS[i % len(MONTHS)], 'type': 'proforma' if i % 4 == 3 else 'factura',
+                'client_id': client_id, 'items': [{'description': f'Línea {i}', 'units': 1, 'unit_price': 10,
+                                                   'tax_rate': 21}],
+            }
+            try:
+                resp = http.post('/api/invoices', json=payload, headers=headers)
+                code, error = resp.status_code, (resp.get_json(silent=True) or {}).get('error')
+            except Exception as exc:  # errores de BD no capturados por la vista
+                code, error = 'exc', f'{type(exc).__name__}: {str(exc)[:80]}'
+            with lock:
+                statuses[code] += 1
+                if code != 201:
+                    errors[error] += 1
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    with facturer.app.app_context():
+        numbers = [n for (n,) in facturer.db.session.query(facturer.Invoice.number)]
+        sequences = {(s.doc_type, s.year, s.month): s.last_number for s in facturer.DocumentSequence.query}
+    series = defaultdict(list)
+    for number in numbers:
+        series[number[:5]].append(int(number[5:]))
+    ok = statuses.get(201, 0) == args.invoices and len(numbers) == len(set(numbers))
+    print(f'modo={args.mode} hilos={args.threads} facturas={args.invoices} '
+          f'{elapsed:.1f}s ({args.invoices / elapsed:.0f}/s) respuestas={dict(statuses)}')
+    for prefix, seqs in sorted(series.items()):
+        doc_type = 'factura' if prefix[0] == 'F' else 'proforma'
+        last = sequences.get((doc_type, 2000 + int(prefix[1:3]), int(prefix[3:5])))
+        dupes = len(seqs) - len(set(seqs))
+        gaps = sorted(set(range(1, max(seqs) + 1)) - set(seqs))
+        ok = ok and not dupes and not gaps and last == len(seqs)
+        print(f'  {prefix}: {len(seqs)} números, duplicados={dupes}, huecos={len(gaps)}, last_number={last}')
+    for error, count in errors.most_common(5):
+        print(f'  error x{count}: {error}')
+    print('OK' if ok else 'FALLO')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -30,10 +30,26 @@ for generating invoices, reports and other documents【239017722105616†L83-L94
 from datetime import datetime, timedelta
 import os
 import time
+import hashlib
+import shutil
+import sqlite3
+import threading
+import multiprocessing
+import zipfile
+import csv
+import tempfile
+import copy
+import bisect
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import re
 import unicodedata
+import click
 from docx import Document
-from flask import Flask, jsonify, request, render_template, send_file, abort, url_for, Response
+from docx.enum.style import WD_STYLE_TYPE
+from flask import Flask, jsonify, request, render_template, send_file, abort, url_for, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_compress import Compress
 from flask_cors import CORS
@@ -44,8 +60,11 @@ from flask_jwt_extended import (
     JWTManager, create_access_token, jwt_required, get_jwt_identity,
     set_access_cookies, unset_jwt_cookies, verify_jwt_in_request
 )
-from sqlalchemy import inspect, text
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import inspect, text, event
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload, selectinload
 from dotenv import load_dotenv
 from types import SimpleNamespace
 try:
@@ -53,8 +72,13 @@ try:
     from sentry_sdk.integrations.flask import FlaskIntegration  # type: ignore
 except Exception:
     sentry_sdk = None  # type: ignore
+try:
+    from PIL import Image as PILImage, ImageOps  # type: ignore
+except Exception:
+    PILImage = None  # type: ignore
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
 from typing import Tuple
 from werkzeug.middleware.proxy_fix import ProxyFix
 import logging
@@ -86,6 +110,12 @@ except Exception:
 # Eliminamos WeasyPrint para evitar incompatibilidades entre entornos
 use_weasyprint = False
 
+# Motor de facturas: 'wkhtmltopdf' (HTML→PDF, por defecto) o 'reportlab'
+# (dibujo nativo en Python, sin proceso externo por PDF)
+PDF_ENGINE = (os.getenv('PDF_ENGINE') or 'wkhtmltopdf').strip().lower()
+if PDF_ENGINE not in ('wkhtmltopdf', 'reportlab'):
+    PDF_ENGINE = 'wkhtmltopdf'
+
 try:
     import pdfkit  # type: ignore
 except Exception:
@@ -112,11 +142,17 @@ def _resolve_pdfkit_configuration():
     except Exception:
         return None
 
-# Fallback PDF generator (pure Python) when WeasyPrint/wkhtmltopdf are unavailable
+# ReportLab: pure-Python PDF engine (PDF_ENGINE=reportlab) and fallback when wkhtmltopdf is unavailable
 try:
     from reportlab.lib.pagesizes import A4
     from reportlab.pdfgen import canvas
-    from reportlab.lib.units import mm
+    from reportlab.lib.units import mm, cm
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.utils import ImageReader
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, Spacer, Image, HRFlowable
+    from xml.sax.saxutils import escape as xml_escape
     reportlab_available = True
 except Exception:
     reportlab_available = False
@@ -177,6 +213,11 @@ import io
 from pathlib import Path
 from uuid import uuid4
 import json
+import base64
+try:
+    import fcntl  # bloqueo de subidas reanudables (no existe en Windows)
+except ImportError:
+    fcntl = None  # type: ignore
 
 # -----------------------------------------------------------------------------
 # Flask configuration
@@ -459,6 +500,11 @@ limiter = Limiter(
 DOWNLOAD_FOLDER = os.path.join(app.root_path, 'downloads')
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
+# Caché de PDFs de facturas ya renderizados (direccionada por contenido).
+# Un subdirectorio por factura: <PDF_CACHE_DIR>/<invoice_id>/<sha256>.pdf
+PDF_CACHE_DIR = os.getenv('PDF_CACHE_DIR') or os.path.join(DOWNLOAD_FOLDER, 'pdf_cache')
+os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+
 # Asegurar carpeta static para logo PDF
 STATIC_FOLDER = os.path.join(app.root_path, 'static')
 os.makedirs(STATIC_FOLDER, exist_ok=True)
@@ -488,10 +534,22 @@ def handle_429(err):
 def handle_404(err):
     return jsonify({"error": "not found", "code": 404}), 404
 
+@app.errorhandler(413)
+def handle_413(err):
+    return jsonify({"error": getattr(err, 'description', 'payload too large'), "code": 413}), 413
+
+@app.errorhandler(415)
+def handle_415(err):
+    return jsonify({"error": getattr(err, 'description', 'unsupported media type'), "code": 415}), 415
+
 @app.errorhandler(500)
 def handle_500(err):
     return jsonify({"error": 'internal error', "code": 500}), 500
 
+@app.errorhandler(503)
+def handle_503(err):
+    return jsonify({"error": getattr(err, 'description', 'service unavailable'), "code": 503}), 503
+
 
 # -----------------------------------------------------------------------------
 # Database models
@@ -549,12 +607,27 @@ class ClientDocument(db.Model):
     category = db.Column(db.String(16), nullable=False)
     filename = db.Column(db.String(255), nullable=False)  # nombre original
     stored_path = db.Column(db.String(512), nullable=False)  # ruta relativa bajo UPLOADS_ROOT
+    # SHA-256 del contenido: stored_path apunta a blobs/<sha[:2]>/<sha> (StoredBlob)
+    sha256 = db.Column(db.String(64), index=True)
     content_type = db.Column(db.String(128), nullable=False)
     size_bytes = db.Column(db.Integer, default=0)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     client = db.relationship('Client', backref=db.backref('documents', lazy=True))
 
 
+class StoredBlob(db.Model):
+    """Content-addressed file under UPLOADS_ROOT/blobs, shared by identical documents.
+
+    ``ref_count`` is the number of ``ClientDocument`` rows pointing at it; the
+    file is removed after the commit that drops it to zero (``_blob_release``,
+    ``_blob_unlink``).
+    """
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size_bytes = db.Column(db.Integer, nullable=False, default=0)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
 class InvoiceItem(db.Model):
     """Line items that belong to an invoice."""
     id = db.Column(db.Integer, primary_key=True)
@@ -603,6 +676,10 @@ class User(db.Model):
 
 class DocumentSequence(db.Model):
     """Stores the last issued number per document type and period (year, month)."""
+    __table_args__ = (
+        # Destino del ON CONFLICT de _allocate_sequence
+        db.Index('uq_docseq_type_year_month', 'doc_type', 'year', 'month', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     doc_type = db.Column(db.String(16), nullable=False, index=True)
     year = db.Column(db.Integer, nullable=False, default=0, index=True)
@@ -624,6 +701,64 @@ class Expense(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class ReportRollup(db.Model):
+    """Pre-aggregated daily totals read by /api/reports/*.
+
+    kind: 'income' (facturas pagadas) | 'expense' (gastos).  Maintained on
+    every write via ``_refresh_report_rollups``; rebuild with
+    ``flask --app app rebuild-report-rollups``.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'year', 'month', 'day', name='uq_report_rollup_period'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    day = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class RecurringInvoice(db.Model):
+    """Plantilla de factura periódica (cuotas de renting).
+
+    ``template``: campos de ``InvoiceCreateRequest`` salvo ``date`` y
+    ``client_id`` (type, items, notes, payment_method, paid).  Cada
+    ``interval_months`` meses, a partir de ``next_run`` (día 1-28), el
+    programador ``flask run-recurring-invoices`` emite una factura.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False, index=True)
+    name = db.Column(db.String(128), nullable=False)
+    template = db.Column(db.JSON, nullable=False)
+    interval_months = db.Column(db.Integer, nullable=False, default=1)
+    next_run = db.Column(db.Date, nullable=False, index=True)
+    end_date = db.Column(db.Date)
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    prerender_pdf = db.Column(db.Boolean, nullable=False, default=False)
+    last_run_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    client = db.relationship('Client')
+
+
+class RecurringInvoiceRun(db.Model):
+    """Factura emitida por una plantilla para un periodo (YYYY-MM).
+
+    La restricción única hace idempotente la ejecución: un periodo ya emitido
+    no se vuelve a facturar aunque el programador corra dos veces.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('recurring_id', 'period', name='uq_recurring_run_period'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    recurring_id = db.Column(db.Integer, db.ForeignKey('recurring_invoice.id'), nullable=False)
+    period = db.Column(db.String(7), nullable=False)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
 # -----------------------------------------------------------------------------
 # Helper functions
 
@@ -635,6 +770,489 @@ def calculate_totals(items):
     return subtotal_sum, tax_sum, total_sum
 
 
+def _load_invoice_or_404(invoice_id: int, with_client: bool = True) -> 'Invoice':
+    """Invoice with its lines (selectinload) and client (joined) in two queries."""
+    options = [selectinload(Invoice.items)]
+    if with_client:
+        options.append(joinedload(Invoice.client))
+    invoice = db.session.get(Invoice, invoice_id, options=options)
+    if invoice is None:
+        abort(404)
+    return invoice
+
+
+def _products_by_id(product_ids) -> dict:
+    """{id: Product} for every referenced product in a single ``IN (...)`` query."""
+    ids = {int(pid) for pid in product_ids if pid}
+    if not ids:
+        return {}
+    return {p.id: p for p in Product.query.filter(Product.id.in_(ids)).all()}
+
+
+def _insert_rows(model, rows: list) -> None:
+    """Bulk INSERT of plain dicts: one executemany instead of one INSERT … RETURNING per object.
+
+    The new rows are not added to the session; relationships such as
+    ``invoice.items`` see them on their next (lazy or eager) load.  ``None``
+    values are sent as NULL (``render_nulls``) instead of being omitted, so
+    rows with and without e.g. ``product_id`` stay in the same batch.
+    """
+    if rows:
+        db.session.execute(db.insert(model).execution_options(render_nulls=True), rows)
+
+
+def _month_bounds(year: int, month: int):
+    """Return the half-open date range [first day of month, first day of next month)."""
+    start = datetime(year, month, 1).date()
+    end = datetime(year + 1, 1, 1).date() if month == 12 else datetime(year, month + 1, 1).date()
+    return start, end
+
+
+def _date_range_from_args(args):
+    """Parse ``from``/``to`` (YYYY-MM-DD, both inclusive) or ``year``[+``month``].
+
+    Returns a half-open ``(start, end)`` tuple of dates; either side may be
+    None when not provided.  Raises ValueError on malformed input.
+    """
+    date_from = (args.get('from') or '').strip()
+    date_to = (args.get('to') or '').strip()
+    if date_from or date_to:
+        start = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+        end = (datetime.strptime(date_to, '%Y-%m-%d').date() + timedelta(days=1)) if date_to else None
+        return start, end
+    year = args.get('year')
+    month = args.get('month')
+    if year and month:
+        return _month_bounds(int(year), int(month))
+    if year:
+        return datetime(int(year), 1, 1).date(), datetime(int(year) + 1, 1, 1).date()
+    return None, None
+
+
+def _filter_date_range(query, column, start, end):
+    """Apply a half-open ``start <= column < end`` range (sargable: uses the date index)."""
+    if start is not None:
+        query = query.filter(column >= start)
+    if end is not None:
+        query = query.filter(column < end)
+    return query
+
+
+def _encode_cursor(sort: str, direction: str, value, row_id: int) -> str:
+    """Opaque keyset cursor: base64url of the last row's (sort value, id)."""
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    raw = json.dumps({'s': sort, 'd': direction, 'v': value, 'id': row_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(token: str, sort: str, direction: str, column):
+    """Inverse of ``_encode_cursor``.  Raises ValueError if malformed or for another sort/dir."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if data['s'] != sort or data['d'] != direction:
+            raise ValueError('cursor de otra ordenación')
+        value, row_id = data['v'], int(data['id'])
+        if value is not None and isinstance(column.type, db.DateTime):
+            value = datetime.fromisoformat(value)
+        elif value is not None and isinstance(column.type, db.Date):
+            value = datetime.strptime(value, '%Y-%m-%d').date()
+    except (KeyError, TypeError, AttributeError) as e:  # JSON/base64 errors are already ValueError
+        raise ValueError(str(e))
+    return value, row_id
+
+
+def _paginate_listing(query, model, sort: str, direction: str, args):
+    """Order ``query`` by (sort, id) and return ``(rows, meta)`` for a listing.
+
+    - Default: ``limit``/``offset`` as before.
+    - ``cursor`` (opt-in; empty string = first page): keyset pagination.  The
+      next page filters ``(sort, id)`` past the last row instead of OFFSET, so
+      every page costs O(limit).  ``meta['next_cursor']`` is None at the end.
+    - ``include_total=0`` skips the COUNT(*) (``meta['total']`` is None).
+
+    NULLs always sort last so the keyset predicate is the same on SQLite and
+    Postgres.  Raises ValueError for an invalid cursor.
+    """
+    limit = max(0, args.get('limit', type=int, default=10))
+    offset = max(0, args.get('offset', type=int, default=0))
+    cursor = args.get('cursor')
+    include_total = (args.get('include_total') or '1').strip().lower() not in {'0', 'false', 'no'}
+
+    column = getattr(model, sort)
+    nullable = bool(getattr(column, 'nullable', False)) and sort != 'id'
+    desc = direction == 'desc'
+    meta = {'total': query.count() if include_total else None}
+
+    order = [column.desc() if desc else column.asc()]
+    if nullable:
+        order[0] = order[0].nulls_last()
+    if sort != 'id':
+        order.append(model.id.desc() if desc else model.id.asc())
+
+    if cursor is None:
+        return query.order_by(*order).offset(offset).limit(limit).all(), meta
+
+    if cursor:
+        value, last_id = _decode_cursor(cursor, sort, direction, column)
+        after = (lambda col, v: col < v) if desc else (lambda col, v: col > v)
+        if sort == 'id':
+            cond = after(model.id, last_id)
+        elif value is None:
+            cond = db.and_(column.is_(None), after(model.id, last_id))
+        else:
+            cond = db.or_(after(column, value), db.and_(column == value, after(model.id, last_id)))
+            if nullable:
+                cond = db.or_(cond, column.is_(None))
+        query = query.filter(cond)
+    rows = query.order_by(*order).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    meta['next_cursor'] = (_encode_cursor(sort, direction, getattr(rows[-1], sort), rows[-1].id)
+                           if has_more and rows else None)
+    return rows, meta
+
+
+def _rollup_source_query(kind: str, *columns):
+    """Query over the source table of a rollup kind, with its inclusion filters."""
+    if kind == 'income':
+        return (db.session.query(*columns)
+                .filter(Invoice.type == 'factura')
+                .filter(Invoice.paid.is_(True)))
+    return db.session.query(*columns)
+
+
+def _rollup_source_model(kind: str):
+    return Invoice if kind == 'income' else Expense
+
+
+def _lock_report_rollup(kind: str, day) -> dict:
+    """Create the rollup row of ``day`` if missing and hold its row lock until commit.
+
+    ``INSERT ... ON CONFLICT DO NOTHING`` (waits on a concurrent insert of
+    the same day instead of failing on ``uq_report_rollup_period``) and then
+    ``SELECT ... FOR UPDATE``.  En SQLite el INSERT ya toma el bloqueo de
+    escritura de la base.  Returns the row's key.
+    """
+    key = dict(kind=kind, year=day.year, month=day.month, day=day.day)
+    table = ReportRollup.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = pg_insert if dialect == 'postgresql' else sqlite_insert
+        db.session.execute(insert(table)
+                           .values(**key, total=0.0, count=0, updated_at=datetime.utcnow())
+                           .on_conflict_do_nothing(index_elements=['kind', 'year', 'month', 'day']))
+    elif ReportRollup.query.filter_by(**key).first() is None:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(**key, total=0.0, count=0, updated_at=datetime.utcnow()))
+        except IntegrityError:
+            pass
+    db.session.execute(db.select(table.c.id).filter_by(**key).with_for_update())
+    return key
+
+
+def _refresh_report_rollups(kind: str, *days) -> None:
+    """Recompute the rollup rows of the given days from the source table.
+
+    Call before ``db.session.commit()`` after any write that can change the
+    totals of those days (autoflush makes the pending changes visible).
+    Each refresh is an indexed equality lookup on ``date``, run only once
+    the day's row is locked (``_lock_report_rollup``): a concurrent writer
+    of the same day waits for this commit and then sums our rows too, so
+    no amount is lost under READ COMMITTED.  Days are locked in order to
+    avoid deadlocks between writers touching two days.
+    """
+    model = _rollup_source_model(kind)
+    for day in sorted({d for d in days if d is not None}):
+        key = _lock_report_rollup(kind, day)
+        total, count = (_rollup_source_query(kind, db.func.sum(model.total), db.func.count(model.id))
+                        .filter(model.date == day)
+                        .one())
+        rows = ReportRollup.query.filter_by(**key)
+        if not count:
+            rows.delete(synchronize_session=False)
+            continue
+        rows.update({ReportRollup.total: float(total or 0), ReportRollup.count: int(count),
+                     ReportRollup.updated_at: datetime.utcnow()}, synchronize_session=False)
+
+
+def _rebuild_report_rollups() -> int:
+    """Rebuild every rollup row from invoice/expense (backfill).  Returns rows written."""
+    ReportRollup.query.delete()
+    written = 0
+    for kind in ('income', 'expense'):
+        model = _rollup_source_model(kind)
+        rows = (_rollup_source_query(kind, model.date, db.func.sum(model.total), db.func.count(model.id))
+                .group_by(model.date)
+                .all())
+        now = datetime.utcnow()
+        db.session.add_all([
+            ReportRollup(kind=kind, year=d.year, month=d.month, day=d.day,
+                         total=float(t or 0), count=int(n), updated_at=now)
+            for d, t, n in rows
+        ])
+        written += len(rows)
+    db.session.commit()
+    return written
+
+
+@app.cli.command('rebuild-report-rollups')
+def rebuild_report_rollups_command():
+    """Recalcula la tabla report_rollup desde facturas y gastos."""
+    written = _rebuild_report_rollups()
+    print(f'report_rollup reconstruida: {written} filas')
+
+
+# -----------------------------------------------------------------------------
+# Search index
+# -----------------------------------------------------------------------------
+# Una fila por cliente/factura/producto/gasto con el texto buscable normalizado
+# (minúsculas, sin acentos).  SQLite: tabla FTS5 con tokenizer ``trigram``;
+# Postgres: tabla normal con índice GIN ``gin_trgm_ops`` (pg_trgm).  Ambos
+# resuelven ``%texto%`` por índice, con la misma semántica que el ilike previo.
+SEARCH_ENTITIES = ('client', 'invoice', 'product', 'expense')
+_SEARCH_FIELDS = {
+    'client': ('name', 'cif', 'email', 'phone'),
+    'invoice': ('number', 'client_id'),
+    'product': ('model', 'category', 'sku'),
+    'expense': ('description', 'supplier', 'category'),
+}
+_search_index_ready = None
+
+
+def _search_normalize(value) -> str:
+    """Lowercase and strip accents (NFD, as in ``slugify``) for indexing/querying."""
+    value = unicodedata.normalize('NFD', str(value or ''))
+    return ''.join(c for c in value if not unicodedata.combining(c)).casefold()
+
+
+def _search_entity_of(obj):
+    for entity, model in (('client', Client), ('invoice', Invoice), ('product', Product), ('expense', Expense)):
+        if isinstance(obj, model):
+            return entity
+    return None
+
+
+def _search_index_ddl(dialect_name: str) -> list:
+    if dialect_name == 'sqlite':
+        return [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+            "entity UNINDEXED, entity_id UNINDEXED, title UNINDEXED, subtitle UNINDEXED, body, "
+            "tokenize='trigram')",
+        ]
+    return [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        'CREATE TABLE IF NOT EXISTS search_index ('
+        'entity VARCHAR(16) NOT NULL, entity_id INTEGER NOT NULL, title TEXT, subtitle TEXT, '
+        'body TEXT NOT NULL, PRIMARY KEY (entity, entity_id))',
+        'CREATE INDEX IF NOT EXISTS ix_search_index_body_trgm ON search_index USING gin (body gin_trgm_ops)',
+    ]
+
+
+def _search_index_rows(conn, entity: str, ids=None, client_ids=None) -> list:
+    """Build index rows for ``entity`` straight from the source tables (Core, no ORM)."""
+    if entity == 'client':
+        stmt = db.select(Client.id, Client.name, Client.cif, Client.email, Client.phone)
+        id_col = Client.id
+    elif entity == 'invoice':
+        stmt = (db.select(Invoice.id, Invoice.number, Client.name)
+                .join(Client, Client.id == Invoice.client_id))
+        id_col = Invoice.id
+    elif entity == 'product':
+        stmt = db.select(Product.id, Product.model, Product.category, Product.sku)
+        id_col = Product.id
+    else:
+        stmt = db.select(Expense.id, Expense.description, Expense.supplier, Expense.category)
+        id_col = Expense.id
+    if ids is not None and client_ids:
+        stmt = stmt.where(db.or_(id_col.in_(list(ids)), Invoice.client_id.in_(list(client_ids))))
+    elif ids is not None:
+        stmt = stmt.where(id_col.in_(list(ids)))
+    rows = []
+    for row in conn.execute(stmt):
+        row_id, *fields = row
+        title, subtitle = fields[0], fields[1]
+        rows.append({
+            'entity': entity, 'entity_id': row_id, 'title': title or '', 'subtitle': subtitle or '',
+            'body': _search_normalize(' '.join(str(f) for f in fields if f)),
+            'rowid': row_id * len(SEARCH_ENTITIES) + SEARCH_ENTITIES.index(entity),
+        })
+    return rows
+
+
+def _search_index_write(conn, rows: list, removed: list = ()) -> None:
+    """Upsert ``rows`` and delete ``removed`` ((entity, id) pairs) from search_index."""
+    sqlite = conn.dialect.name == 'sqlite'
+    drop = [{'entity': e, 'entity_id': i, 'rowid': i * len(SEARCH_ENTITIES) + SEARCH_ENTITIES.index(e)}
+            for e, i in removed]
+    if sqlite:
+        # FTS5 no tiene UPSERT: borrar por rowid (entity_id y tipo codificados) y reinsertar
+        stale = drop + rows
+        if stale:
+            conn.execute(text('DELETE FROM search_index WHERE rowid = :rowid'), stale)
+        if rows:
+            conn.execute(text(
+                'INSERT INTO search_index (rowid, entity, entity_id, title, subtitle, body) '
+                'VALUES (:rowid, :entity, :entity_id, :title, :subtitle, :body)'), rows)
+        return
+    if drop:
+        conn.execute(text('DELETE FROM search_index WHERE entity = :entity AND entity_id = :entity_id'), drop)
+    if rows:
+        conn.execute(text(
+            'INSERT INTO search_index (entity, entity_id, title, subtitle, body) '
+            'VALUES (:entity, :entity_id, :title, :subtitle, :body) '
+            'ON CONFLICT (entity, entity_id) DO UPDATE SET '
+            'title = EXCLUDED.title, subtitle = EXCLUDED.subtitle, body = EXCLUDED.body'), rows)
+
+
+def _search_index_available(conn) -> bool:
+    global _search_index_ready
+    if _search_index_ready is None:
+        _search_index_ready = inspect(conn).has_table('search_index')
+    return _search_index_ready
+
+
+@event.listens_for(db.session, 'after_flush')
+def _search_index_after_flush(session, flush_context):
+    """Keep search_index in the same transaction as the rows it mirrors."""
+    changed = {entity: set() for entity in SEARCH_ENTITIES}
+    removed = []
+    renamed_clients = set()
+    new = session.new
+    for obj in list(new) + [o for o in session.dirty if o not in new]:
+        entity = _search_entity_of(obj)
+        if entity is None:
+            continue
+        if obj not in new:
+            state = inspect(obj)
+            if not any(state.attrs[f].history.has_changes() for f in _SEARCH_FIELDS[entity]):
+                continue  # p. ej. stock_qty o paid: nada que reindexar
+            if entity == 'client':
+                renamed_clients.add(obj.id)
+        changed[entity].add(obj.id)
+    for obj in session.deleted:
+        entity = _search_entity_of(obj)
+        if entity is not None:
+            removed.append((entity, obj.id))
+    if not removed and not any(changed.values()):
+        return
+    conn = session.connection()
+    if not _search_index_available(conn):
+        return
+    rows = []
+    for entity, ids in changed.items():
+        if ids or (entity == 'invoice' and renamed_clients):
+            # Las facturas indexan el nombre del cliente: reindexarlas si cambia
+            rows += _search_index_rows(conn, entity, ids=ids, client_ids=renamed_clients if entity == 'invoice' else None)
+    _search_index_write(conn, rows, removed)
+
+
+def _ensure_search_index() -> None:
+    """Create search_index if missing (dev path; production uses Alembic 0007) and backfill it."""
+    global _search_index_ready
+    with db.engine.begin() as conn:
+        existed = inspect(conn).has_table('search_index')
+        for ddl in _search_index_ddl(conn.dialect.name):
+            conn.execute(text(ddl))
+    _search_index_ready = True
+    if not existed:
+        _rebuild_search_index()
+
+
+def _rebuild_search_index() -> int:
+    """Rebuild search_index from clients, invoices, products and expenses.  Returns rows written."""
+    written = 0
+    with db.engine.begin() as conn:
+        conn.execute(text('DELETE FROM search_index'))
+        for entity in SEARCH_ENTITIES:
+            rows = _search_index_rows(conn, entity)
+            _search_index_write(conn, rows)
+            written += len(rows)
+    return written
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Recalcula el índice de búsqueda (search_index)."""
+    written = _rebuild_search_index()
+    print(f'search_index reconstruido: {written} filas')
+
+
+def _search_conditions(q: str, dialect_name: str):
+    """WHERE fragment, params and score expression for a free-text query.
+
+    Each word must appear as a substring (AND).  Words of 3+ chars go through
+    the trigram index (FTS5 MATCH / pg_trgm ILIKE); shorter ones fall back to
+    a LIKE over the (small) index table.  Returns None when ``q`` has no words.
+    """
+    words = _search_normalize(q).split()
+    if not words:
+        return None
+    params = {}
+    where = []
+    escape = lambda w: w.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')  # noqa: E731
+    if dialect_name == 'sqlite':
+        long_words = [w for w in words if len(w) >= 3]
+        if long_words:
+            where.append('search_index MATCH :search_match')
+            params['search_match'] = ' '.join('"' + w.replace('"', '""') + '"' for w in long_words)
+        for i, w in enumerate(w for w in words if len(w) < 3):
+            where.append(f"body LIKE :search_w{i} ESCAPE '\\'")
+            params[f'search_w{i}'] = f'%{escape(w)}%'
+        score = '-bm25(search_index)' if long_words else '0.0'
+    else:
+        for i, w in enumerate(words):
+            where.append(f"body ILIKE :search_w{i} ESCAPE '\\'")
+            params[f'search_w{i}'] = f'%{escape(w)}%'
+        params['search_q'] = ' '.join(words)
+        score = 'word_similarity(:search_q, body)'
+    return ' AND '.join(where), params, score
+
+
+def _search_ids_select(entity: str, q: str):
+    """``SELECT entity_id`` over search_index for ``q``; for ``Model.id.in_(...)``."""
+    dialect_name = db.engine.dialect.name
+    cond = _search_conditions(q, dialect_name)
+    if cond is None:
+        return None
+    where, params, _ = cond
+    return (text(f'SELECT entity_id FROM search_index WHERE {where} AND entity = :search_entity')
+            .bindparams(search_entity=entity, **params)
+            .columns(db.column('entity_id', db.Integer)))
+
+
+@app.route('/api/search')
+@jwt_required()
+def search():
+    """Búsqueda unificada sobre clientes, facturas, productos y gastos.
+
+    Parámetros: ``q`` (texto; sin acentos ni mayúsculas), ``types`` (lista
+    separada por comas de client|invoice|product|expense), ``limit`` (≤ 100).
+    Devuelve los resultados ordenados por relevancia.
+    """
+    q = (request.args.get('q') or '').strip()
+    types = [t.strip() for t in (request.args.get('types') or '').split(',') if t.strip()]
+    if any(t not in SEARCH_ENTITIES for t in types):
+        return jsonify({'error': f"types inválido (usa {', '.join(SEARCH_ENTITIES)})"}), 400
+    limit = min(max(1, request.args.get('limit', type=int, default=20)), 100)
+    cond = _search_conditions(q, db.engine.dialect.name)
+    if cond is None:
+        return jsonify({'q': q, 'items': []})
+    where, params, score = cond
+    if types:
+        # valores ya validados contra SEARCH_ENTITIES
+        where += ' AND entity IN (' + ', '.join(f"'{t}'" for t in types) + ')'
+    rows = db.session.execute(text(
+        f'SELECT entity, entity_id, title, subtitle, {score} AS score FROM search_index '
+        f'WHERE {where} ORDER BY score DESC, entity_id DESC LIMIT :search_limit'),
+        {**params, 'search_limit': limit}).all()
+    return jsonify({'q': q, 'items': [
+        {'type': e, 'id': int(i), 'title': t, 'subtitle': st, 'score': round(float(sc or 0), 4)}
+        for e, i, t, st, sc in rows
+    ]})
+
+
 def _format_number_for_type(doc_type: str, sequence_number: int, year: int, month: int) -> str:
     """Return formatted number FAAMM### or PAAMM### depending on type.
 
@@ -648,128 +1266,625 @@ def _format_number_for_type(doc_type: str, sequence_number: int, year: int, mont
     return f"{prefix}{yy:02d}{mm:02d}{sequence_number:03d}"
 
 
+SEQUENCE_RETRIES = 8
+_SQLITE_UPSERT_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def _allocate_sequence(doc_type: str, year: int, month: int, count: int = 1) -> int:
+    """Reserve ``count`` consecutive numbers for (doc_type, year, month); return the last one.
+
+    One statement creates the row or increments it (``INSERT ... ON CONFLICT
+    DO UPDATE ... RETURNING``, SQLite >= 3.35 and Postgres), so there is no
+    read-then-write window and the first number of a month cannot be handed
+    out twice.  The row stays locked until the caller commits: a rollback
+    also returns the numbers, so invoices never leave gaps.  SQLite answers
+    "database is locked" when another writer holds the lock past the busy
+    timeout; the statement is retried with backoff.
+    """
+    table = DocumentSequence.__table__
+    dialect = db.session.get_bind().dialect.name
+    for attempt in range(SEQUENCE_RETRIES):
+        try:
+            if dialect == 'postgresql' or (dialect == 'sqlite' and _SQLITE_UPSERT_RETURNING):
+                insert = pg_insert if dialect == 'postgresql' else sqlite_insert
+                stmt = (insert(table)
+                        .values(doc_type=doc_type, year=year, month=month, last_number=count)
+                        .on_conflict_do_update(index_elements=['doc_type', 'year', 'month'],
+                                               set_={'last_number': table.c.last_number + count})
+                        .returning(table.c.last_number))
+                return db.session.execute(stmt).scalar_one()
+            return _allocate_sequence_fallback(doc_type, year, month, count)
+        except OperationalError as exc:
+            if dialect != 'sqlite' or 'locked' not in str(exc.orig) or attempt == SEQUENCE_RETRIES - 1:
+                raise
+            time.sleep(0.05 * (2 ** attempt))
+
+
+def _allocate_sequence_fallback(doc_type: str, year: int, month: int, count: int) -> int:
+    """UPDATE-then-SELECT for engines without upsert + RETURNING (the UPDATE takes the row/write lock)."""
+    where = dict(doc_type=doc_type, year=year, month=month)
+    bump = {DocumentSequence.last_number: DocumentSequence.last_number + count}
+    if not DocumentSequence.query.filter_by(**where).update(bump, synchronize_session=False):
+        try:
+            with db.session.begin_nested():
+                db.session.execute(DocumentSequence.__table__.insert().values(**where, last_number=count))
+            return count
+        except IntegrityError:
+            DocumentSequence.query.filter_by(**where).update(bump, synchronize_session=False)
+    return db.session.query(DocumentSequence.last_number).filter_by(**where).scalar()
+
+
 def _next_sequence_atomic(doc_type: str, at_date: datetime = None) -> str:
     """Atomically increment and return the next formatted number for a given type and current year/month."""
     at = at_date or datetime.utcnow()
-    y, m = at.year, at.month
-    # Locking approach: in SQLite rely on transaction; in Postgres, FOR UPDATE ideal (SQLAlchemy hint used).
-    seq = (DocumentSequence.query
-           .filter_by(doc_type=doc_type, year=y, month=m)
-           .with_for_update(nowait=False)
-           .first())
-    if not seq:
-        seq = DocumentSequence(doc_type=doc_type, year=y, month=m, last_number=0)
-        db.session.add(seq)
-        db.session.flush()
-    seq.last_number += 1
-    db.session.flush()
-    return _format_number_for_type(doc_type, seq.last_number, y, m)
+    return _format_number_for_type(doc_type, _allocate_sequence(doc_type, at.year, at.month), at.year, at.month)
+
+
+def _reserve_sequence_numbers(doc_type: str, at_date: datetime, count: int) -> list:
+    """Reserve ``count`` consecutive formatted numbers in one statement (batch creation)."""
+    if count <= 0:
+        return []
+    last = _allocate_sequence(doc_type, at_date.year, at_date.month, count)
+    return [_format_number_for_type(doc_type, n, at_date.year, at_date.month) for n in range(last - count + 1, last + 1)]
+
 
+def _generate_invoice_pdf_reportlab(invoice: 'Invoice', client: 'Client', company, items) -> bytes:
+    """Draw the invoice with ReportLab, mirroring templates/invoice_template.html.
 
-def _generate_pdf_fallback(invoice: 'Invoice', client: 'Client', company: 'CompanyConfig', items) -> bytes:
-    """Generate a very simple PDF using ReportLab as a last-resort fallback.
-    Avoids external binaries. Intended only when WeasyPrint/pdfkit are unavailable.
+    Pure Python (no external binaries): header with document type, number box
+    and logo, client/issuer blocks, line table, payment conditions, VAT and
+    total box, notes and footer.  Selected with PDF_ENGINE=reportlab and also
+    used as fallback when wkhtmltopdf fails.
     """
     if not reportlab_available:
         abort(500, description='No hay motor PDF disponible. Instale wkhtmltopdf o WeasyPrint.')
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
+    # 1 px CSS (96 dpi) = 0.75 pt: los tamaños replican los de la plantilla HTML
+    base = ParagraphStyle('inv-base', fontName='Helvetica', fontSize=9, leading=11.25, textColor=colors.HexColor('#333333'))
+    bold = ParagraphStyle('inv-bold', parent=base, fontName='Helvetica-Bold')
+    right = ParagraphStyle('inv-right', parent=base, alignment=TA_RIGHT)
+    center = ParagraphStyle('inv-center', parent=base, alignment=TA_CENTER)
+    doc_type_style = ParagraphStyle('inv-doctype', parent=bold, fontSize=21, leading=25)
+    block_title = ParagraphStyle('inv-block-title', parent=bold, fontSize=10.5, leading=13, spaceAfter=4.5)
+    footer_style = ParagraphStyle('inv-footer', parent=center, fontSize=7.5, leading=9, textColor=colors.HexColor('#555555'))
 
-    y = height - 20 * mm
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(20 * mm, y, f"{company.name if company and getattr(company, 'name', None) else 'Empresa'}")
-    y -= 8 * mm
-    c.setFont("Helvetica", 10)
-    if company:
-        c.drawString(20 * mm, y, f"CIF: {company.cif or ''}  Tel: {company.phone or ''}")
-        y -= 6 * mm
-        c.drawString(20 * mm, y, f"{company.address or ''}")
-        y -= 10 * mm
-
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(20 * mm, y, f"{invoice.type.title()} {invoice.number}")
-    y -= 6 * mm
-    c.setFont("Helvetica", 10)
-    c.drawString(20 * mm, y, f"Fecha: {invoice.date.isoformat()}")
-    y -= 10 * mm
-
-    c.setFont("Helvetica-Bold", 11)
-    c.drawString(20 * mm, y, "Cliente")
-    y -= 6 * mm
-    c.setFont("Helvetica", 10)
-    c.drawString(20 * mm, y, f"{client.name}  CIF: {client.cif}")
-    y -= 6 * mm
-    c.drawString(20 * mm, y, f"{client.address}")
-    y -= 10 * mm
-
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(20 * mm, y, "Descripción")
-    c.drawString(110 * mm, y, "Unidades")
-    c.drawString(140 * mm, y, "Precio")
-    c.drawString(170 * mm - 10 * mm, y, "IVA%")
-    y -= 5 * mm
-    c.line(20 * mm, y, 190 * mm, y)
-    y -= 5 * mm
-    c.setFont("Helvetica", 10)
-    subtotal_sum, tax_sum, total_sum = calculate_totals([
-        {
-            'units': it.units,
-            'unit_price': it.unit_price,
-            'tax_rate': it.tax_rate,
-        } for it in items
-    ])
+    def esc(value) -> str:
+        return xml_escape('' if value is None else str(value))
+
+    def multiline(value) -> str:
+        return '<br/>'.join(esc(line.strip()) for line in str(value or '').split('\n'))
+
+    def money(value) -> str:
+        return f"{float(value or 0):.2f} €"
+
+    buffer = io.BytesIO()
+    margin = 19.05 * mm + 10 * mm  # márgenes de wkhtmltopdf (0.75in) + body { margin: 1cm }
+    doc = SimpleDocTemplate(
+        buffer, pagesize=A4, leftMargin=margin, rightMargin=margin, topMargin=margin, bottomMargin=margin,
+        title=f"{invoice.type} {invoice.number}", author=getattr(company, 'name', '') or '',
+    )
+    width = doc.width
+    story = []
+
+    # Cabecera: tipo + caja de número/fecha a la izquierda, logo a la derecha
+    number_box = Table(
+        [[Paragraph(f'<b>Nº:</b> {esc(invoice.number)}', base)],
+         [Paragraph(f"<b>Fecha:</b> {invoice.date.strftime('%d/%m/%Y')}", base)]],
+        colWidths=[180 * 0.75], hAlign='LEFT',
+        style=[('BOX', (0, 0), (-1, -1), 1.5, colors.black),
+               ('LEFTPADDING', (0, 0), (-1, -1), 7.5), ('RIGHTPADDING', (0, 0), (-1, -1), 7.5),
+               ('TOPPADDING', (0, 0), (0, 0), 4.5), ('BOTTOMPADDING', (0, -1), (0, -1), 4.5),
+               ('TOPPADDING', (0, 1), (-1, -1), 0), ('BOTTOMPADDING', (0, 0), (-1, -2), 0)],
+    )
+    left_header = [Paragraph(esc((invoice.type or '').upper()), doc_type_style), Spacer(1, 3), number_box]
+    logo = ''
+    if os.path.isfile(INVOICE_LOGO_PATH):
+        try:
+            img_w, img_h = ImageReader(INVOICE_LOGO_PATH).getSize()
+            logo_w = 180 * 0.75
+            logo = Image(INVOICE_LOGO_PATH, width=logo_w, height=logo_w * img_h / img_w)
+            logo.hAlign = 'RIGHT'
+        except Exception:
+            logo = ''
+    story.append(Table(
+        [[left_header, logo]], colWidths=[width - 180 * 0.75, 180 * 0.75], rowHeights=[max(140 * 0.75, 0)],
+        style=[('VALIGN', (0, 0), (-1, -1), 'TOP'), ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
+               ('LEFTPADDING', (0, 0), (-1, -1), 0), ('RIGHTPADDING', (0, 0), (-1, -1), 0),
+               ('TOPPADDING', (0, 0), (-1, -1), 0), ('BOTTOMPADDING', (0, 0), (-1, -1), 0)],
+    ))
+    story.append(Spacer(1, 0.4 * cm))
+
+    # Datos del cliente y del emisor (columna de texto de ~260px como en la plantilla)
+    col_w = width / 2
+    indent = max(0, col_w - 260 * 0.75 - 6)
+    left_p = ParagraphStyle('inv-info-left', parent=base, rightIndent=indent)
+    right_p = ParagraphStyle('inv-info-right', parent=right, leftIndent=indent)
+    client_block = [Paragraph('DATOS DEL CLIENTE', block_title),
+                    Paragraph(f'<b>{esc(client.name)}</b>', left_p),
+                    Paragraph(f'CIF: {esc(client.cif)}', left_p),
+                    Paragraph(esc(client.address), left_p),
+                    Paragraph(esc(client.email), left_p),
+                    Paragraph(esc(client.phone), left_p)]
+    if getattr(client, 'iban', None):
+        client_block.append(Paragraph(f'IBAN: {esc(client.iban)}', left_p))
+    company_block = [Paragraph('DATOS DEL EMISOR', ParagraphStyle('inv-block-title-r', parent=block_title, alignment=TA_RIGHT)),
+                     Paragraph(f'<b>{esc(company.name)}</b>', right_p),
+                     Paragraph(f'CIF: {esc(company.cif)}', right_p),
+                     Paragraph(esc(_compose_company_address(company)), right_p),
+                     Paragraph(esc(company.email), right_p),
+                     Paragraph(esc(company.phone), right_p)]
+    if getattr(company, 'iban', None):
+        company_block.append(Paragraph(f'IBAN: {esc(company.iban)}', right_p))
+    story.append(Table(
+        [[client_block, company_block]], colWidths=[col_w, col_w],
+        style=[('VALIGN', (0, 0), (-1, -1), 'TOP'),
+               ('LEFTPADDING', (0, 0), (-1, -1), 3), ('RIGHTPADDING', (0, 0), (-1, -1), 3),
+               ('TOPPADDING', (0, 0), (-1, -1), 0), ('BOTTOMPADDING', (0, 0), (-1, -1), 0)],
+    ))
+    story.append(Spacer(1, 0.6 * cm))
+    story.append(HRFlowable(width='100%', thickness=0.75, color=colors.black, spaceBefore=0.35 * cm, spaceAfter=0.2 * cm))
+
+    # Detalle de conceptos (cabecera repetida en cada página)
+    rows = [[Paragraph('<b>Detalle</b>', base), Paragraph('<b>Unidades</b>', base), Paragraph('<b>Subtotal</b>', base),
+             Paragraph('<b>IVA</b>', base), Paragraph('<b>Total</b>', right)]]
     for it in items:
-        if y < 30 * mm:
-            c.showPage()
-            y = height - 20 * mm
-            c.setFont("Helvetica", 10)
-        
-        # Manejar saltos de línea en la descripción
-        description_lines = (it.description or '').split('\n')
-        first_line = True
-        
-        for line in description_lines:
-            if y < 30 * mm:
-                c.showPage()
-                y = height - 20 * mm
-                c.setFont("Helvetica", 10)
-            
-            # Solo mostrar datos numéricos en la primera línea
-            if first_line:
-                c.drawString(20 * mm, y, line[:80])
-                c.drawRightString(135 * mm, y, f"{it.units}")
-                c.drawRightString(165 * mm, y, f"{it.unit_price:.2f} €")
-                c.drawRightString(190 * mm, y, f"{it.tax_rate:.2f}")
-                first_line = False
-            else:
-                # Líneas adicionales solo con texto de descripción
-                c.drawString(20 * mm, y, line[:80])
-            
-            y -= 6 * mm
-
-    y -= 6 * mm
-    c.line(120 * mm, y, 190 * mm, y)
-    y -= 8 * mm
-    c.setFont("Helvetica-Bold", 11)
-    c.drawRightString(165 * mm, y, "Subtotal:")
-    c.drawRightString(190 * mm, y, f"{subtotal_sum:.2f} €")
-    y -= 6 * mm
-    c.setFont("Helvetica", 11)
-    c.drawRightString(165 * mm, y, "Impuestos:")
-    c.drawRightString(190 * mm, y, f"{tax_sum:.2f} €")
-    y -= 6 * mm
-    c.setFont("Helvetica-Bold", 12)
-    c.drawRightString(165 * mm, y, "Total:")
-    c.drawRightString(190 * mm, y, f"{total_sum:.2f} €")
-
-    c.showPage()
-    c.save()
+        rows.append([
+            Paragraph(multiline(it.description), base),
+            Paragraph(esc(it.units), center),
+            Paragraph(money(it.units * it.unit_price), right),
+            Paragraph(f"{float(it.tax_rate or 0):.0f}%", center),
+            Paragraph(money(it.total), right),
+        ])
+    story.append(Table(
+        rows, colWidths=[width * f for f in (0.5, 0.1, 0.15, 0.1, 0.15)], repeatRows=1,
+        style=[('VALIGN', (0, 0), (-1, -1), 'TOP'),
+               ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f2f2f2')),
+               ('LINEBELOW', (0, 0), (-1, 0), 0.75, colors.black),
+               ('LINEBELOW', (0, 1), (-1, -1), 0.75, colors.HexColor('#dddddd')),
+               ('LEFTPADDING', (0, 0), (-1, -1), 4.5), ('RIGHTPADDING', (0, 0), (-1, -1), 4.5),
+               ('LEFTPADDING', (1, 0), (1, -1), 1), ('RIGHTPADDING', (1, 0), (1, -1), 1),
+               ('TOPPADDING', (0, 0), (-1, -1), 4.5), ('BOTTOMPADDING', (0, 0), (-1, -1), 4.5)],
+    ))
+
+    # Totales y condiciones de pago (mitad derecha).  Con varios tipos de IVA
+    # se desglosa la cuota por tipo; con uno solo queda igual que la plantilla.
+    totals_block = []
+    if invoice.type == 'factura':
+        totals_block.append(Paragraph('CONDICIONES DE PAGO:', ParagraphStyle('inv-pay-title', parent=bold, spaceAfter=4 * mm)))
+        totals_block.append(Paragraph(esc((invoice.payment_method or 'EFECTIVO').upper()),
+                                      ParagraphStyle('inv-pay', parent=base, fontSize=10.5, leading=13, spaceAfter=6 * mm)))
+    tax_by_rate = {}
+    for it in items:
+        rate = float(it.tax_rate or 0)
+        tax_by_rate[rate] = tax_by_rate.get(rate, 0.0) + it.units * it.unit_price * rate / 100
+    totals_rows = []
+    if len(tax_by_rate) > 1:
+        for rate in sorted(tax_by_rate):
+            totals_rows.append([Paragraph(f'IVA {rate:.0f}%:', base), Paragraph(money(tax_by_rate[rate]), right)])
+    totals_rows.append([Paragraph('IVA:', base), Paragraph(money(invoice.tax_total), right)])
+    totals_rows.append([Paragraph('<b>TOTAL:</b>', base), Paragraph(f'<b>{money(invoice.total)}</b>', right)])
+    totals_block.append(Table(
+        totals_rows, colWidths=[col_w / 2, col_w / 2],
+        style=[('BOX', (0, 0), (-1, -1), 1.5, colors.black),
+               ('LINEBELOW', (0, 0), (-1, -2), 0.75, colors.HexColor('#dddddd')),
+               ('LEFTPADDING', (0, 0), (-1, -1), 4.5), ('RIGHTPADDING', (0, 0), (-1, -1), 4.5),
+               ('TOPPADDING', (0, 0), (-1, -1), 4.5), ('BOTTOMPADDING', (0, 0), (-1, -1), 4.5)],
+    ))
+    story.append(Spacer(1, 1 * cm))
+    story.append(Table(
+        [['', totals_block]], colWidths=[col_w, col_w],
+        style=[('VALIGN', (0, 0), (-1, -1), 'TOP'),
+               ('LEFTPADDING', (0, 0), (-1, -1), 0), ('RIGHTPADDING', (0, 0), (-1, -1), 0),
+               ('TOPPADDING', (0, 0), (-1, -1), 0), ('BOTTOMPADDING', (0, 0), (-1, -1), 0)],
+    ))
+
+    if invoice.notes:
+        story.append(Spacer(1, 0.5 * cm))
+        story.append(Paragraph(f'<b>Observaciones:</b> {multiline(invoice.notes)}', base))
+
+    story.append(Spacer(1, 2 * cm))
+    story.append(Paragraph(esc(getattr(company, 'website', '') or ''), footer_style))
+
+    doc.build(story)
     pdf_bytes = buffer.getvalue()
     buffer.close()
     return pdf_bytes
 
 
+INVOICE_TEMPLATE_PATH = os.path.join(app.root_path, 'templates', 'invoice_template.html')
+INVOICE_LOGO_PATH = os.path.join(STATIC_FOLDER, 'logo_invoice.png')
+
+
+def _file_mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
+def _invoice_pdf_cache_key(invoice: 'Invoice', client: 'Client', company, items) -> str:
+    """Return a SHA-256 of everything that ends up in the invoice PDF.
+
+    Includes the invoice, its lines, the client, the company data and the
+    mtimes of the HTML template and the logo.  Any change produces a new key,
+    so an outdated PDF is never served even if an invalidation is missed.
+    """
+    payload = {
+        'invoice': [
+            invoice.id, invoice.number, invoice.date, invoice.type, invoice.client_id,
+            invoice.notes, invoice.payment_method, invoice.total, invoice.tax_total,
+        ],
+        'items': [
+            [it.description, it.units, it.unit_price, it.tax_rate, it.subtotal, it.total]
+            for it in items
+        ],
+        'client': [
+            getattr(client, f, None) for f in ('name', 'cif', 'address', 'email', 'phone', 'iban')
+        ],
+        'company': [
+            getattr(company, f, None)
+            for f in ('name', 'cif', 'address', 'city', 'province', 'email', 'phone', 'iban', 'website')
+        ],
+        'engine': PDF_ENGINE,
+        'template': _file_mtime(INVOICE_TEMPLATE_PATH),
+        'logo': _file_mtime(INVOICE_LOGO_PATH),
+    }
+    raw = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _invoice_pdf_cache_path(invoice_id: int, cache_key: str) -> str:
+    return os.path.join(PDF_CACHE_DIR, str(invoice_id), f'{cache_key}.pdf')
+
+
+def _store_invoice_pdf_cache(invoice_id: int, cache_key: str, pdf_bytes: bytes):
+    """Write a rendered PDF into the cache and drop older entries of the same invoice.
+
+    Returns the cached path, or None if the cache could not be written.
+    """
+    path = _invoice_pdf_cache_path(invoice_id, cache_key)
+    folder = os.path.dirname(path)
+    try:
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = f'{path}.{uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, path)
+        for name in os.listdir(folder):
+            if name.endswith('.pdf') and name != os.path.basename(path):
+                os.remove(os.path.join(folder, name))
+        return path
+    except OSError as e:
+        app.logger.warning(f'No se pudo escribir la caché PDF de la factura {invoice_id}: {e}')
+        return None
+
+
+def _invalidate_invoice_pdf_cache(*invoice_ids: int) -> None:
+    """Remove cached PDFs for the given invoices (best-effort)."""
+    for invoice_id in invoice_ids:
+        shutil.rmtree(os.path.join(PDF_CACHE_DIR, str(invoice_id)), ignore_errors=True)
+
+
+def _clear_invoice_pdf_cache() -> None:
+    """Remove every cached invoice PDF (e.g. after company data changes)."""
+    try:
+        for name in os.listdir(PDF_CACHE_DIR):
+            shutil.rmtree(os.path.join(PDF_CACHE_DIR, name), ignore_errors=True)
+    except OSError:
+        pass
+
+
+# Los datos de empresa se editan también desde scripts (seed_company.py), por eso
+# la invalidación se engancha al modelo y no a un endpoint concreto.
+@event.listens_for(CompanyConfig, 'after_insert')
+@event.listens_for(CompanyConfig, 'after_update')
+@event.listens_for(CompanyConfig, 'after_delete')
+def _company_config_changed(mapper, connection, target):
+    _clear_invoice_pdf_cache()
+
+
+INVOICE_PDF_OPTIONS = {
+    'enable-local-file-access': None,
+    'page-size': 'A4',
+    'margin-top': '0.75in',
+    'margin-right': '0.75in',
+    'margin-bottom': '0.75in',
+    'margin-left': '0.75in',
+    'encoding': 'UTF-8',
+    'no-outline': None,
+    'print-media-type': None,
+    'disable-smart-shrinking': None,
+    'zoom': 1.0,
+    'dpi': 96,
+    'image-quality': 94,
+    'minimum-font-size': 12,
+    'enable-plugins': None,
+    'load-error-handling': 'ignore',
+    'load-media-error-handling': 'ignore'
+}
+
+
+def _render_invoice_html(invoice: 'Invoice', client: 'Client', company, items) -> str:
+    """Render invoice_template.html for the given invoice (requires app context)."""
+    # Build absolute file URI for logo to avoid network issues in wkhtmltopdf
+    # Use a proper file URI (file:///C:/...) and forward slashes
+    logo_path = INVOICE_LOGO_PATH
+    try:
+        logo_uri = Path(logo_path).resolve().as_uri()
+    except Exception:
+        logo_uri = 'file:///' + logo_path.replace('\\', '/')
+    return render_template(
+        'invoice_template.html',
+        invoice=invoice,
+        client=client,
+        company=company,
+        items=items,
+        logo_uri=logo_uri,
+        company_address_line=_compose_company_address(company),
+    )
+
+
+def _invoice_pdf_snapshot(invoice: 'Invoice', client: 'Client', company, items) -> dict:
+    """Plain, picklable copy of the data the ReportLab fallback needs.
+
+    The render pool runs in separate processes, so ORM objects cannot be sent.
+    """
+    def _ns(obj, fields):
+        return SimpleNamespace(**{f: getattr(obj, f, None) for f in fields})
+    return {
+        'invoice': _ns(invoice, ('id', 'number', 'date', 'type', 'notes', 'payment_method', 'total', 'tax_total')),
+        'client': _ns(client, ('name', 'cif', 'address', 'email', 'phone', 'iban')),
+        'company': _ns(company, ('name', 'cif', 'address', 'city', 'province', 'email', 'phone', 'iban', 'website')),
+        'items': [_ns(it, ('description', 'units', 'unit_price', 'tax_rate', 'subtotal', 'total')) for it in items],
+    }
+
+
+def _html_to_pdf(html: str, options: dict) -> bytes:
+    """Convert HTML to PDF with wkhtmltopdf.  Runs inside the render pool."""
+    if pdfkit is None:
+        raise RuntimeError('pdfkit no disponible')
+    cfg = _resolve_pdfkit_configuration()
+    return pdfkit.from_string(html, False, options=options, configuration=cfg)
+
+
+def _invoice_snapshot_to_pdf(snapshot: dict) -> bytes:
+    """ReportLab render job for an invoice snapshot."""
+    return _generate_invoice_pdf_reportlab(snapshot['invoice'], snapshot['client'], snapshot['company'], snapshot['items'])
+
+
+def _invoice_html_to_pdf(html: str, snapshot: dict) -> bytes:
+    """Invoice render job: wkhtmltopdf first, ReportLab if it fails."""
+    # Usar solo wkhtmltopdf para consistencia dev/prod
+    pdf_bytes = None
+    if pdfkit is not None:
+        try:
+            pdf_bytes = _html_to_pdf(html, INVOICE_PDF_OPTIONS)
+        except Exception:
+            pdf_bytes = None
+
+    # Fallback solo si wkhtmltopdf falla
+    if pdf_bytes is None:
+        pdf_bytes = _invoice_snapshot_to_pdf(snapshot)
+    return pdf_bytes
+
+
+# -----------------------------------------------------------------------------
+# PDF render pool
+#
+# wkhtmltopdf tarda ~1 s por documento.  Para que un pico de PDFs no bloquee
+# los workers de gunicorn, la conversión se delega a un pool de procesos con
+# cola acotada.  El hilo de la petición solo espera al resultado (las demás
+# peticiones CRUD las atienden otros hilos: ver --threads en Dockerfile.backend).
+# PDF_RENDER_WORKERS=0 desactiva el pool y renderiza en línea.
+
+PDF_RENDER_WORKERS = int(os.getenv('PDF_RENDER_WORKERS', '2'))
+PDF_RENDER_QUEUE_MAX = int(os.getenv('PDF_RENDER_QUEUE_MAX', '16'))
+PDF_RENDER_TIMEOUT = int(os.getenv('PDF_RENDER_TIMEOUT', '120'))
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+_pdf_queue_slots = threading.BoundedSemaphore(max(1, PDF_RENDER_QUEUE_MAX))
+
+
+def _pdf_pool_context():
+    """Start method for the render pool's processes.
+
+    ``fork`` evita reimportar app.py en cada hijo, pero solo mientras el
+    proceso tiene un único hilo (``warm_pdf_render_pool`` desde el hook
+    ``post_worker_init`` de gunicorn.conf.py): un fork con otros hilos vivos
+    (los de ``--threads``, el de variantes de imágenes) puede heredar tomados
+    los locks de logging, del pool de SQLAlchemy o de importación y bloquear
+    a los hijos.  En otro caso, ``forkserver`` (o ``spawn``).
+    """
+    if hasattr(os, 'fork') and threading.active_count() == 1:
+        return multiprocessing.get_context('fork')
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _get_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=max(1, PDF_RENDER_WORKERS), mp_context=_pdf_pool_context())
+        return _pdf_pool
+
+
+def _discard_pdf_pool(pool, shutdown: bool = True) -> None:
+    """Forget ``pool`` if it is still the current one, so the next render builds a fresh pool.
+
+    Un hijo muerto (OOM, wkhtmltopdf que revienta, SIGKILL) deja el pool
+    roto para siempre: sin esto, cada render posterior del worker fallaría
+    con ``BrokenProcessPool``.  Desde el callback de un Future (hilo de
+    gestión del pool) no se llama a ``shutdown``: ese hilo ya termina los
+    procesos restantes.
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not pool:
+            return
+        _pdf_pool = None
+    app.logger.warning('Pool de render PDF roto (proceso hijo terminado); se crea uno nuevo')
+    if shutdown:
+        pool.shutdown(wait=False)
+
+
+def warm_pdf_render_pool() -> None:
+    """Create the render pool and start its processes now (gunicorn ``post_worker_init``)."""
+    if PDF_RENDER_WORKERS > 0:
+        _get_pdf_pool().submit(int).result(timeout=PDF_RENDER_TIMEOUT)
+
+
+def _submit_pdf_render(fn, *args) -> Future:
+    """Queue ``fn(*args)`` on the render pool and return its Future.
+
+    Aborts with 503 when the queue is full instead of piling up requests.
+    A broken pool is replaced and the job resubmitted once; a job that
+    fails with ``BrokenProcessPool`` also discards its pool (not retried:
+    the document may be what killed the child).
+    """
+    if PDF_RENDER_WORKERS <= 0:
+        fut = Future()
+        try:
+            fut.set_result(fn(*args))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+    if not _pdf_queue_slots.acquire(blocking=False):
+        abort(503, description='Cola de generación de PDF llena; reintenta en unos segundos')
+    try:
+        pool = _get_pdf_pool()
+        try:
+            fut = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            _discard_pdf_pool(pool)
+            pool = _get_pdf_pool()
+            fut = pool.submit(fn, *args)
+    except Exception:
+        _pdf_queue_slots.release()
+        raise
+
+    def _done(f):
+        _pdf_queue_slots.release()
+        if not f.cancelled() and isinstance(f.exception(), BrokenProcessPool):
+            _discard_pdf_pool(pool, shutdown=False)
+
+    fut.add_done_callback(_done)
+    return fut
+
+
+def _render_pdf(fn, *args) -> bytes:
+    """Run a render job on the pool and wait for its result."""
+    return _submit_pdf_render(fn, *args).result(timeout=PDF_RENDER_TIMEOUT)
+
+
+def _invoice_render_job(invoice: 'Invoice', client: 'Client', company, items):
+    """Return ``(fn, args)`` to render an invoice with the configured PDF_ENGINE.
+
+    The HTML template is rendered here (needs the app context); the
+    conversion itself is what runs on the pool.
+    """
+    snapshot = _invoice_pdf_snapshot(invoice, client, company, items)
+    if PDF_ENGINE == 'reportlab':
+        return _invoice_snapshot_to_pdf, (snapshot,)
+    return _invoice_html_to_pdf, (_render_invoice_html(invoice, client, company, items), snapshot)
+
+
+def _render_invoice_pdf(invoice: 'Invoice', client: 'Client', company, items) -> bytes:
+    """Render an invoice to PDF bytes on the render pool."""
+    fn, args = _invoice_render_job(invoice, client, company, items)
+    return _render_pdf(fn, *args)
+
+
+def _pdf_job_id(invoice_id: int, cache_key: str) -> str:
+    return f'{invoice_id}-{cache_key}'
+
+
+def _pdf_job_marker(invoice_id: int, cache_key: str, suffix: str) -> str:
+    return os.path.join(PDF_CACHE_DIR, str(invoice_id), f'{cache_key}.{suffix}')
+
+
+def _pdf_job_status(invoice_id: int, cache_key: str):
+    """Return (status, detail) for a render job using the files in the cache.
+
+    State lives on disk so any gunicorn worker can answer the poll.
+    """
+    if os.path.isfile(_invoice_pdf_cache_path(invoice_id, cache_key)):
+        return 'done', None
+    error_path = _pdf_job_marker(invoice_id, cache_key, 'error')
+    if os.path.isfile(error_path):
+        try:
+            with open(error_path, 'r', encoding='utf-8') as f:
+                return 'error', f.read()
+        except OSError:
+            return 'error', None
+    pending_path = _pdf_job_marker(invoice_id, cache_key, 'pending')
+    if os.path.isfile(pending_path):
+        if time.time() - _file_mtime(pending_path) > PDF_RENDER_TIMEOUT:
+            return 'error', 'timeout'
+        return 'pending', None
+    return None, None
+
+
+def _enqueue_invoice_pdf_job(invoice: 'Invoice', client: 'Client', company, items, cache_key: str) -> None:
+    """Start rendering an invoice PDF in the background; the result lands in the cache."""
+    pending_path = _pdf_job_marker(invoice.id, cache_key, 'pending')
+    error_path = _pdf_job_marker(invoice.id, cache_key, 'error')
+    os.makedirs(os.path.dirname(pending_path), exist_ok=True)
+    fn, args = _invoice_render_job(invoice, client, company, items)
+    invoice_id = invoice.id
+
+    def _on_done(fut: Future):
+        try:
+            _store_invoice_pdf_cache(invoice_id, cache_key, fut.result())
+        except Exception as e:
+            app.logger.error(f'Error renderizando PDF de la factura {invoice_id}: {e}')
+            try:
+                with open(error_path, 'w', encoding='utf-8') as f:
+                    f.write(str(e) or e.__class__.__name__)
+            except OSError:
+                pass
+        finally:
+            try:
+                os.remove(pending_path)
+            except OSError:
+                pass
+
+    if os.path.exists(error_path):
+        os.remove(error_path)
+    with open(pending_path, 'w', encoding='utf-8') as f:
+        f.write(datetime.utcnow().isoformat())
+    try:
+        fut = _submit_pdf_render(fn, *args)
+    except Exception:
+        os.remove(pending_path)
+        raise
+    fut.add_done_callback(_on_done)
+
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Write-only sink that lets ``zipfile`` stream into a response generator.
+
+    It is not seekable, so ZipFile writes data descriptors and never needs
+    to rewind: each ``pop()`` hands out the bytes written so far.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def pop(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
 # -----------------------------------------------------------------------------
 # Routes
 #
@@ -793,6 +1908,17 @@ with app.app_context():
             # Evitar bloquear el arranque si hay desajustes temporales de esquema
             app.logger.warning('db.create_all() falló; confía en Alembic para crear/esquema')
             db.session.rollback()
+        # Tabla de agregados recién creada sobre una base con datos: rellenarla
+        try:
+            if (ReportRollup.query.first() is None
+                    and (Invoice.query.first() is not None or Expense.query.first() is not None)):
+                _rebuild_report_rollups()
+        except Exception:
+            db.session.rollback()
+        try:
+            _ensure_search_index()
+        except Exception:
+            app.logger.warning('No se pudo crear search_index; usa Alembic 0007 o flask rebuild-search-index')
 
     # Migración ligera (solo en desarrollo o si se permite explícitamente)
     if (app_env != 'production' and allow_runtime_migrations) or allow_create_all:
@@ -802,6 +1928,23 @@ with app.app_context():
             if 'is_active' not in cols:
                 db.session.execute(text("ALTER TABLE product ADD COLUMN is_active BOOLEAN DEFAULT 1"))
                 db.session.commit()
+            doc_cols = [c['name'] for c in insp.get_columns('client_document')]
+            if 'sha256' not in doc_cols:
+                db.session.execute(text("ALTER TABLE client_document ADD COLUMN sha256 VARCHAR(64)"))
+                db.session.commit()
+            seq_indexes = {ix['name'] for ix in insp.get_indexes('document_sequence')}
+            if 'uq_docseq_type_year_month' not in seq_indexes:
+                # Fusionar duplicados por periodo (queda el mayor contador) antes del índice único
+                db.session.execute(text(
+                    "UPDATE document_sequence SET last_number = (SELECT MAX(s2.last_number) FROM document_sequence s2 "
+                    "WHERE s2.doc_type = document_sequence.doc_type AND s2.year = document_sequence.year "
+                    "AND s2.month = document_sequence.month)"))
+                db.session.execute(text(
+                    "DELETE FROM document_sequence WHERE id NOT IN (SELECT MIN(id) FROM document_sequence "
+                    "GROUP BY doc_type, year, month)"))
+                db.session.execute(text(
+                    "CREATE UNIQUE INDEX uq_docseq_type_year_month ON document_sequence (doc_type, year, month)"))
+                db.session.commit()
         except Exception:
             # No bloquear arranque si falla la migración ligera
             db.session.rollback()
@@ -847,6 +1990,18 @@ def create_client():
     return jsonify({'id': client.id}), 201
 
 
+def _clients_query(args):
+    """Client query with the listing filters (``q``); shared by list and exports."""
+    query = Client.query
+    q = (args.get('q') or '').strip()
+    if q:
+        # Índice de búsqueda (nombre/cif/email/teléfono, sin acentos)
+        ids = _search_ids_select('client', q)
+        if ids is not None:
+            query = query.filter(Client.id.in_(ids))
+    return query
+
+
 @app.route('/api/clients', methods=['GET'])
 @jwt_required()
 def list_clients():
@@ -855,13 +2010,12 @@ def list_clients():
     Parámetros opcionales:
       - limit (int): número máximo de elementos
       - offset (int): desplazamiento
+      - cursor (str): paginación keyset (ver ``_paginate_listing``); ignora offset
+      - include_total (0|1): 0 omite el COUNT(*)
       - q (str): término de búsqueda en nombre/cif/email/teléfono
       - sort (str): campo de ordenación (id, name, created_at, email, phone)
       - dir (str): dirección 'asc'|'desc' (por defecto 'desc')
     """
-    limit = request.args.get('limit', type=int, default=10)
-    offset = request.args.get('offset', type=int, default=0)
-    q = (request.args.get('q') or '').strip()
     sort = (request.args.get('sort') or 'created_at').strip()
     direction = (request.args.get('dir') or 'desc').strip().lower()
 
@@ -871,25 +2025,11 @@ def list_clients():
     if direction not in {'asc', 'desc'}:
         direction = 'desc'
 
-    query = Client.query
-    if q:
-        like = f"%{q}%"
-        query = query.filter(
-            db.or_(
-                Client.name.ilike(like),
-                Client.cif.ilike(like),
-                Client.email.ilike(like),
-                Client.phone.ilike(like),
-            )
-        )
-
-    sort_col = getattr(Client, sort)
-    if direction == 'desc':
-        sort_col = sort_col.desc()
-    query = query.order_by(sort_col)
-
-    total = query.count()
-    clients = query.offset(offset).limit(limit).all()
+    query = _clients_query(request.args)
+    try:
+        clients, page = _paginate_listing(query, Client, sort, direction, request.args)
+    except ValueError:
+        return jsonify({'error': 'cursor inválido'}), 400
 
     items = []
     for c in clients:
@@ -903,53 +2043,66 @@ def list_clients():
             'iban': c.iban,
             'created_at': c.created_at.isoformat() if getattr(c, 'created_at', None) else None,
         })
-    return jsonify({'items': items, 'total': total})
+    return jsonify({'items': items, **page})
 
 
-@app.route('/api/invoices', methods=['POST'])
-@jwt_required()
-def create_invoice():
-    """Create a new invoice or proforma and its items.
+def _invoice_values(payload: 'InvoiceCreateRequest') -> tuple:
+    """Column values of a new invoice (without ``number``) and its item rows (without ``invoice_id``).
 
-    Número se asigna automáticamente según el tipo.
+    Normaliza la forma de pago (solo facturas; por defecto efectivo), fuerza
+    ``paid=False`` en proformas y calcula los totales.
     """
-    try:
-        payload = InvoiceCreateRequest.model_validate(request.get_json(force=True))
-    except PydValidationError as e:
-        return jsonify({"error": e.errors()[0]['msg'] if e.errors() else 'invalid payload', "code": 400}), 400
-    date_str = payload.date
     invoice_type = payload.type
-    client_id = payload.client_id
-    notes = payload.notes or ''
-    payment_method = payload.payment_method
     items_data = [i.model_dump() for i in payload.items]
-    # Convert date string to date object
-    date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-    # Normalize payment method
-    allowed_pm = {'efectivo','bizum','transferencia'}
+    allowed_pm = {'efectivo', 'bizum', 'transferencia'}
     if invoice_type != 'factura':
         payment_method = None
     else:
-        pm = (payment_method or '').strip().lower()
+        pm = (payload.payment_method or '').strip().lower()
         payment_method = pm if pm in allowed_pm else 'efectivo'
-    # Compute totals
-    subtotal, tax_amount, total = calculate_totals(items_data)
-    # Asignar número automáticamente según fecha indicada (reinicia por año/mes)
-    number = _next_sequence_atomic(invoice_type, datetime.strptime(date_str, '%Y-%m-%d'))
-    paid_flag = bool(payload.paid)
-    if invoice_type != 'factura':
-        paid_flag = False
-    invoice = Invoice(
-        number=number,
-        date=date_obj,
+    _, tax_amount, total = calculate_totals(items_data)
+    values = dict(
+        date=datetime.strptime(payload.date, '%Y-%m-%d').date(),
         type=invoice_type,
-        client_id=client_id,
-        notes=notes,
+        client_id=payload.client_id,
+        notes=payload.notes or '',
         payment_method=payment_method,
         total=total,
         tax_total=tax_amount,
-        paid=paid_flag
+        paid=bool(payload.paid) if invoice_type == 'factura' else False,
     )
+    item_rows = [
+        dict(
+            product_id=item.get('product_id'),
+            description=item['description'],
+            units=item['units'],
+            unit_price=item['unit_price'],
+            tax_rate=item['tax_rate'],
+            subtotal=item['units'] * item['unit_price'],
+            total=item['units'] * item['unit_price'] * (1 + item['tax_rate'] / 100),
+        )
+        for item in items_data
+    ]
+    return values, item_rows
+
+
+@app.route('/api/invoices', methods=['POST'])
+@jwt_required()
+def create_invoice():
+    """Create a new invoice or proforma and its items.
+
+    Número se asigna automáticamente según el tipo.
+    """
+    try:
+        payload = InvoiceCreateRequest.model_validate(request.get_json(force=True))
+    except PydValidationError as e:
+        return jsonify({"error": e.errors()[0]['msg'] if e.errors() else 'invalid payload', "code": 400}), 400
+    values, item_rows = _invoice_values(payload)
+    invoice_type = values['type']
+    items_data = [i.model_dump() for i in payload.items]
+    # Asignar número automáticamente según fecha indicada (reinicia por año/mes)
+    number = _next_sequence_atomic(invoice_type, datetime.strptime(payload.date, '%Y-%m-%d'))
+    invoice = Invoice(number=number, **values)
     db.session.add(invoice)
     try:
         db.session.flush()  # flush to obtain invoice.id
@@ -959,10 +2112,11 @@ def create_invoice():
     # Validar stock de productos (solo para facturas reales)
     products_to_decrement = []  # (product, qty)
     if invoice_type == 'factura':
+        products = _products_by_id(item.get('product_id') for item in items_data)
         for item in items_data:
             pid = item.get('product_id')
             if pid:
-                prod = Product.query.get(pid)
+                prod = products.get(int(pid))
                 if not prod:
                     return jsonify({'error': f'Producto {pid} no existe', 'code': 400}), 400
                 qty = int(item['units'])
@@ -970,23 +2124,17 @@ def create_invoice():
                     return jsonify({'error': f'Sin stock suficiente para producto {pid}', 'code': 409}), 409
                 products_to_decrement.append((prod, qty))
 
-    for item in items_data:
-        line = InvoiceItem(
-            invoice_id=invoice.id,
-            product_id=item.get('product_id'),
-            description=item['description'],
-            units=item['units'],
-            unit_price=item['unit_price'],
-            tax_rate=item['tax_rate'],
-            subtotal=item['units'] * item['unit_price'],
-            total=item['units'] * item['unit_price'] * (1 + item['tax_rate'] / 100)
-        )
-        db.session.add(line)
+    # Líneas y movimientos en un solo executemany cada uno (sin RETURNING por fila)
+    _insert_rows(InvoiceItem, [dict(row, invoice_id=invoice.id) for row in item_rows])
     # Descontar stock y registrar movimiento (solo 'factura')
     if invoice_type == 'factura':
         for prod, qty in products_to_decrement:
             prod.stock_qty = int(prod.stock_qty or 0) - int(qty)
-            db.session.add(StockMovement(product_id=prod.id, qty=-int(qty), type='sale', invoice_id=invoice.id))
+        _insert_rows(StockMovement, [
+            dict(product_id=prod.id, qty=-int(qty), type='sale', invoice_id=invoice.id)
+            for prod, qty in products_to_decrement
+        ])
+        _refresh_report_rollups('income', invoice.date)
     db.session.commit()
     return jsonify({
         'id': invoice.id,
@@ -1014,23 +2162,527 @@ def create_invoice():
     }), 201
 
 
+INVOICE_BULK_MAX = int(os.getenv('INVOICE_BULK_MAX', '1000'))
+
+
+def _bulk_create_invoices(rows: list, atomic: bool = False) -> list:
+    """Create many invoices with set-based statements; returns one result dict per input row.
+
+    Pydantic por fila; clientes y productos en una consulta cada uno; stock
+    validado contra lo que consumen las filas anteriores del lote; números
+    reservados con una sentencia por serie (tipo + mes), en orden de fecha;
+    facturas, líneas y movimientos en un executemany cada uno.  Las filas
+    con error se omiten y se informan; con ``atomic`` cualquier error deja
+    el lote sin insertar.  No hace commit.
+    """
+    results = [None] * len(rows)
+    parsed = []  # (index, values, item_rows)
+    for index, raw in enumerate(rows):
+        try:
+            payload = InvoiceCreateRequest.model_validate(raw)
+        except PydValidationError as e:
+            results[index] = {'index': index, 'status': 'error', 'code': 400,
+                              'error': e.errors()[0]['msg'] if e.errors() else 'invalid payload'}
+            continue
+        values, item_rows = _invoice_values(payload)
+        parsed.append((index, values, item_rows))
+
+    client_ids = {values['client_id'] for _, values, _ in parsed}
+    known_clients = ({cid for (cid,) in db.session.query(Client.id).filter(Client.id.in_(client_ids))}
+                     if client_ids else set())
+    products = _products_by_id(row['product_id'] for _, values, item_rows in parsed
+                               if values['type'] == 'factura' for row in item_rows)
+    remaining = {pid: int(p.stock_qty or 0) for pid, p in products.items()}
+    valid = []  # (index, values, item_rows, [(product_id, qty)])
+    for index, values, item_rows in parsed:
+        error = None
+        if values['client_id'] not in known_clients:
+            error = (400, f"Cliente {values['client_id']} no existe")
+        lines = []  # (product_id, qty) por línea: un movimiento de stock cada una
+        consumed = {}
+        if error is None and values['type'] == 'factura':
+            for row in item_rows:
+                if row['product_id']:
+                    pid = int(row['product_id'])
+                    lines.append((pid, int(row['units'])))
+                    consumed[pid] = consumed.get(pid, 0) + int(row['units'])
+            for pid, qty in consumed.items():
+                if pid not in products:
+                    error = (400, f'Producto {pid} no existe')
+                    break
+                if remaining[pid] < qty:
+                    error = (409, f'Sin stock suficiente para producto {pid}')
+                    break
+        if error is not None:
+            results[index] = {'index': index, 'status': 'error', 'code': error[0], 'error': error[1]}
+            continue
+        for pid, qty in consumed.items():
+            remaining[pid] -= qty
+        valid.append((index, values, item_rows, lines))
+
+    if not valid or (atomic and len(valid) < len(rows)):
+        return results
+
+    # Numeración: una reserva por serie, asignada por fecha (y orden de entrada)
+    series = {}
+    for entry in sorted(valid, key=lambda e: (e[1]['date'], e[0])):
+        values = entry[1]
+        series.setdefault((values['type'], values['date'].year, values['date'].month), []).append(entry)
+    numbered = []
+    for (doc_type, year, month), entries in series.items():
+        numbers = _reserve_sequence_numbers(doc_type, datetime(year, month, 1), len(entries))
+        numbered.extend(zip(numbers, entries))
+
+    # RETURNING sin orden garantizado (así va en lotes multi-VALUES): se casa por número, que es único
+    ids_by_number = dict(db.session.execute(
+        db.insert(Invoice).returning(Invoice.number, Invoice.id),
+        [dict(values, number=number) for number, (_, values, _, _) in numbered],
+    ).all())
+    invoice_ids = [ids_by_number[number] for number, _ in numbered]
+    _insert_rows(InvoiceItem, [
+        dict(row, invoice_id=invoice_id)
+        for invoice_id, (_, (_, _, item_rows, _)) in zip(invoice_ids, numbered)
+        for row in item_rows
+    ])
+    _insert_rows(StockMovement, [
+        dict(product_id=pid, qty=-qty, type='sale', invoice_id=invoice_id)
+        for invoice_id, (_, (_, _, _, lines)) in zip(invoice_ids, numbered)
+        for pid, qty in lines
+    ])
+    for pid, stock in remaining.items():
+        if stock != int(products[pid].stock_qty or 0):
+            products[pid].stock_qty = stock
+    _refresh_report_rollups('income', *{values['date'] for _, (_, values, _, _) in numbered
+                                        if values['type'] == 'factura' and values['paid']})
+    # Las inserciones Core no pasan por el after_flush del índice de búsqueda
+    conn = db.session.connection()
+    if _search_index_available(conn):
+        _search_index_write(conn, _search_index_rows(conn, 'invoice', ids=invoice_ids))
+
+    for invoice_id, (number, (index, values, _, _)) in zip(invoice_ids, numbered):
+        results[index] = {'index': index, 'status': 'ok', 'id': invoice_id, 'number': number,
+                          'date': values['date'].isoformat(), 'type': values['type'], 'total': values['total']}
+    return results
+
+
+@app.post('/api/invoices/bulk')
+@jwt_required()
+@limiter.limit("10 per minute")
+def create_invoices_bulk():
+    """Crea muchas facturas/proformas en una petición (importación, recurrentes).
+
+    Cuerpo: ``{"invoices": [InvoiceCreateRequest, ...], "atomic": false}``.
+    Un único commit. Devuelve el resultado por fila (``id`` y ``number`` o
+    ``error``); con ``atomic: true`` un error en cualquier fila cancela el lote.
+    """
+    data = request.get_json(silent=True) or {}
+    rows = data.get('invoices')
+    if not isinstance(rows, list) or not rows:
+        return jsonify({'error': 'invoices debe ser una lista no vacía'}), 400
+    if len(rows) > INVOICE_BULK_MAX:
+        return jsonify({'error': f'Máximo {INVOICE_BULK_MAX} facturas por lote'}), 400
+    atomic = bool(data.get('atomic'))
+    results = _bulk_create_invoices(rows, atomic=atomic)
+    created = sum(1 for r in results if r and r['status'] == 'ok')
+    if atomic and created < len(rows):
+        db.session.rollback()
+        errors = [r for r in results if r and r['status'] == 'error']
+        return jsonify({'created': 0, 'failed': len(errors), 'results': errors}), 409 if all(
+            r['code'] == 409 for r in errors) else 400
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'El número de factura ya existe'}), 409
+    return jsonify({'created': created, 'failed': len(rows) - created, 'results': results}), 201 if created else 400
+
+
+# -----------------------------------------------------------------------------
+# Recurring invoices
+# -----------------------------------------------------------------------------
+# Plantillas de factura periódicas (cuotas de renting).  ``flask
+# run-recurring-invoices`` (cron diario, o ``--every`` como proceso) emite los
+# periodos vencidos por lotes con ``_bulk_create_invoices``: misma numeración
+# y control de stock que la API.  ``RecurringInvoiceRun`` registra cada
+# (plantilla, periodo) emitido, así que repetir una ejecución no duplica nada.
+# Fechado: cada factura lleva la fecha de la ejecución (fecha de expedición
+# real, la que exige la numeración correlativa por fecha), también los
+# periodos atrasados que se emiten al ponerse al día; el periodo facturado
+# queda en las notas ("Periodo YYYY-MM").
+RECURRING_BATCH_SIZE = int(os.getenv('RECURRING_BATCH_SIZE', '200'))
+RECURRING_MAX_CATCHUP = 12  # periodos atrasados que se emiten por plantilla en una ejecución
+
+
+def _add_months(d, months: int):
+    """Same day ``months`` later (next_run is kept on days 1-28)."""
+    month = d.month - 1 + months
+    return d.replace(year=d.year + month // 12, month=month % 12 + 1)
+
+
+def _recurring_template(raw) -> dict:
+    """Validate an invoice template: ``InvoiceCreateRequest`` without date/client_id."""
+    if not isinstance(raw, dict):
+        raise ValueError('template debe ser un objeto')
+    try:
+        payload = InvoiceCreateRequest.model_validate({**raw, 'date': '2000-01-01', 'client_id': 1})
+    except PydValidationError as e:
+        raise ValueError(e.errors()[0]['msg'] if e.errors() else 'template inválido')
+    return payload.model_dump(exclude={'date', 'client_id'})
+
+
+def _recurring_fields(data: dict, partial: bool = False) -> dict:
+    """Column values for a RecurringInvoice from a request body; raises ValueError.
+
+    ``from_invoice_id`` copia cliente, tipo, notas, forma de pago y líneas de
+    una factura existente como plantilla.
+    """
+    if data.get('from_invoice_id') is not None and 'template' not in data:
+        try:
+            source = db.session.get(Invoice, int(data['from_invoice_id']), options=[selectinload(Invoice.items)])
+        except (TypeError, ValueError):
+            source = None
+        if source is None:
+            raise ValueError('Factura origen no existe')
+        data = {'client_id': source.client_id, 'name': f'Recurrente {source.number}', **data, 'template': {
+            'type': source.type, 'notes': source.notes or '', 'payment_method': source.payment_method,
+            'paid': bool(source.paid),
+            'items': [{'description': it.description, 'units': it.units, 'unit_price': it.unit_price,
+                       'tax_rate': it.tax_rate, 'product_id': it.product_id} for it in source.items],
+        }}
+    values = {}
+    if 'template' in data:
+        values['template'] = _recurring_template(data['template'])
+    if 'client_id' in data:
+        try:
+            client_id = int(data['client_id'])
+        except (TypeError, ValueError):
+            raise ValueError('client_id inválido')
+        if db.session.get(Client, client_id) is None:
+            raise ValueError(f'Cliente {client_id} no existe')
+        values['client_id'] = client_id
+    if 'name' in data:
+        values['name'] = str(data['name'] or '').strip()[:128]
+        if not values['name']:
+            raise ValueError('name es obligatorio')
+    if 'interval_months' in data:
+        try:
+            values['interval_months'] = int(data['interval_months'])
+        except (TypeError, ValueError):
+            raise ValueError('interval_months inválido')
+        if not 1 <= values['interval_months'] <= 24:
+            raise ValueError('interval_months debe estar entre 1 y 24')
+    for field in ('next_run', 'end_date'):
+        if field not in data:
+            continue
+        if field == 'end_date' and not data[field]:
+            values[field] = None
+            continue
+        try:
+            values[field] = datetime.strptime(str(data[field]), '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError(f'{field} debe ser YYYY-MM-DD')
+    if 'next_run' in values and values['next_run'].day > 28:
+        raise ValueError('next_run: el día del mes debe estar entre 1 y 28')
+    for flag in ('active', 'prerender_pdf'):
+        if flag in data:
+            values[flag] = bool(data[flag])
+    if not partial:
+        missing = [f for f in ('client_id', 'name', 'template', 'next_run') if f not in values]
+        if missing:
+            raise ValueError(f"Faltan campos: {', '.join(missing)}")
+    return values
+
+
+def _recurring_to_dict(r: 'RecurringInvoice') -> dict:
+    return {
+        'id': r.id,
+        'client_id': r.client_id,
+        'name': r.name,
+        'template': r.template,
+        'interval_months': r.interval_months,
+        'next_run': r.next_run.isoformat(),
+        'end_date': r.end_date.isoformat() if r.end_date else None,
+        'active': bool(r.active),
+        'prerender_pdf': bool(r.prerender_pdf),
+        'last_run_at': r.last_run_at.isoformat() if r.last_run_at else None,
+    }
+
+
+def _recurring_notes(notes, period: str) -> str:
+    """Template notes plus a ``Periodo YYYY-MM`` line for the billed period."""
+    return '\n'.join(filter(None, [(notes or '').rstrip(), f'Periodo {period}']))
+
+
+def _recurring_is_due(tpl: 'RecurringInvoice', today) -> bool:
+    return tpl.next_run <= today and (tpl.end_date is None or tpl.next_run <= tpl.end_date)
+
+
+def _run_recurring_batch(templates: list, today, prerender: bool = False) -> dict:
+    """Emit the due periods of ``templates``, dated ``today``, and commit once.
+
+    Todas las facturas del lote se fechan ``today``, también las de periodos
+    atrasados: es su fecha de expedición y mantiene la numeración en orden de
+    fecha.  El periodo que cubre cada una va en sus notas (``_recurring_notes``).
+
+    Por rondas: cada ronda emite el siguiente periodo pendiente de cada
+    plantilla (varios si el programador estuvo parado, hasta
+    ``RECURRING_MAX_CATCHUP``) con una llamada a ``_bulk_create_invoices``.
+    Un periodo ya registrado solo avanza ``next_run``; una plantilla con
+    error (p. ej. sin stock) se queda en su periodo y se reintenta en la
+    próxima ejecución.  Si otro proceso emitió el mismo periodo a la vez, la
+    restricción única rechaza el registro del periodo y el lote entero se
+    deshace (numeración incluida).
+    """
+    summary = {'created': 0, 'skipped': 0, 'failed': 0, 'errors': [], 'prerender_ids': []}
+    failed = set()
+    pending = list(templates)
+    try:
+        for _ in range(RECURRING_MAX_CATCHUP):
+            pending = [t for t in pending if t.id not in failed and _recurring_is_due(t, today)]
+            if not pending:
+                break
+            periods = {t.id: t.next_run.strftime('%Y-%m') for t in pending}
+            done = set(db.session.query(RecurringInvoiceRun.recurring_id, RecurringInvoiceRun.period).filter(
+                RecurringInvoiceRun.recurring_id.in_(periods), RecurringInvoiceRun.period.in_(set(periods.values()))))
+            to_emit = []
+            for tpl in pending:
+                if (tpl.id, periods[tpl.id]) in done:
+                    summary['skipped'] += 1
+                    tpl.next_run = _add_months(tpl.next_run, tpl.interval_months)
+                else:
+                    to_emit.append(tpl)
+            if not to_emit:
+                continue
+            results = _bulk_create_invoices([
+                {**tpl.template, 'date': today.isoformat(), 'client_id': tpl.client_id,
+                 'notes': _recurring_notes(tpl.template.get('notes'), periods[tpl.id])} for tpl in to_emit
+            ])
+            runs = []
+            for tpl, res in zip(to_emit, results):
+                if res['status'] != 'ok':
+                    failed.add(tpl.id)
+                    summary['failed'] += 1
+                    summary['errors'].append({'recurring_id': tpl.id, 'period': periods[tpl.id],
+                                              'code': res['code'], 'error': res['error']})
+                    continue
+                runs.append(dict(recurring_id=tpl.id, period=periods[tpl.id], invoice_id=res['id']))
+                tpl.next_run = _add_months(tpl.next_run, tpl.interval_months)
+                tpl.last_run_at = datetime.utcnow()
+                summary['created'] += 1
+                if prerender or tpl.prerender_pdf:
+                    summary['prerender_ids'].append(res['id'])
+            _insert_rows(RecurringInvoiceRun, runs)
+        for tpl in templates:
+            if tpl.end_date and tpl.next_run > tpl.end_date:
+                tpl.active = False
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        app.logger.warning('Facturas recurrentes: lote emitido a la vez por otro proceso; se descarta')
+        summary.update(created=0, prerender_ids=[], conflict=True)
+    return summary
+
+
+def _prerender_invoice_pdfs(invoice_ids) -> int:
+    """Render the PDFs of ``invoice_ids`` into the PDF cache; returns how many were written.
+
+    Igual que la exportación ZIP: pool de render con una ventana acotada de
+    trabajos en vuelo y render en línea si la cola está llena.
+    """
+    company = CompanyConfig.query.first() or _company_from_env()
+    window = max(1, min(PDF_RENDER_QUEUE_MAX, max(1, PDF_RENDER_WORKERS) * 2))
+    in_flight = deque()
+    written = 0
+
+    def _finish(entry):
+        nonlocal written
+        invoice_id, cache_key, job = entry
+        try:
+            _store_invoice_pdf_cache(invoice_id, cache_key, job.result(timeout=PDF_RENDER_TIMEOUT))
+            written += 1
+        except Exception:
+            app.logger.exception('No se pudo pre-renderizar el PDF de la factura %s', invoice_id)
+
+    for invoice_id in invoice_ids:
+        invoice = db.session.get(Invoice, invoice_id, options=[selectinload(Invoice.items), joinedload(Invoice.client)])
+        if invoice is None:
+            continue
+        cache_key = _invoice_pdf_cache_key(invoice, invoice.client, company, invoice.items)
+        if os.path.isfile(_invoice_pdf_cache_path(invoice.id, cache_key)):
+            continue
+        fn, args = _invoice_render_job(invoice, invoice.client, company, invoice.items)
+        try:
+            job = _submit_pdf_render(fn, *args)
+        except HTTPException:
+            job = Future()
+            try:
+                job.set_result(fn(*args))
+            except Exception as e:
+                job.set_exception(e)
+        in_flight.append((invoice_id, cache_key, job))
+        if len(in_flight) >= window:
+            _finish(in_flight.popleft())
+    while in_flight:
+        _finish(in_flight.popleft())
+    return written
+
+
+def _run_recurring_invoices(today=None, prerender: bool = False) -> dict:
+    """Materialize every due recurring invoice, ``RECURRING_BATCH_SIZE`` templates per commit."""
+    today = today or datetime.utcnow().date()
+    totals = {'date': today.isoformat(), 'created': 0, 'skipped': 0, 'failed': 0, 'prerendered': 0, 'errors': []}
+    last_id = 0
+    while True:
+        batch = (RecurringInvoice.query
+                 .filter(RecurringInvoice.active.is_(True), RecurringInvoice.next_run <= today,
+                         RecurringInvoice.id > last_id)
+                 .order_by(RecurringInvoice.id)
+                 .limit(RECURRING_BATCH_SIZE)
+                 .all())
+        if not batch:
+            break
+        last_id = batch[-1].id
+        summary = _run_recurring_batch(batch, today, prerender=prerender)
+        for key in ('created', 'skipped', 'failed'):
+            totals[key] += summary[key]
+        totals['errors'].extend(summary['errors'])
+        if summary['prerender_ids']:
+            totals['prerendered'] += _prerender_invoice_pdfs(summary['prerender_ids'])
+        db.session.expunge_all()
+    return totals
+
+
+@app.cli.command('run-recurring-invoices')
+@click.option('--date', 'run_date', help='Fecha de emisión YYYY-MM-DD (por defecto hoy)')
+@click.option('--prerender/--no-prerender', default=False, help='Dejar los PDFs emitidos en la caché')
+@click.option('--every', type=int, default=0, help='Repetir cada N segundos (proceso programador)')
+def run_recurring_invoices_command(run_date, prerender, every):
+    """Emite las facturas recurrentes vencidas (idempotente por periodo)."""
+    while True:
+        today = datetime.strptime(run_date, '%Y-%m-%d').date() if run_date else datetime.utcnow().date()
+        try:
+            totals = _run_recurring_invoices(today, prerender=prerender)
+        except Exception:
+            if every <= 0:
+                raise
+            db.session.rollback()
+            app.logger.exception('Facturas recurrentes: ejecución fallida; se reintenta en %ss', every)
+        else:
+            print(f"{totals['date']}: emitidas {totals['created']}; ya emitidas {totals['skipped']}; "
+                  f"con error {totals['failed']}; PDFs en caché {totals['prerendered']}")
+            for err in totals['errors']:
+                print(f"  plantilla {err['recurring_id']} ({err['period']}): {err['error']}")
+        if every <= 0:
+            return
+        time.sleep(every)
+
+
+@app.route('/api/recurring-invoices', methods=['GET'])
+@jwt_required()
+def list_recurring_invoices():
+    """Lista las plantillas recurrentes (filtro opcional ``client_id``)."""
+    query = RecurringInvoice.query
+    client_id = request.args.get('client_id', type=int)
+    if client_id:
+        query = query.filter(RecurringInvoice.client_id == client_id)
+    return jsonify({'items': [_recurring_to_dict(r) for r in query.order_by(RecurringInvoice.next_run,
+                                                                             RecurringInvoice.id)]})
+
+
+@app.route('/api/recurring-invoices', methods=['POST'])
+@jwt_required()
+def create_recurring_invoice():
+    """Crea una plantilla: ``client_id``, ``name``, ``template``, ``next_run``,
+    ``interval_months`` (1), ``end_date``, ``prerender_pdf``; o ``from_invoice_id``."""
+    try:
+        values = _recurring_fields(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'error': str(e), 'code': 400}), 400
+    recurring = RecurringInvoice(**values)
+    db.session.add(recurring)
+    db.session.commit()
+    return jsonify(_recurring_to_dict(recurring)), 201
+
+
+@app.route('/api/recurring-invoices/<int:recurring_id>', methods=['PUT'])
+@jwt_required()
+def update_recurring_invoice(recurring_id):
+    recurring = RecurringInvoice.query.get_or_404(recurring_id)
+    try:
+        values = _recurring_fields(request.get_json(silent=True) or {}, partial=True)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'code': 400}), 400
+    for field, value in values.items():
+        setattr(recurring, field, value)
+    db.session.commit()
+    return jsonify(_recurring_to_dict(recurring))
+
+
+@app.route('/api/recurring-invoices/<int:recurring_id>', methods=['DELETE'])
+@jwt_required()
+def delete_recurring_invoice(recurring_id):
+    """Elimina la plantilla y su registro de periodos; las facturas emitidas se conservan."""
+    recurring = RecurringInvoice.query.get_or_404(recurring_id)
+    RecurringInvoiceRun.query.filter_by(recurring_id=recurring.id).delete()
+    db.session.delete(recurring)
+    db.session.commit()
+    return jsonify({'status': 'deleted'})
+
+
+@app.post('/api/recurring-invoices/run')
+@jwt_required()
+@limiter.limit("2 per minute")
+def run_recurring_invoices():
+    """Ejecuta el programador ahora (``date`` YYYY-MM-DD opcional, ``prerender``)."""
+    data = request.get_json(silent=True) or {}
+    try:
+        today = datetime.strptime(data['date'], '%Y-%m-%d').date() if data.get('date') else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'date debe ser YYYY-MM-DD', 'code': 400}), 400
+    return jsonify(_run_recurring_invoices(today, prerender=bool(data.get('prerender'))))
+
+
+def _invoices_query(args):
+    """Invoice query with the listing filters; shared by list and exports.
+
+    ``year``/``month`` or ``from``/``to`` (half-open range on Invoice.date),
+    ``type`` (factura|proforma) and ``q``.  Raises ValueError on bad dates.
+    """
+    query = Invoice.query
+
+    # Filtro por mes/año o from/to como rango semiabierto sobre Invoice.date
+    start, end = _date_range_from_args(args)
+    query = _filter_date_range(query, Invoice.date, start, end)
+
+    doc_type = (args.get('type') or '').strip().lower()
+    if doc_type in ('factura', 'proforma'):
+        query = query.filter(Invoice.type == doc_type)
+
+    # Búsqueda por número o nombre de cliente (el índice incluye ambos)
+    q = (args.get('q') or '').strip()
+    if q:
+        ids = _search_ids_select('invoice', q)
+        if ids is not None:
+            query = query.filter(Invoice.id.in_(ids))
+    return query
+
+
 @app.route('/api/invoices', methods=['GET'])
 @jwt_required()
 def list_invoices():
     """Listado de facturas/proformas con filtros, paginación, búsqueda y orden.
 
     Parámetros opcionales:
-      - month, year (int): filtrar por mes/año
+      - month, year (int): filtrar por mes/año (o solo year)
+      - from, to (YYYY-MM-DD, inclusivos): rango de fechas
       - limit (int), offset (int)
+      - cursor (str): paginación keyset (ver ``_paginate_listing``); ignora offset
+      - include_total (0|1): 0 omite el COUNT(*)
+      - type (str): factura|proforma
       - q (str): búsqueda por número o nombre de cliente
       - sort (str): id, date, total, tax_total, number
       - dir (str): asc|desc (por defecto desc)
     """
-    month = request.args.get('month')
-    year = request.args.get('year')
-    limit = request.args.get('limit', type=int, default=10)
-    offset = request.args.get('offset', type=int, default=0)
-    q = (request.args.get('q') or '').strip()
     sort = (request.args.get('sort') or 'date').strip()
     direction = (request.args.get('dir') or 'desc').strip().lower()
 
@@ -1040,33 +2692,16 @@ def list_invoices():
     if direction not in {'asc', 'desc'}:
         direction = 'desc'
 
-    query = Invoice.query
-
-    # Filtro por mes/año
-    if month and year:
-        try:
-            m = int(month)
-            y = int(year)
-            query = query.filter(db.extract('month', Invoice.date) == m)
-            query = query.filter(db.extract('year', Invoice.date) == y)
-        except ValueError:
-            return jsonify({'error': 'Month and year must be integers'}), 400
-
-    # Búsqueda por número o nombre de cliente
-    if q:
-        like = f"%{q}%"
-        # Join para poder buscar por nombre de cliente
-        query = query.join(Client, Client.id == Invoice.client_id)
-        query = query.filter(db.or_(Invoice.number.ilike(like), Client.name.ilike(like)))
-
-    # Orden
-    sort_col = getattr(Invoice, sort)
-    if direction == 'desc':
-        sort_col = sort_col.desc()
-    query = query.order_by(sort_col)
+    try:
+        query = _invoices_query(request.args)
+    except ValueError:
+        return jsonify({'error': 'Month and year must be integers, from/to YYYY-MM-DD'}), 400
 
-    total = query.count()
-    invoices = query.offset(offset).limit(limit).all()
+    # Orden (sort, id) y paginación por offset o cursor
+    try:
+        invoices, page = _paginate_listing(query, Invoice, sort, direction, request.args)
+    except ValueError:
+        return jsonify({'error': 'cursor inválido'}), 400
 
     items = []
     for inv in invoices:
@@ -1081,7 +2716,7 @@ def list_invoices():
             'tax_total': inv.tax_total,
             'paid': bool(inv.paid)
         })
-    return jsonify({'items': items, 'total': total})
+    return jsonify({'items': items, **page})
 
 
 @app.route('/api/invoices/next_number')
@@ -1103,7 +2738,7 @@ def get_next_number():
 @app.route('/api/invoices/<int:invoice_id>', methods=['GET'])
 @jwt_required()
 def get_invoice(invoice_id):
-    inv = Invoice.query.get_or_404(invoice_id)
+    inv = _load_invoice_or_404(invoice_id, with_client=False)
     return jsonify({
         'id': inv.id,
         'number': inv.number,
@@ -1142,8 +2777,12 @@ def delete_invoice(invoice_id):
             return jsonify({'error': 'No se puede eliminar: factura con productos vendidos'}), 409
     for it in list(inv.items):
         db.session.delete(it)
+    # El periodo queda sin factura; el programador no lo reemite (next_run ya avanzó)
+    RecurringInvoiceRun.query.filter_by(invoice_id=inv.id).delete()
     db.session.delete(inv)
+    _refresh_report_rollups('income', inv.date)
     db.session.commit()
+    _invalidate_invoice_pdf_cache(invoice_id)
     return jsonify({'status': 'deleted'})
 
 
@@ -1156,6 +2795,8 @@ def update_client(client_id):
         if field in data:
             setattr(client, field, data[field])
     db.session.commit()
+    # Los PDFs de sus facturas incluyen los datos del cliente
+    _invalidate_invoice_pdf_cache(*[i for (i,) in db.session.query(Invoice.id).filter_by(client_id=client.id)])
     return jsonify({'status': 'ok'})
 
 
@@ -1168,25 +2809,290 @@ def delete_client(client_id):
     has_invoices = Invoice.query.filter_by(client_id=client.id).count() > 0
     if has_invoices:
         return jsonify({'error': 'No se puede eliminar: el cliente tiene facturas asociadas'}), 409
+    if RecurringInvoice.query.filter_by(client_id=client.id).count() > 0:
+        return jsonify({'error': 'No se puede eliminar: el cliente tiene facturas recurrentes'}), 409
     db.session.delete(client)
     db.session.commit()
     return jsonify({'status': 'deleted'})
 
 
-def _client_upload_dir(client_id: int) -> str:
-    base = os.path.join(UPLOADS_ROOT, str(client_id))
-    os.makedirs(os.path.join(base, 'documents'), exist_ok=True)
-    os.makedirs(os.path.join(base, 'images'), exist_ok=True)
-    return base
+# -----------------------------
+# Content-addressed document storage
+# -----------------------------
+
+BLOBS_DIR = 'blobs'  # bajo UPLOADS_ROOT
+BLOB_CHUNK_SIZE = 64 * 1024
+
+
+def _blob_rel_path(sha256: str) -> str:
+    return os.path.join(BLOBS_DIR, sha256[:2], sha256)
 
 
-def _allowed_category_and_mime(filename: str, content_type: str) -> tuple[str, bool]:
-    name = filename.lower()
-    if name.endswith('.pdf') and content_type in ('application/pdf', 'application/octet-stream'):
-        return 'document', True
-    if any(name.endswith(ext) for ext in ('.jpg', '.jpeg', '.png', '.webp')) and content_type.startswith('image/'):
-        return 'image', True
-    return 'other', False
+def _blob_put(chunks) -> tuple:
+    """Store the bytes yielded by ``chunks`` as a blob and take a reference to it.
+
+    The content is hashed while it is written to a temp file, so uploads are
+    never buffered whole nor read twice.  The reference is counted in the
+    current session (commit it together with the ``ClientDocument`` inside
+    ``_blob_commit``); the temp file is then moved into place, or dropped if
+    the blob already exists.  Returns ``(sha256, size_bytes, stored_path)``.
+    """
+    tmp_dir = os.path.join(UPLOADS_ROOT, BLOBS_DIR, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = os.path.join(tmp_dir, uuid4().hex)
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        sha = digest.hexdigest()
+        stored_rel = _blob_adopt(tmp_path, sha, size)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return sha, size, stored_rel
+
+
+def _blob_adopt(tmp_path: str, sha256: str, size: int) -> str:
+    """Take a reference to ``sha256`` and move ``tmp_path`` (its content) into place.
+
+    ``tmp_path`` must live on the same filesystem as ``UPLOADS_ROOT``; it is
+    removed if the blob already exists.  Returns the blob's relative path.
+    Inside ``_blob_commit`` the blob is noted so a failed commit removes it.
+    """
+    _blob_acquire(sha256, size)
+    written = db.session.info.get('blobs_written')
+    if written is not None:
+        written.append(sha256)
+    stored_rel = _blob_rel_path(sha256)
+    stored_abs = os.path.join(UPLOADS_ROOT, stored_rel)
+    if os.path.isfile(stored_abs) and os.path.getsize(stored_abs) == size:
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(stored_abs), exist_ok=True)
+        os.replace(tmp_path, stored_abs)
+    return stored_rel
+
+
+def _iter_stream(stream, chunk_size: int = BLOB_CHUNK_SIZE):
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _blob_acquire(sha256: str, size: int) -> None:
+    """ref_count + 1 for ``sha256``, creating the row if needed (flushed, not committed)."""
+    bump = {StoredBlob.ref_count: StoredBlob.ref_count + 1}
+    if StoredBlob.query.filter_by(sha256=sha256).update(bump, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(StoredBlob(sha256=sha256, size_bytes=size, ref_count=1))
+    except IntegrityError:
+        # Otra petición creó el mismo blob a la vez
+        StoredBlob.query.filter_by(sha256=sha256).update(bump, synchronize_session=False)
+
+
+def _blob_release(doc: 'ClientDocument') -> list:
+    """Drop ``doc``'s reference to its blob; return the files to remove after commit.
+
+    Runs inside the caller's transaction and touches no files: pass the
+    result to ``_blob_unlink`` once ``db.session.commit()`` succeeded, so a
+    failed or rolled-back delete never leaves a row without its file.
+    Documents stored before content addressing (no ``sha256``) own their
+    file.  Returns ``[(sha256 or None, abs_path)]``.
+    """
+    if not doc.sha256:
+        return [(None, os.path.join(UPLOADS_ROOT, doc.stored_path))]
+    StoredBlob.query.filter_by(sha256=doc.sha256).update(
+        {StoredBlob.ref_count: StoredBlob.ref_count - 1}, synchronize_session=False)
+    gone = (StoredBlob.query
+            .filter(StoredBlob.sha256 == doc.sha256, StoredBlob.ref_count <= 0)
+            .delete(synchronize_session=False))
+    return [(doc.sha256, os.path.join(UPLOADS_ROOT, _blob_rel_path(doc.sha256)))] if gone else []
+
+
+def _blob_claim_unreferenced(sha256: str) -> bool:
+    """Insert a zero-reference row for ``sha256`` unless the blob is referenced again.
+
+    ``ON CONFLICT DO NOTHING`` waits on a concurrent upload of the same
+    content that already inserted its row (and then yields to it); while
+    our row is uncommitted, new uploads of that content wait in
+    ``_blob_acquire`` until the file is gone.
+    """
+    table = StoredBlob.__table__
+    values = dict(sha256=sha256, size_bytes=0, ref_count=0, created_at=datetime.utcnow())
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql' or (dialect == 'sqlite' and _SQLITE_UPSERT_RETURNING):
+        insert = pg_insert if dialect == 'postgresql' else sqlite_insert
+        # rowcount no es fiable con ON CONFLICT (psycopg 3 da -1): RETURNING vacío = conflicto
+        return db.session.execute(insert(table).values(**values)
+                                  .on_conflict_do_nothing(index_elements=['sha256'])
+                                  .returning(table.c.sha256)).first() is not None
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert().values(**values))
+        return True
+    except IntegrityError:
+        return False
+
+
+def _blob_unlink(released: list) -> None:
+    """Remove the files returned by ``_blob_release``; call after the commit.
+
+    Blob files are removed only if no upload referenced the content again
+    in between (``_blob_claim_unreferenced``), each in its own short
+    transaction.
+    """
+    for sha256, path in released:
+        if sha256 and not _blob_claim_unreferenced(sha256):
+            db.session.rollback()
+            continue
+        try:
+            if os.path.isfile(path):
+                os.remove(path)
+        except OSError:
+            pass
+        if sha256:
+            StoredBlob.query.filter_by(sha256=sha256, ref_count=0).delete(synchronize_session=False)
+            db.session.commit()
+
+
+@contextmanager
+def _blob_commit():
+    """Commit the rows referencing the blobs stored in the block; on failure remove their files.
+
+    ``_blob_put``/``_blob_adopt`` dejan el fichero en ``blobs/`` antes del
+    commit.  Si el bloque o el commit fallan se hace rollback y
+    ``_blob_unlink`` borra los ficheros que ya no referencia ninguna fila (un
+    blob que ya existía conserva el suyo); la excepción se propaga.
+    """
+    db.session.info['blobs_written'] = []
+    try:
+        yield
+        db.session.commit()
+    except BaseException:
+        written = db.session.info.pop('blobs_written', [])
+        db.session.rollback()
+        try:
+            _blob_unlink([(sha, os.path.join(UPLOADS_ROOT, _blob_rel_path(sha))) for sha in dict.fromkeys(written)])
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('No se pudieron borrar los blobs de un commit fallido')
+        raise
+    finally:
+        db.session.info.pop('blobs_written', None)
+
+
+@app.cli.command('prune-legacy-uploads')
+def prune_legacy_uploads_command():
+    """Borra los ficheros de documentos anteriores a los blobs que ya no usa ninguna fila.
+
+    La migración 0008 los enlaza en ``blobs/`` sin borrarlos; ejecutar una vez
+    aplicada.  Solo mira ``<client_id>/{documents,images}/``.
+    """
+    referenced = {os.path.normpath(p) for (p,) in db.session.query(ClientDocument.stored_path)}
+    removed = 0
+    if os.path.isdir(UPLOADS_ROOT):
+        for entry in os.scandir(UPLOADS_ROOT):
+            if not (entry.is_dir() and entry.name.isdigit()):
+                continue
+            for subdir in ('documents', 'images'):
+                base = os.path.join(entry.path, subdir)
+                if not os.path.isdir(base):
+                    continue
+                for name in os.listdir(base):
+                    rel = os.path.join(entry.name, subdir, name)
+                    if rel not in referenced and os.path.isfile(os.path.join(base, name)):
+                        os.remove(os.path.join(base, name))
+                        removed += 1
+    print(f'Ficheros antiguos borrados: {removed}')
+
+
+# -----------------------------
+# Client document uploads (streaming + resumable)
+# -----------------------------
+
+CLIENT_DOC_MAX_BYTES = int(os.getenv('CLIENT_DOC_MAX_MB', '500')) * 1024 * 1024
+UPLOAD_SESSIONS_DIR = os.path.join(BLOBS_DIR, 'partial')  # bajo UPLOADS_ROOT
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL_HOURS', '24')) * 3600
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # sugerido al cliente; cada trozo también respeta MAX_CONTENT_LENGTH
+_UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+_UPLOAD_SNIFF_BYTES = 12
+
+# Firma (magic bytes) -> (content_type, categoría). Solo se admiten PDF e imágenes.
+_UPLOAD_SIGNATURES = (
+    (b'%PDF-', 'application/pdf', 'document'),
+    (b'\xff\xd8\xff', 'image/jpeg', 'image'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png', 'image'),
+)
+
+
+def _sniff_upload(head: bytes) -> tuple | None:
+    """(content_type, category) from the first bytes of a file, or None if not allowed."""
+    for magic, content_type, category in _UPLOAD_SIGNATURES:
+        if head.startswith(magic):
+            return content_type, category
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp', 'image'
+    return None
+
+
+def _checked_upload(chunks, sniffed: dict, offset: int = 0):
+    """Pass ``chunks`` through, enforcing ``CLIENT_DOC_MAX_BYTES`` as bytes arrive.
+
+    When ``offset`` is 0 the first bytes are sniffed before anything is
+    yielded; the detected ``content_type``/``category`` are stored in
+    ``sniffed``.  Aborts 415 for anything that is not PDF/JPEG/PNG/WebP,
+    400 for an empty file and 413 as soon as the file grows past the cap
+    (``_blob_put`` drops the temp file on the way out).
+    """
+    size = offset
+    head = b''
+    for chunk in chunks:
+        size += len(chunk)
+        if size > CLIENT_DOC_MAX_BYTES:
+            abort(413, description=f'Fichero demasiado grande (máximo {CLIENT_DOC_MAX_BYTES // (1024 * 1024)} MB)')
+        if offset == 0 and not sniffed:
+            head += chunk
+            if len(head) < _UPLOAD_SNIFF_BYTES:
+                continue
+            chunk, head = head, b''
+            _sniff_into(sniffed, chunk)
+        yield chunk
+    if head:
+        _sniff_into(sniffed, head)
+        yield head
+    elif offset == 0 and not sniffed:
+        abort(400, description='Fichero vacío')
+
+
+def _sniff_into(sniffed: dict, head: bytes) -> None:
+    kind = _sniff_upload(head)
+    if kind is None:
+        abort(415, description='Tipo de archivo no permitido (PDF, JPEG, PNG o WebP)')
+    sniffed['content_type'], sniffed['category'] = kind
+
+
+def _create_client_document(client_id: int, filename: str, sniffed: dict, sha: str, size: int,
+                            stored_rel: str) -> 'ClientDocument':
+    doc = ClientDocument(
+        client_id=client_id,
+        category=sniffed['category'],
+        filename=filename,
+        stored_path=stored_rel,
+        sha256=sha,
+        content_type=sniffed['content_type'],
+        size_bytes=size,
+    )
+    db.session.add(doc)
+    return doc
 
 
 @app.route('/api/clients/<int:client_id>/documents', methods=['GET'])
@@ -1213,37 +3119,215 @@ def list_client_documents(client_id):
 @jwt_required()
 @limiter.limit("20 per minute")
 def upload_client_document(client_id):
+    """Sube un documento en una petición.
+
+    Admite ``multipart/form-data`` (campo ``file``) o el fichero como cuerpo
+    crudo con ``?filename=``; este último se escribe según llega, sin pasar
+    por el parser multipart. El tipo se decide por los primeros bytes, no
+    por la extensión ni el mimetype declarado. Para ficheros grandes usar
+    ``/documents/uploads`` (subida reanudable por trozos).
+    """
     Client.query.get_or_404(client_id)
-    if 'file' not in request.files:
-        return jsonify({'error': 'Fichero requerido (campo file)'}), 400
-    file = request.files['file']
-    if file.filename == '':
+    if request.content_length and request.content_length > CLIENT_DOC_MAX_BYTES + 64 * 1024:
+        abort(413, description=f'Fichero demasiado grande (máximo {CLIENT_DOC_MAX_BYTES // (1024 * 1024)} MB)')
+    if request.mimetype == 'multipart/form-data':
+        if 'file' not in request.files:
+            return jsonify({'error': 'Fichero requerido (campo file)'}), 400
+        file = request.files['file']
+        filename, stream = file.filename, file.stream
+    else:
+        filename, stream = request.args.get('filename', ''), request.stream
+    safe_name = secure_filename(filename or '')
+    if safe_name == '':
         return jsonify({'error': 'Nombre de fichero vacío'}), 400
-    safe_name = secure_filename(file.filename)
-    category, ok = _allowed_category_and_mime(safe_name, file.mimetype or '')
-    if not ok:
-        return jsonify({'error': 'Tipo de archivo no permitido (PDF o imagen)'}), 400
-    # Guardar con nombre único para evitar colisiones
-    base_dir = _client_upload_dir(client_id)
-    subdir = 'documents' if category == 'document' else 'images'
-    unique_name = f"{uuid4().hex}_{safe_name}"
-    stored_rel = os.path.join(str(client_id), subdir, unique_name)
-    stored_abs = os.path.join(UPLOADS_ROOT, stored_rel)
-    file.save(stored_abs)
-    size_bytes = os.path.getsize(stored_abs)
-    doc = ClientDocument(
-        client_id=client_id,
-        category=category,
-        filename=safe_name,
-        stored_path=stored_rel,
-        content_type=file.mimetype or 'application/octet-stream',
-        size_bytes=size_bytes,
-    )
-    db.session.add(doc)
-    db.session.commit()
+    # Un solo paso: se valida, se hashea y se escribe a la vez; contenidos idénticos se guardan una vez
+    sniffed = {}
+    with _blob_commit():
+        sha, size_bytes, stored_rel = _blob_put(_checked_upload(_iter_stream(stream), sniffed))
+        doc = _create_client_document(client_id, safe_name, sniffed, sha, size_bytes, stored_rel)
     return jsonify({'id': doc.id}), 201
 
 
+def _upload_session_paths(upload_id: str) -> tuple:
+    if not _UPLOAD_ID_RE.match(upload_id or ''):
+        abort(404)
+    base = os.path.join(UPLOADS_ROOT, UPLOAD_SESSIONS_DIR, upload_id)
+    return base + '.json', base + '.part'
+
+
+def _load_upload_session(client_id: int, upload_id: str) -> tuple:
+    meta_path, part_path = _upload_session_paths(upload_id)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        abort(404)
+    if meta.get('client_id') != client_id:
+        abort(404)
+    return meta, part_path
+
+
+def _drop_upload_session(upload_id: str) -> None:
+    for path in _upload_session_paths(upload_id):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _purge_stale_upload_sessions() -> None:
+    """Drop resumable uploads with no activity for ``UPLOAD_SESSION_TTL``.
+
+    Una sesión caduca entera (``.json`` y ``.part`` juntos) según el mtime
+    más reciente de los dos: el ``.json`` solo se escribe al abrirla y el
+    ``.part`` se toca con cada trozo.
+    """
+    sessions_dir = os.path.join(UPLOADS_ROOT, UPLOAD_SESSIONS_DIR)
+    cutoff = time.time() - UPLOAD_SESSION_TTL
+    try:
+        entries = list(os.scandir(sessions_dir))
+    except OSError:
+        return
+    last_activity = {}
+    for entry in entries:
+        upload_id, ext = os.path.splitext(entry.name)
+        if ext not in ('.json', '.part') or not _UPLOAD_ID_RE.match(upload_id):
+            continue
+        try:
+            mtime = entry.stat().st_mtime
+        except OSError:
+            continue
+        last_activity[upload_id] = max(mtime, last_activity.get(upload_id, mtime))
+    for upload_id, mtime in last_activity.items():
+        if mtime < cutoff:
+            _drop_upload_session(upload_id)
+
+
+def _upload_session_payload(upload_id: str, meta: dict, part_path: str) -> dict:
+    return {
+        'upload_id': upload_id,
+        'filename': meta['filename'],
+        'size': meta.get('size'),
+        'offset': os.path.getsize(part_path) if os.path.exists(part_path) else 0,
+        'chunk_size': min(UPLOAD_CHUNK_SIZE, app.config.get('MAX_CONTENT_LENGTH') or UPLOAD_CHUNK_SIZE),
+        'max_bytes': CLIENT_DOC_MAX_BYTES,
+    }
+
+
+@app.post('/api/clients/<int:client_id>/documents/uploads')
+@jwt_required()
+@limiter.limit("20 per minute")
+def init_client_document_upload(client_id):
+    """Abre una subida reanudable: ``{filename, size?}`` -> ``{upload_id, offset, chunk_size}``.
+
+    Después: ``PUT .../uploads/<id>?offset=N`` con cada trozo como cuerpo
+    crudo, ``GET .../uploads/<id>`` para saber desde dónde reanudar,
+    ``POST .../uploads/<id>/commit`` para crear el documento y ``DELETE``
+    para cancelar. Las sesiones sin actividad caducan en
+    ``UPLOAD_SESSION_TTL_HOURS``.
+    """
+    Client.query.get_or_404(client_id)
+    data = request.get_json(silent=True) or {}
+    safe_name = secure_filename(str(data.get('filename') or ''))
+    if safe_name == '':
+        return jsonify({'error': 'Nombre de fichero vacío'}), 400
+    size = data.get('size')
+    if size is not None:
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'size inválido'}), 400
+        if size <= 0:
+            return jsonify({'error': 'size inválido'}), 400
+        if size > CLIENT_DOC_MAX_BYTES:
+            abort(413, description=f'Fichero demasiado grande (máximo {CLIENT_DOC_MAX_BYTES // (1024 * 1024)} MB)')
+    _purge_stale_upload_sessions()
+    upload_id = uuid4().hex
+    meta_path, part_path = _upload_session_paths(upload_id)
+    os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+    meta = {'client_id': client_id, 'filename': safe_name, 'size': size, 'created_at': datetime.utcnow().isoformat()}
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    open(part_path, 'wb').close()
+    return jsonify(_upload_session_payload(upload_id, meta, part_path)), 201
+
+
+@app.get('/api/clients/<int:client_id>/documents/uploads/<upload_id>')
+@jwt_required()
+def get_client_document_upload(client_id, upload_id):
+    meta, part_path = _load_upload_session(client_id, upload_id)
+    return jsonify(_upload_session_payload(upload_id, meta, part_path))
+
+
+@app.put('/api/clients/<int:client_id>/documents/uploads/<upload_id>')
+@jwt_required()
+@limiter.limit("300 per minute")
+def append_client_document_upload(client_id, upload_id):
+    """Añade un trozo en ``?offset=N``; si no coincide con lo recibido devuelve 409 y el offset actual."""
+    meta, part_path = _load_upload_session(client_id, upload_id)
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'error': 'offset requerido'}), 400
+    with open(part_path, 'ab') as f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return jsonify({'error': 'Otro trozo de esta subida está en curso'}), 409
+        current = f.seek(0, os.SEEK_END)
+        if offset != current:
+            return jsonify({'error': 'offset no coincide', 'offset': current}), 409
+        sniffed = {}
+        try:
+            for chunk in _checked_upload(_iter_stream(request.stream), sniffed, offset):
+                f.write(chunk)
+        except HTTPException as exc:
+            if exc.code in (413, 415):
+                f.close()
+                _drop_upload_session(upload_id)
+            else:
+                # Trozo incompleto (conexión cortada): se descarta para poder reanudar en ``offset``
+                f.truncate(offset)
+            raise
+        received = f.tell()
+    if meta.get('size') and received > meta['size']:
+        _drop_upload_session(upload_id)
+        return jsonify({'error': 'Se recibieron más bytes que el tamaño declarado'}), 400
+    return jsonify({'upload_id': upload_id, 'offset': received})
+
+
+@app.post('/api/clients/<int:client_id>/documents/uploads/<upload_id>/commit')
+@jwt_required()
+@limiter.limit("20 per minute")
+def commit_client_document_upload(client_id, upload_id):
+    meta, part_path = _load_upload_session(client_id, upload_id)
+    size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if size == 0:
+        return jsonify({'error': 'Fichero vacío'}), 400
+    if meta.get('size') and size != meta['size']:
+        return jsonify({'error': 'Subida incompleta', 'offset': size}), 409
+    digest = hashlib.sha256()
+    sniffed = {}
+    with open(part_path, 'rb') as f:
+        for chunk in _checked_upload(_iter_stream(f), sniffed):
+            digest.update(chunk)
+    sha = digest.hexdigest()
+    with _blob_commit():
+        stored_rel = _blob_adopt(part_path, sha, size)
+        doc = _create_client_document(client_id, meta['filename'], sniffed, sha, size, stored_rel)
+    _drop_upload_session(upload_id)
+    return jsonify({'id': doc.id}), 201
+
+
+@app.delete('/api/clients/<int:client_id>/documents/uploads/<upload_id>')
+@jwt_required()
+def abort_client_document_upload(client_id, upload_id):
+    _load_upload_session(client_id, upload_id)
+    _drop_upload_session(upload_id)
+    return jsonify({'status': 'deleted'})
+
+
 @app.route('/api/clients/<int:client_id>/documents/<int:doc_id>', methods=['GET'])
 @jwt_required()
 @limiter.limit("100 per minute")
@@ -1253,13 +3337,18 @@ def get_client_document(client_id, doc_id):
     if not os.path.isfile(abs_path):
         abort(404)
     dl_flag = (request.args.get('dl', '') or '').lower() in ('1','true','yes')
+    # ETag fuerte = hash del contenido (el blob es inmutable). conditional=True
+    # responde 304 a If-None-Match y 206 a Range/If-Range, para que el visor
+    # de PDF del navegador pueda pedir páginas sueltas.
     resp = send_file(
         abs_path,
         mimetype=doc.content_type,
         as_attachment=dl_flag,
         download_name=doc.filename,
+        etag=doc.sha256 or _static_file_sha256(abs_path),
+        conditional=True,
     )
-    resp.headers['Cache-Control'] = 'private, no-store'
+    resp.headers['Cache-Control'] = 'private, no-cache'
     return resp
 
 
@@ -1267,14 +3356,10 @@ def get_client_document(client_id, doc_id):
 @jwt_required()
 def delete_client_document(client_id, doc_id):
     doc = ClientDocument.query.filter_by(id=doc_id, client_id=client_id).first_or_404()
-    abs_path = os.path.join(UPLOADS_ROOT, doc.stored_path)
-    try:
-        if os.path.isfile(abs_path):
-            os.remove(abs_path)
-    except Exception:
-        pass
+    released = _blob_release(doc)
     db.session.delete(doc)
     db.session.commit()
+    _blob_unlink(released)
     return jsonify({'status': 'deleted'})
 
 
@@ -1282,8 +3367,6 @@ def delete_client_document(client_id, doc_id):
 @jwt_required()
 def list_invoices_by_client(client_id):
     Client.query.get_or_404(client_id)
-    limit = request.args.get('limit', type=int, default=10)
-    offset = request.args.get('offset', type=int, default=0)
     sort = (request.args.get('sort') or 'id').strip()
     direction = (request.args.get('dir') or 'desc').strip().lower()
     allowed_sort = {'id', 'date', 'total', 'tax_total', 'number'}
@@ -1291,12 +3374,10 @@ def list_invoices_by_client(client_id):
         sort = 'id'
     if direction not in {'asc', 'desc'}:
         direction = 'desc'
-    sort_col = getattr(Invoice, sort)
-    if direction == 'desc':
-        sort_col = sort_col.desc()
-    q = Invoice.query.filter_by(client_id=client_id).order_by(sort_col)
-    total = q.count()
-    invs = q.offset(offset).limit(limit).all()
+    try:
+        invs, page = _paginate_listing(Invoice.query.filter_by(client_id=client_id), Invoice, sort, direction, request.args)
+    except ValueError:
+        return jsonify({'error': 'cursor inválido'}), 400
     return jsonify({
         'items': [
             {
@@ -1308,7 +3389,7 @@ def list_invoices_by_client(client_id):
                 'tax_total': inv.tax_total,
             } for inv in invs
         ],
-        'total': total,
+        **page,
     })
 
 
@@ -1395,8 +3476,6 @@ def list_products():
     if request.method == 'OPTIONS':
         return '', 200
     
-    limit = request.args.get('limit', type=int, default=10)
-    offset = request.args.get('offset', type=int, default=0)
     q = (request.args.get('q') or '').strip()
     category = (request.args.get('category') or '').strip()
     model = (request.args.get('model') or '').strip()
@@ -1412,19 +3491,19 @@ def list_products():
     if model:
         query = query.filter(Product.model.ilike(model))
     if q:
-        like = f"%{q}%"
-        query = query.filter(db.or_(Product.model.ilike(like), Product.category.ilike(like), Product.sku.ilike(like)))
+        ids = _search_ids_select('product', q)
+        if ids is not None:
+            query = query.filter(Product.id.in_(ids))
     # Por defecto devolver solo activos; si active=0 devuelve archivados; si active=1 activos
     if active_param in {'0','1'}:
         query = query.filter(Product.is_active == (active_param == '1'))
     else:
         query = query.filter(Product.is_active == True)  # noqa: E712
-    sort_col = getattr(Product, sort)
-    if direction == 'desc': sort_col = sort_col.desc()
-    query = query.order_by(sort_col)
-    total = query.count()
-    rows = query.offset(offset).limit(limit).all()
-    return jsonify({'items': [_product_to_dict(p) for p in rows], 'total': total})
+    try:
+        rows, page = _paginate_listing(query, Product, sort, direction, request.args)
+    except ValueError:
+        return jsonify({'error': 'cursor inválido'}), 400
+    return jsonify({'items': [_product_to_dict(p) for p in rows], **page})
 
 
 @app.route('/api/products/<int:pid>', methods=['GET'])
@@ -1618,7 +3697,7 @@ def upload_product_image():
         return jsonify({'error': f'Extensión no permitida. Usa: {", ".join(allowed_extensions)}'}), 400
     
     # Crear directorio si no existe
-    upload_dir = os.path.join('static', 'uploads', 'products')
+    upload_dir = PRODUCT_IMAGES_DIR
     os.makedirs(upload_dir, exist_ok=True)
     
     # Generar nombre único para el archivo
@@ -1644,10 +3723,10 @@ def upload_product_image():
         print(f"⚠️ DEBUG: Error al leer product.images: {e}")
         current_images = []
     
-    current_images.append({
-        'url': image_url,
-        'alt': file.filename
-    })
+    # Variantes WebP (miniatura/media/completa) en segundo plano; hasta que
+    # existan, sus URLs sirven el original
+    image_entry = _product_image_entry(unique_filename, file.filename)
+    current_images.append(image_entry)
     product.images = current_images
     
     # Marcar el atributo como modificado para que SQLAlchemy lo actualice
@@ -1655,28 +3734,20 @@ def upload_product_image():
     flag_modified(product, 'images')
     
     db.session.commit()
+    _schedule_product_image_variants(unique_filename)
     
     print(f"✅ DEBUG: Base de datos actualizada")
     
-    return jsonify({
-        'url': image_url,
-        'alt': file.filename,
-        'status': 'ok'
-    })
+    return jsonify({**image_entry, 'status': 'ok'})
 
 @app.get('/api/contracts/templates/<template_id>/placeholders')
 @jwt_required()
 def get_template_placeholders(template_id):
     """Get placeholders from a specific template."""
-    templates = {
-        'compraventa': 'Contrato_Compraventa_Plazos_NIOXTEC_v5.docx',
-        'renting': 'Plantilla_Contrato_Renting_Firma_Datos_v2.docx'
-    }
-    
-    if template_id not in templates:
+    if template_id not in CONTRACT_TEMPLATE_FILES:
         return jsonify({'error': 'Template not found'}), 404
     
-    result = extract_placeholders_from_docx(templates[template_id])
+    result = extract_placeholders_from_docx(CONTRACT_TEMPLATE_FILES[template_id])
     
     if 'error' in result:
         return jsonify(result), 400
@@ -1720,6 +3791,7 @@ def get_company_config():
 def update_invoice(invoice_id):
     inv = Invoice.query.get_or_404(invoice_id)
     data = request.get_json(force=True)
+    previous_date = inv.date
     # Basic fields
     # Ya no permitimos cambiar el número arbitrariamente para mantener la secuencia
     if 'date' in data:
@@ -1754,8 +3826,8 @@ def update_invoice(invoice_id):
         inv.total = total
         inv.tax_total = tax_amount
         db.session.flush()
-        for item in items_data:
-            line = InvoiceItem(
+        _insert_rows(InvoiceItem, [
+            dict(
                 invoice_id=inv.id,
                 description=item['description'],
                 units=item['units'],
@@ -1764,12 +3836,15 @@ def update_invoice(invoice_id):
                 subtotal=item['units'] * item['unit_price'],
                 total=item['units'] * item['unit_price'] * (1 + item['tax_rate'] / 100)
             )
-            db.session.add(line)
+            for item in items_data
+        ])
+    _refresh_report_rollups('income', previous_date, inv.date)
     try:
         db.session.commit()
     except IntegrityError:
         db.session.rollback()
         return jsonify({'error': 'El número de factura ya existe'}), 409
+    _invalidate_invoice_pdf_cache(inv.id)
     return jsonify({'status': 'ok'})
 
 
@@ -1782,6 +3857,7 @@ def update_invoice_paid(invoice_id):
     data = request.get_json(silent=True) or {}
     paid_value = bool(data.get('paid'))
     inv.paid = paid_value
+    _refresh_report_rollups('income', inv.date)
     db.session.commit()
     return jsonify({'status': 'ok', 'paid': bool(inv.paid)})
 
@@ -1795,7 +3871,7 @@ def convert_proforma(invoice_id):
     - Copia líneas/items
     - La proforma original NO se modifica ni elimina
     """
-    inv = Invoice.query.get_or_404(invoice_id)
+    inv = _load_invoice_or_404(invoice_id, with_client=False)
     if inv.type == 'factura':
         return jsonify({'error': 'El documento ya es una factura'}), 400
 
@@ -1808,8 +3884,9 @@ def convert_proforma(invoice_id):
     # 1) Validar stock por cada línea con product_id
     items_with_product = [it for it in inv.items if getattr(it, 'product_id', None)]
     products_and_qty: list[tuple[Product, int]] = []
+    products = _products_by_id(it.product_id for it in items_with_product)
     for it in items_with_product:
-        prod = Product.query.get(it.product_id)
+        prod = products.get(it.product_id)
         if not prod:
             return jsonify({'error': f'Producto {it.product_id} no existe', 'code': 400}), 400
         qty = int(it.units)
@@ -1834,24 +3911,28 @@ def convert_proforma(invoice_id):
     db.session.flush()
 
     # 3) Copiar líneas de la proforma a la nueva factura
-    for it in inv.items:
-        line_subtotal = it.units * it.unit_price
-        line_total = line_subtotal * (1 + it.tax_rate / 100)
-        db.session.add(InvoiceItem(
+    _insert_rows(InvoiceItem, [
+        dict(
             invoice_id=new_inv.id,
             product_id=getattr(it, 'product_id', None),
             description=it.description,
             units=it.units,
             unit_price=it.unit_price,
             tax_rate=it.tax_rate,
-            subtotal=line_subtotal,
-            total=line_total,
-        ))
+            subtotal=it.units * it.unit_price,
+            total=it.units * it.unit_price * (1 + it.tax_rate / 100),
+        )
+        for it in inv.items
+    ])
 
     # 4) Descontar stock y registrar movimientos asociados a la nueva factura
     for prod, qty in products_and_qty:
         prod.stock_qty = int(prod.stock_qty or 0) - int(qty)
-        db.session.add(StockMovement(product_id=prod.id, qty=-int(qty), type='sale', invoice_id=new_inv.id))
+    _insert_rows(StockMovement, [
+        dict(product_id=prod.id, qty=-int(qty), type='sale', invoice_id=new_inv.id)
+        for prod, qty in products_and_qty
+    ])
+    _refresh_report_rollups('income', new_inv.date)
     try:
         db.session.commit()
     except IntegrityError:
@@ -1875,34 +3956,38 @@ def convert_proforma(invoice_id):
     })
 
 
+def _rollup_by_month(kind: str, year: int) -> dict:
+    """{month: total} for one year, read from report_rollup (≤ 366 filas)."""
+    rows = (db.session.query(ReportRollup.month, db.func.sum(ReportRollup.total))
+            .filter(ReportRollup.kind == kind, ReportRollup.year == year)
+            .group_by(ReportRollup.month)
+            .order_by(ReportRollup.month)
+            .all())
+    return {int(m): float(t or 0) for m, t in rows}
+
+
+def _rollup_by_day(kind: str, year: int, month: int) -> dict:
+    """{'YYYY-MM-DD': total} for one month, read from report_rollup."""
+    rows = (db.session.query(ReportRollup.day, ReportRollup.total)
+            .filter(ReportRollup.kind == kind, ReportRollup.year == year, ReportRollup.month == month)
+            .order_by(ReportRollup.day)
+            .all())
+    return {f'{year:04d}-{month:02d}-{int(d):02d}': float(t or 0) for d, t in rows}
+
+
+def _rollup_month_total(kind: str, year: int, month: int) -> float:
+    result = (db.session.query(db.func.sum(ReportRollup.total))
+              .filter(ReportRollup.kind == kind, ReportRollup.year == year, ReportRollup.month == month)
+              .scalar())
+    return float(result or 0)
+
+
 @app.route('/api/reports/summary')
 @jwt_required()
 def reports_summary():
     year = request.args.get('year', type=int, default=datetime.utcnow().year)
-    # Sum totals by month for invoices type 'factura'
-    rows = []
-    try:
-        rows = (
-            db.session.query(db.extract('month', Invoice.date).label('month'), db.func.sum(Invoice.total))
-            .filter(db.extract('year', Invoice.date) == year)
-            .filter(Invoice.type == 'factura')
-            .filter(Invoice.paid.is_(True))
-            .group_by('month')
-            .order_by('month')
-            .all()
-        )
-    except Exception:
-        # SQLite fallback using strftime
-        rows = db.session.execute(
-            text("""
-                SELECT CAST(STRFTIME('%m', date) AS INTEGER) AS month, SUM(total)
-                FROM invoice
-                WHERE type = 'factura' AND paid = 1 AND CAST(STRFTIME('%Y', date) AS INTEGER) = :year
-                GROUP BY month
-                ORDER BY month
-            """), { 'year': year }
-        ).fetchall()
-    by_month = {int(m): float(t or 0) for m, t in rows}
+    # Sum totals by month for invoices type 'factura' (paid)
+    by_month = _rollup_by_month('income', year)
     total_year = sum(by_month.values())
     return jsonify({'year': year, 'by_month': by_month, 'total_year': total_year})
 
@@ -1914,30 +3999,7 @@ def reports_heatmap():
     month = request.args.get('month', type=int)
     if not year or not month:
         return jsonify({'error': 'Parámetros year y month requeridos'}), 400
-    try:
-        rows = (
-            db.session.query(Invoice.date, db.func.sum(Invoice.total))
-            .filter(db.extract('year', Invoice.date) == year)
-            .filter(db.extract('month', Invoice.date) == month)
-            .filter(Invoice.type == 'factura')
-            .filter(Invoice.paid.is_(True))
-            .group_by(Invoice.date)
-            .all()
-        )
-    except Exception:
-        rows = db.session.execute(
-            text("""
-                SELECT date as d, SUM(total) as t
-                FROM invoice
-                WHERE type = 'factura'
-                  AND paid = 1
-                  AND CAST(STRFTIME('%Y', date) AS INTEGER) = :year
-                  AND CAST(STRFTIME('%m', date) AS INTEGER) = :month
-                GROUP BY d
-                ORDER BY d
-            """), { 'year': year, 'month': month }
-        ).fetchall()
-    by_day = {d.strftime('%Y-%m-%d'): float(t or 0) for d, t in rows}
+    by_day = _rollup_by_day('income', year, month)
     return jsonify({'year': year, 'month': month, 'by_day': by_day})
 
 
@@ -1946,27 +4008,7 @@ def reports_heatmap():
 def reports_expenses_summary():
     year = request.args.get('year', type=int, default=datetime.utcnow().year)
     # Sum totals by month for expenses
-    rows = []
-    try:
-        rows = (
-            db.session.query(db.extract('month', Expense.date).label('month'), db.func.sum(Expense.total))
-            .filter(db.extract('year', Expense.date) == year)
-            .group_by('month')
-            .order_by('month')
-            .all()
-        )
-    except Exception:
-        # SQLite fallback using strftime
-        rows = db.session.execute(
-            text("""
-                SELECT CAST(STRFTIME('%m', date) AS INTEGER) AS month, SUM(total)
-                FROM expense
-                WHERE CAST(STRFTIME('%Y', date) AS INTEGER) = :year
-                GROUP BY month
-                ORDER BY month
-            """), { 'year': year }
-        ).fetchall()
-    by_month = {int(m): float(t or 0) for m, t in rows}
+    by_month = _rollup_by_month('expense', year)
     total_year = sum(by_month.values())
     return jsonify({'year': year, 'by_month': by_month, 'total_year': total_year})
 
@@ -1978,26 +4020,7 @@ def reports_expenses_heatmap():
     month = request.args.get('month', type=int)
     if not year or not month:
         return jsonify({'error': 'Parámetros year y month requeridos'}), 400
-    try:
-        rows = (
-            db.session.query(Expense.date, db.func.sum(Expense.total))
-            .filter(db.extract('year', Expense.date) == year)
-            .filter(db.extract('month', Expense.date) == month)
-            .group_by(Expense.date)
-            .all()
-        )
-    except Exception:
-        rows = db.session.execute(
-            text("""
-                SELECT date as d, SUM(total) as t
-                FROM expense
-                WHERE CAST(STRFTIME('%Y', date) AS INTEGER) = :year
-                  AND CAST(STRFTIME('%m', date) AS INTEGER) = :month
-                GROUP BY d
-                ORDER BY d
-            """), { 'year': year, 'month': month }
-        ).fetchall()
-    by_day = {d.strftime('%Y-%m-%d'): float(t or 0) for d, t in rows}
+    by_day = _rollup_by_day('expense', year, month)
     return jsonify({'year': year, 'month': month, 'by_day': by_day})
 
 
@@ -2006,53 +4029,13 @@ def reports_expenses_heatmap():
 def reports_combined_summary():
     year = request.args.get('year', type=int, default=datetime.utcnow().year)
     
-    # Get income data by month
-    income_rows = []
-    try:
-        income_rows = (
-            db.session.query(db.extract('month', Invoice.date).label('month'), db.func.sum(Invoice.total))
-            .filter(db.extract('year', Invoice.date) == year)
-            .filter(Invoice.type == 'factura')
-            .filter(Invoice.paid.is_(True))
-            .group_by('month')
-            .order_by('month')
-            .all()
-        )
-    except Exception:
-        income_rows = db.session.execute(
-            text("""
-                SELECT CAST(STRFTIME('%m', date) AS INTEGER) AS month, SUM(total)
-                FROM invoice
-                WHERE type = 'factura' AND paid = 1 AND CAST(STRFTIME('%Y', date) AS INTEGER) = :year
-                GROUP BY month
-                ORDER BY month
-            """), { 'year': year }
-        ).fetchall()
-    
-    # Get expenses data by month
-    expenses_rows = []
-    try:
-        expenses_rows = (
-            db.session.query(db.extract('month', Expense.date).label('month'), db.func.sum(Expense.total))
-            .filter(db.extract('year', Expense.date) == year)
-            .group_by('month')
-            .order_by('month')
-            .all()
-        )
-    except Exception:
-        expenses_rows = db.session.execute(
-            text("""
-                SELECT CAST(STRFTIME('%m', date) AS INTEGER) AS month, SUM(total)
-                FROM expense
-                WHERE CAST(STRFTIME('%Y', date) AS INTEGER) = :year
-                GROUP BY month
-                ORDER BY month
-            """), { 'year': year }
-        ).fetchall()
-    
-    # Create combined data structure
-    income_by_month = {int(m): float(t or 0) for m, t in income_rows}
-    expenses_by_month = {int(m): float(t or 0) for m, t in expenses_rows}
+    # Income and expenses by month in a single grouped query over the rollups
+    rows = (db.session.query(ReportRollup.kind, ReportRollup.month, db.func.sum(ReportRollup.total))
+            .filter(ReportRollup.year == year)
+            .group_by(ReportRollup.kind, ReportRollup.month)
+            .all())
+    income_by_month = {int(m): float(t or 0) for k, m, t in rows if k == 'income'}
+    expenses_by_month = {int(m): float(t or 0) for k, m, t in rows if k == 'expense'}
     
     # Calculate profit (income - expenses) for each month
     profit_by_month = {}
@@ -2083,51 +4066,8 @@ def reports_monthly_summary():
     year = request.args.get('year', type=int, default=datetime.utcnow().year)
     month = request.args.get('month', type=int, default=datetime.utcnow().month)
     
-    # Get income data for the specific month
-    income_month = 0
-    try:
-        result = (
-            db.session.query(db.func.sum(Invoice.total))
-            .filter(db.extract('year', Invoice.date) == year)
-            .filter(db.extract('month', Invoice.date) == month)
-            .filter(Invoice.type == 'factura')
-            .filter(Invoice.paid.is_(True))
-            .scalar()
-        )
-        income_month = float(result or 0)
-    except Exception:
-        result = db.session.execute(
-            text("""
-                SELECT SUM(total)
-                FROM invoice
-                WHERE type = 'factura'
-                  AND paid = 1
-                  AND CAST(STRFTIME('%Y', date) AS INTEGER) = :year
-                  AND CAST(STRFTIME('%m', date) AS INTEGER) = :month
-            """), { 'year': year, 'month': month }
-        ).scalar()
-        income_month = float(result or 0)
-    
-    # Get expenses data for the specific month
-    expenses_month = 0
-    try:
-        result = (
-            db.session.query(db.func.sum(Expense.total))
-            .filter(db.extract('year', Expense.date) == year)
-            .filter(db.extract('month', Expense.date) == month)
-            .scalar()
-        )
-        expenses_month = float(result or 0)
-    except Exception:
-        result = db.session.execute(
-            text("""
-                SELECT SUM(total)
-                FROM expense
-                WHERE CAST(STRFTIME('%Y', date) AS INTEGER) = :year
-                  AND CAST(STRFTIME('%m', date) AS INTEGER) = :month
-            """), { 'year': year, 'month': month }
-        ).scalar()
-        expenses_month = float(result or 0)
+    income_month = _rollup_month_total('income', year, month)
+    expenses_month = _rollup_month_total('expense', year, month)
     
     # Calculate profit for the month
     profit_month = income_month - expenses_month
@@ -2141,73 +4081,209 @@ def reports_monthly_summary():
     })
 
 
-def _csv_response(filename: str, content: str) -> Response:
+@app.route('/api/reports/dashboard')
+@jwt_required()
+def reports_dashboard():
+    """Todo lo que pinta la página de Reportes en una sola respuesta.
+
+    Dos consultas agrupadas sobre report_rollup: totales por (kind, mes) del
+    año y por (kind, día) del mes.  Responde con ``ETag`` (hash del payload)
+    y ``Cache-Control: private, no-cache``: las recargas revalidan con
+    ``If-None-Match`` y reciben 304 sin cuerpo si nada ha cambiado.
+    """
+    now = datetime.utcnow()
+    year = request.args.get('year', type=int, default=now.year)
+    month = request.args.get('month', type=int, default=now.month)
+    if not 1 <= month <= 12:
+        return jsonify({'error': 'month debe estar entre 1 y 12'}), 400
+
+    by_month = {'income': {}, 'expense': {}}
+    rows = (db.session.query(ReportRollup.kind, ReportRollup.month, db.func.sum(ReportRollup.total))
+            .filter(ReportRollup.year == year)
+            .group_by(ReportRollup.kind, ReportRollup.month)
+            .all())
+    for kind, m, t in rows:
+        by_month.setdefault(kind, {})[int(m)] = float(t or 0)
+
+    by_day = {'income': {}, 'expense': {}}
+    rows = (db.session.query(ReportRollup.kind, ReportRollup.day, ReportRollup.total)
+            .filter(ReportRollup.year == year, ReportRollup.month == month)
+            .order_by(ReportRollup.day)
+            .all())
+    for kind, d, t in rows:
+        by_day.setdefault(kind, {})[f'{year:04d}-{month:02d}-{int(d):02d}'] = float(t or 0)
+
+    income_by_month = by_month['income']
+    expenses_by_month = by_month['expense']
+    profit_by_month = {m: income_by_month.get(m, 0) - expenses_by_month.get(m, 0) for m in range(1, 13)}
+    total_income = sum(income_by_month.values())
+    total_expenses = sum(expenses_by_month.values())
+    income_month = income_by_month.get(month, 0.0)
+    expenses_month = expenses_by_month.get(month, 0.0)
+
+    payload = {
+        'year': year,
+        'month': month,
+        'income_by_month': income_by_month,
+        'expenses_by_month': expenses_by_month,
+        'profit_by_month': profit_by_month,
+        'total_income': total_income,
+        'total_expenses': total_expenses,
+        'total_profit': total_income - total_expenses,
+        'income_month': income_month,
+        'expenses_month': expenses_month,
+        'profit_month': income_month - expenses_month,
+        'heatmap': {'income': by_day['income'], 'expenses': by_day['expense']},
+    }
+    resp = jsonify(payload)
+    resp.set_etag(hashlib.sha256(resp.get_data()).hexdigest())
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp.make_conditional(request)
+
+
+class _CsvLineBuffer:
+    """Pseudo-file for ``csv.writer``: ``write`` hands the line back instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+CSV_EXPORT_BATCH = int(os.getenv('CSV_EXPORT_BATCH', '1000'))
+
+
+def _csv_stream_response(filename: str, header: list, rows) -> Response:
+    """Stream ``rows`` (iterable of tuples, consumed lazily) as a CSV attachment.
+
+    ``csv.writer`` handles quoting; lines are yielded in chunks of
+    ``CSV_EXPORT_BATCH`` so memory stays flat whatever the table size.
+    """
+    writer = csv.writer(_CsvLineBuffer(), lineterminator='\n')
+
+    def generate():
+        chunk = [writer.writerow(header)]
+        for row in rows:
+            chunk.append(writer.writerow(row))
+            if len(chunk) >= CSV_EXPORT_BATCH:
+                yield ''.join(chunk)
+                chunk = []
+        if chunk:
+            yield ''.join(chunk)
+
     return Response(
-        content,
+        stream_with_context(generate()),
         mimetype='text/csv',
         headers={'Content-Disposition': f'attachment; filename="{filename}"'}
     )
 
 
+def _export_rows(query, *columns):
+    """Selected columns of ``query`` ordered by id, fetched in ``yield_per`` batches."""
+    return query.with_entities(*columns).order_by(columns[0]).yield_per(CSV_EXPORT_BATCH)
+
+
 @app.route('/api/clients/export')
 @jwt_required()
 @limiter.limit("10 per minute")
 def export_clients():
-    clients = Client.query.order_by(Client.id).all()
-    lines = ['id,name,cif,address,email,phone,iban,created_at']
-    for c in clients:
-        lines.append(
-            f'{c.id},"{c.name}",{c.cif},"{c.address}",{c.email},{c.phone},{c.iban or ""},{(c.created_at or "")}'
-        )
-    return _csv_response('clientes.csv', '\n'.join(lines))
+    """CSV de clientes (acepta los filtros del listado: ``q``)."""
+    rows = _export_rows(_clients_query(request.args), Client.id, Client.name, Client.cif, Client.address,
+                        Client.email, Client.phone, Client.iban, Client.created_at)
+    header = ['id', 'name', 'cif', 'address', 'email', 'phone', 'iban', 'created_at']
+    return _csv_stream_response('clientes.csv', header, rows)
 
 
 @app.route('/api/invoices/export')
 @jwt_required()
 @limiter.limit("10 per minute")
 def export_invoices():
-    invoices = Invoice.query.order_by(Invoice.id).all()
-    lines = ['id,number,date,type,client_id,total,tax_total']
-    for inv in invoices:
-        lines.append(
-            f'{inv.id},{inv.number},{inv.date.isoformat()},{inv.type},{inv.client_id},{inv.total},{inv.tax_total}'
-        )
-    return _csv_response('facturas.csv', '\n'.join(lines))
+    """CSV de facturas (filtros del listado: year/month, from/to, type, q)."""
+    try:
+        query = _invoices_query(request.args)
+    except ValueError:
+        return jsonify({'error': 'Month and year must be integers, from/to YYYY-MM-DD'}), 400
+    rows = _export_rows(query, Invoice.id, Invoice.number, Invoice.date, Invoice.type, Invoice.client_id,
+                        Invoice.total, Invoice.tax_total)
+    header = ['id', 'number', 'date', 'type', 'client_id', 'total', 'tax_total']
+    return _csv_stream_response('facturas.csv', header, rows)
 
 
-@app.route('/api/clients/export_xlsx')
+@app.route('/api/expenses/export')
 @jwt_required()
 @limiter.limit("10 per minute")
-def export_clients_xlsx():
+def export_expenses():
+    """CSV de gastos (filtros del listado: year/month, from/to, q)."""
+    try:
+        query = _expenses_query(request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid date filter: use year/month or from/to (YYYY-MM-DD)'}), 400
+    rows = _export_rows(query, Expense.id, Expense.date, Expense.category, Expense.description, Expense.supplier,
+                        Expense.base_amount, Expense.tax_rate, Expense.total, Expense.paid, Expense.created_at)
+    header = ['id', 'date', 'category', 'description', 'supplier', 'base_amount', 'tax_rate', 'total', 'paid', 'created_at']
+    return _csv_stream_response('gastos.csv', header, rows)
+
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def _xlsx_workbook_response(filename: str, sheets) -> Response:
+    """Send ``sheets`` — iterable of ``(title, header, rows)`` — as an XLSX.
+
+    Built in openpyxl ``write_only`` mode: rows are written to disk as they
+    are appended and the workbook is saved to an anonymous temp file that is
+    streamed back and deleted on close, so memory stays constant whatever the
+    number of rows.
+    """
     # Lazy import to avoid hard dependency if not used
     from openpyxl import Workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Clientes'
-    ws.append(['id','name','cif','address','email','phone','iban','created_at'])
-    for c in Client.query.order_by(Client.id).all():
-        ws.append([c.id, c.name, c.cif, c.address, c.email, c.phone, c.iban or '', c.created_at])
-    bio = io.BytesIO()
-    wb.save(bio)
-    bio.seek(0)
-    return send_file(bio, as_attachment=True, download_name='clientes.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    wb = Workbook(write_only=True)
+    for title, header, rows in sheets:
+        ws = wb.create_sheet(title)
+        ws.append(header)
+        for row in rows:
+            ws.append(row)
+    tmp = tempfile.TemporaryFile(suffix='.xlsx')
+    wb.save(tmp)
+    tmp.seek(0)
+    return send_file(tmp, as_attachment=True, download_name=filename, mimetype=XLSX_MIMETYPE)
+
+
+def _xlsx_export_response(filename: str, title: str, header: list, rows) -> Response:
+    """One-sheet ``_xlsx_workbook_response``."""
+    return _xlsx_workbook_response(filename, [(title, header, rows)])
+
+
+@app.route('/api/clients/export_xlsx')
+@jwt_required()
+@limiter.limit("10 per minute")
+def export_clients_xlsx():
+    """XLSX de clientes (acepta los filtros del listado: ``q``)."""
+    rows = _export_rows(_clients_query(request.args), Client.id, Client.name, Client.cif, Client.address,
+                        Client.email, Client.phone, Client.iban, Client.created_at)
+    return _xlsx_export_response(
+        'clientes.xlsx', 'Clientes',
+        ['id', 'name', 'cif', 'address', 'email', 'phone', 'iban', 'created_at'],
+        ([i, name, cif, address, email, phone, iban or '', created_at]
+         for i, name, cif, address, email, phone, iban, created_at in rows),
+    )
 
 
 @app.route('/api/invoices/export_xlsx')
 @jwt_required()
 @limiter.limit("10 per minute")
 def export_invoices_xlsx():
-    from openpyxl import Workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Facturas'
-    ws.append(['id','number','date','type','client_id','total','tax_total'])
-    for inv in Invoice.query.order_by(Invoice.id).all():
-        ws.append([inv.id, inv.number, inv.date.isoformat(), inv.type, inv.client_id, inv.total, inv.tax_total])
-    bio = io.BytesIO()
-    wb.save(bio)
-    bio.seek(0)
-    return send_file(bio, as_attachment=True, download_name='facturas.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    """XLSX de facturas (filtros del listado: year/month, from/to, type, q)."""
+    try:
+        query = _invoices_query(request.args)
+    except ValueError:
+        return jsonify({'error': 'Month and year must be integers, from/to YYYY-MM-DD'}), 400
+    rows = _export_rows(query, Invoice.id, Invoice.number, Invoice.date, Invoice.type, Invoice.client_id,
+                        Invoice.total, Invoice.tax_total)
+    return _xlsx_export_response(
+        'facturas.xlsx', 'Facturas',
+        ['id', 'number', 'date', 'type', 'client_id', 'total', 'tax_total'],
+        ([i, number, d.isoformat(), doc_type, client_id, total, tax_total]
+         for i, number, d, doc_type, client_id, total, tax_total in rows),
+    )
 
 
 @app.route('/api/expenses', methods=['POST'])
@@ -2268,6 +4344,7 @@ def create_expense():
     )
     
     db.session.add(expense)
+    _refresh_report_rollups('expense', expense.date)
     db.session.commit()
     
     return jsonify({
@@ -2284,47 +4361,58 @@ def create_expense():
     }), 201
 
 
+def _expenses_query(args):
+    """Expense query with the listing filters (date range and ``q``).
+
+    Shared by the list endpoint and the exports.  Raises ValueError on bad dates.
+    """
+    query = Expense.query
+    
+    # Apply date range filter (half-open, uses the Expense.date index)
+    start, end = _date_range_from_args(args)
+    query = _filter_date_range(query, Expense.date, start, end)
+    
+    # Apply search filter
+    q = (args.get('q') or '').strip()
+    if q:
+        ids = _search_ids_select('expense', q)
+        if ids is not None:
+            query = query.filter(Expense.id.in_(ids))
+    return query
+
+
 @app.route('/api/expenses', methods=['GET'])
 @jwt_required()
 def list_expenses():
-    """List expenses with pagination, search and sorting."""
-    limit = request.args.get('limit', type=int, default=10)
-    offset = request.args.get('offset', type=int, default=0)
-    q = request.args.get('q', '')
+    """List expenses with pagination, search, date range and sorting.
+
+    Date filters: ``year``[+``month``] or ``from``/``to`` (YYYY-MM-DD, inclusive).
+    Pagination: ``limit``/``offset`` or ``cursor`` (keyset), ``include_total=0``
+    to skip the count; see ``_paginate_listing``.
+    """
     sort = request.args.get('sort', 'date')
     dir = request.args.get('dir', 'desc')
     
     # Validate sort field
     allowed_sort = {'date', 'total', 'created_at', 'category', 'description', 'supplier'}
-    if sort not in allowed_sort:
-        sort = 'date'
-    
-    # Validate direction
-    if dir not in {'asc', 'desc'}:
-        dir = 'desc'
-    
-    query = Expense.query
-    
-    # Apply search filter
-    if q:
-        search_term = f'%{q}%'
-        query = query.filter(
-            db.or_(
-                Expense.description.ilike(search_term),
-                Expense.supplier.ilike(search_term),
-                Expense.category.ilike(search_term)
-            )
-        )
+    if sort not in allowed_sort:
+        sort = 'date'
     
-    # Apply sorting (with created_at as secondary sort for consistent ordering)
-    sort_field = getattr(Expense, sort)
-    if dir == 'desc':
-        query = query.order_by(sort_field.desc(), Expense.created_at.desc())
-    else:
-        query = query.order_by(sort_field.asc(), Expense.created_at.desc())
+    # Validate direction
+    if dir not in {'asc', 'desc'}:
+        dir = 'desc'
+    
+    try:
+        query = _expenses_query(request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid date filter: use year/month or from/to (YYYY-MM-DD)'}), 400
     
-    total = query.count()
-    expenses = query.offset(offset).limit(limit).all()
+    # Apply sorting (with id as secondary sort for consistent ordering) and
+    # offset or keyset (cursor) pagination
+    try:
+        expenses, page = _paginate_listing(query, Expense, sort, dir, request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
     
     items = []
     for exp in expenses:
@@ -2341,7 +4429,7 @@ def list_expenses():
             'created_at': exp.created_at.isoformat()
         })
     
-    return jsonify({'items': items, 'total': total})
+    return jsonify({'items': items, **page})
 
 
 @app.route('/api/expenses/<int:expense_id>', methods=['PUT'])
@@ -2350,6 +4438,7 @@ def update_expense(expense_id):
     """Update an existing expense record."""
     expense = Expense.query.get_or_404(expense_id)
     data = request.get_json(force=True)
+    previous_date = expense.date
     
     # Update fields with validation
     if 'date' in data:
@@ -2398,6 +4487,7 @@ def update_expense(expense_id):
         except (ValueError, TypeError):
             return jsonify({'error': 'Total must be a valid number'}), 400
     
+    _refresh_report_rollups('expense', previous_date, expense.date)
     db.session.commit()
     
     return jsonify({'status': 'ok'})
@@ -2409,6 +4499,7 @@ def delete_expense(expense_id):
     """Delete an expense record."""
     expense = Expense.query.get_or_404(expense_id)
     db.session.delete(expense)
+    _refresh_report_rollups('expense', expense.date)
     db.session.commit()
     return jsonify({'status': 'deleted'})
 
@@ -2446,95 +4537,306 @@ def get_expense_suppliers():
 @jwt_required()
 @limiter.limit("10 per minute")
 def export_expenses_xlsx():
-    """Export expenses to XLSX file."""
-    from openpyxl import Workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Gastos'
-    ws.append(['id', 'date', 'category', 'description', 'supplier', 'base_amount', 'tax_rate', 'total', 'paid', 'created_at'])
-    for exp in Expense.query.order_by(Expense.id).all():
-        ws.append([
-            exp.id, 
-            exp.date.isoformat(), 
-            exp.category, 
-            exp.description, 
-            exp.supplier, 
-            exp.base_amount, 
-            exp.tax_rate, 
-            exp.total, 
-            exp.paid, 
-            exp.created_at.isoformat()
-        ])
-    bio = io.BytesIO()
-    wb.save(bio)
-    bio.seek(0)
-    return send_file(bio, as_attachment=True, download_name='gastos.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    """Export expenses to XLSX file (same filters as the list: year/month, from/to, q)."""
+    try:
+        query = _expenses_query(request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid date filter: use year/month or from/to (YYYY-MM-DD)'}), 400
+    rows = _export_rows(query, Expense.id, Expense.date, Expense.category, Expense.description, Expense.supplier,
+                        Expense.base_amount, Expense.tax_rate, Expense.total, Expense.paid, Expense.created_at)
+    return _xlsx_export_response(
+        'gastos.xlsx', 'Gastos',
+        ['id', 'date', 'category', 'description', 'supplier', 'base_amount', 'tax_rate', 'total', 'paid', 'created_at'],
+        ([i, d.isoformat(), category, description, supplier, base_amount, tax_rate, total, paid, created_at.isoformat()]
+         for i, d, category, description, supplier, base_amount, tax_rate, total, paid, created_at in rows),
+    )
+
+
+def _vat_summary_rows(invoice_filters, expense_filters) -> list:
+    """VAT by rate: output VAT (invoice lines) against input VAT (expenses).
+
+    Two ``GROUP BY tax_rate`` queries; the merge is over a handful of rates.
+    """
+    output = dict(
+        (rate, (base, tax)) for rate, base, tax in
+        db.session.query(InvoiceItem.tax_rate, db.func.sum(InvoiceItem.subtotal),
+                         db.func.sum(InvoiceItem.total - InvoiceItem.subtotal))
+        .join(Invoice, Invoice.id == InvoiceItem.invoice_id)
+        .filter(*invoice_filters)
+        .group_by(InvoiceItem.tax_rate)
+    )
+    expense_input = dict(
+        (rate, (base, tax)) for rate, base, tax in
+        db.session.query(Expense.tax_rate, db.func.sum(Expense.base_amount),
+                         db.func.sum(Expense.total - Expense.base_amount))
+        .filter(*expense_filters)
+        .group_by(Expense.tax_rate)
+    )
+    rows = []
+    totals = [0.0, 0.0, 0.0, 0.0]
+    for rate in sorted(set(output) | set(expense_input), key=lambda r: float(r or 0)):
+        out_base, out_tax = (float(v or 0) for v in output.get(rate, (0, 0)))
+        in_base, in_tax = (float(v or 0) for v in expense_input.get(rate, (0, 0)))
+        for i, v in enumerate((out_base, out_tax, in_base, in_tax)):
+            totals[i] += v
+        rows.append([float(rate or 0), round(out_base, 2), round(out_tax, 2), round(in_base, 2), round(in_tax, 2),
+                     round(out_tax - in_tax, 2)])
+    rows.append(['Total', *(round(v, 2) for v in totals), round(totals[1] - totals[3], 2)])
+    return rows
+
+
+@app.route('/api/reports/accounting_xlsx')
+@jwt_required()
+@limiter.limit("10 per minute")
+def export_accounting_xlsx():
+    """Libro contable de un periodo en un único XLSX.
+
+    Periodo: ``year``[+``month``] o ``from``/``to`` (YYYY-MM-DD).  ``type``:
+    factura (defecto) | proforma | all.  Hojas: Facturas, Líneas, Gastos y
+    Resumen IVA (repercutido por tipo de ``InvoiceItem`` frente a soportado
+    por tipo de ``Expense``).  Las columnas derivadas y los agregados se
+    calculan en SQL; las filas se leen por lotes y se escriben en streaming.
+    """
+    try:
+        start, end = _date_range_from_args(request.args)
+    except ValueError:
+        return jsonify({'error': 'Parámetros de fecha inválidos (year/month o from/to YYYY-MM-DD)'}), 400
+    if start is None and end is None:
+        return jsonify({'error': 'Indica year/month o from/to'}), 400
+    doc_type = (request.args.get('type') or 'factura').strip().lower()
+    if doc_type not in ('factura', 'proforma', 'all'):
+        return jsonify({'error': 'type inválido'}), 400
+
+    invoice_filters = [c for c in (
+        Invoice.date >= start if start is not None else None,
+        Invoice.date < end if end is not None else None,
+        Invoice.type == doc_type if doc_type != 'all' else None,
+    ) if c is not None]
+    expense_filters = [c for c in (
+        Expense.date >= start if start is not None else None,
+        Expense.date < end if end is not None else None,
+    ) if c is not None]
+
+    invoices = (db.session.query(
+        Invoice.id, Invoice.number, Invoice.date, Invoice.type, Client.name, Client.cif, Invoice.payment_method,
+        Invoice.paid, Invoice.total - Invoice.tax_total, Invoice.tax_total, Invoice.total)
+        .join(Client, Client.id == Invoice.client_id)
+        .filter(*invoice_filters)
+        .order_by(Invoice.date, Invoice.id)
+        .yield_per(CSV_EXPORT_BATCH))
+    lines = (db.session.query(
+        Invoice.number, Invoice.date, InvoiceItem.description, InvoiceItem.units, InvoiceItem.unit_price,
+        InvoiceItem.tax_rate, InvoiceItem.subtotal, InvoiceItem.total - InvoiceItem.subtotal, InvoiceItem.total,
+        InvoiceItem.product_id)
+        .join(Invoice, Invoice.id == InvoiceItem.invoice_id)
+        .filter(*invoice_filters)
+        .order_by(Invoice.date, Invoice.id, InvoiceItem.id)
+        .yield_per(CSV_EXPORT_BATCH))
+    expenses = (db.session.query(
+        Expense.id, Expense.date, Expense.category, Expense.description, Expense.supplier, Expense.base_amount,
+        Expense.tax_rate, Expense.total - Expense.base_amount, Expense.total, Expense.paid)
+        .filter(*expense_filters)
+        .order_by(Expense.date, Expense.id)
+        .yield_per(CSV_EXPORT_BATCH))
+
+    def _cells(rows, money_from):
+        # Fechas ISO como el resto de exportaciones; importes a 2 decimales
+        for row in rows:
+            yield [v.isoformat() if hasattr(v, 'isoformat') else
+                   (round(v, 2) if i >= money_from and isinstance(v, float) else v)
+                   for i, v in enumerate(row)]
+
+    period_end = (end - timedelta(days=1)).isoformat() if end is not None else 'hoy'
+    filename = f"contabilidad_{start.isoformat() if start else 'inicio'}_{period_end}.xlsx"
+    return _xlsx_workbook_response(filename, [
+        ('Facturas',
+         ['id', 'number', 'date', 'type', 'client', 'client_cif', 'payment_method', 'paid', 'base', 'tax_total', 'total'],
+         _cells(invoices, 8)),
+        ('Líneas',
+         ['invoice_number', 'date', 'description', 'units', 'unit_price', 'tax_rate', 'subtotal', 'tax', 'total', 'product_id'],
+         _cells(lines, 6)),
+        ('Gastos',
+         ['id', 'date', 'category', 'description', 'supplier', 'base_amount', 'tax_rate', 'tax', 'total', 'paid'],
+         _cells(expenses, 5)),
+        ('Resumen IVA',
+         ['tax_rate', 'output_base', 'output_vat', 'input_base', 'input_vat', 'vat_balance'],
+         _vat_summary_rows(invoice_filters, expense_filters)),
+    ])
 
 
 @app.route('/api/invoices/<int:invoice_id>/pdf', methods=['GET'])
 @jwt_required()
 @limiter.limit("60 per minute")
 def invoice_pdf(invoice_id):
-    """Generate a PDF for a given invoice."""
-    invoice = Invoice.query.get_or_404(invoice_id)
+    """Generate a PDF for a given invoice.
+
+    The rendered PDF is cached on disk by content hash; repeated requests are
+    served from the cache and honour ``If-None-Match`` (304).
+    """
+    invoice = _load_invoice_or_404(invoice_id)
     client = invoice.client
     company = CompanyConfig.query.first() or _company_from_env()
     items = invoice.items
-    # Build absolute file URI for logo to avoid network issues in wkhtmltopdf
-    # Use a proper file URI (file:///C:/...) and forward slashes
-    logo_path = os.path.join(STATIC_FOLDER, 'logo_invoice.png')
-    try:
-        logo_uri = Path(logo_path).resolve().as_uri()
-    except Exception:
-        logo_uri = 'file:///' + logo_path.replace('\\', '/')
-    rendered = render_template(
-        'invoice_template.html',
-        invoice=invoice,
-        client=client,
-        company=company,
-        items=items,
-        logo_uri=logo_uri,
-        company_address_line=_compose_company_address(company),
-    )
     filename = f"{invoice.type}_{invoice.number}.pdf"
-    file_path = os.path.join(DOWNLOAD_FOLDER, filename)
-    # Usar solo wkhtmltopdf para consistencia dev/prod
-    pdf_bytes = None
-    if pdfkit is not None:
+    cache_key = _invoice_pdf_cache_key(invoice, client, company, items)
+    cached_path = _invoice_pdf_cache_path(invoice.id, cache_key)
+    if not os.path.isfile(cached_path):
+        pdf_bytes = _render_invoice_pdf(invoice, client, company, items)
+        # Save the PDF to the downloads folder
+        with open(os.path.join(DOWNLOAD_FOLDER, filename), 'wb') as f:
+            f.write(pdf_bytes)
+        cached_path = _store_invoice_pdf_cache(invoice.id, cache_key, pdf_bytes)
+        if cached_path is None:
+            return send_file(io.BytesIO(pdf_bytes), mimetype='application/pdf', as_attachment=True,
+                             download_name=filename)
+    resp = send_file(cached_path, mimetype='application/pdf', as_attachment=True,
+                     download_name=filename, etag=cache_key, conditional=True)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+
+@app.route('/api/invoices/<int:invoice_id>/pdf/jobs', methods=['POST'])
+@jwt_required()
+@limiter.limit("60 per minute")
+def create_invoice_pdf_job(invoice_id):
+    """Queue the PDF of an invoice for background rendering.
+
+    Devuelve 202 con ``job_id``; el frontend consulta ``/api/pdf-jobs/<job_id>``
+    y, cuando está ``done``, descarga ``/api/invoices/<id>/pdf`` (ya en caché).
+    """
+    invoice = _load_invoice_or_404(invoice_id)
+    client = invoice.client
+    company = CompanyConfig.query.first() or _company_from_env()
+    items = invoice.items
+    cache_key = _invoice_pdf_cache_key(invoice, client, company, items)
+    status, _ = _pdf_job_status(invoice.id, cache_key)
+    if status not in ('done', 'pending'):
+        _enqueue_invoice_pdf_job(invoice, client, company, items, cache_key)
+        status, _ = _pdf_job_status(invoice.id, cache_key)
+    job_id = _pdf_job_id(invoice.id, cache_key)
+    return jsonify({
+        'job_id': job_id,
+        'status': status,
+        'status_url': url_for('get_pdf_job', job_id=job_id),
+        'download_url': url_for('invoice_pdf', invoice_id=invoice.id),
+    }), 202
+
+
+@app.route('/api/invoices/export_pdf_zip', methods=['GET'])
+@jwt_required()
+@limiter.limit("5 per minute")
+def export_invoices_pdf_zip():
+    """Descarga un ZIP con los PDFs de las facturas de un periodo.
+
+    Parámetros: ``year`` y opcionalmente ``month``, o ``from``/``to``
+    (YYYY-MM-DD).  ``type``: factura (defecto) | proforma | all.
+    Los PDFs en caché se reutilizan; el resto se renderiza en paralelo en el
+    pool y el ZIP se emite en streaming sin mantenerlo entero en memoria.
+    Las facturas borradas durante la descarga se omiten; las que no se
+    pueden renderizar se listan en ``errores.txt`` dentro del ZIP (la
+    respuesta ya está en curso: no hay otro modo de avisar).
+    """
+    try:
+        start, end = _date_range_from_args(request.args)
+    except ValueError:
+        return jsonify({'error': 'Parámetros de fecha inválidos (year/month o from/to YYYY-MM-DD)'}), 400
+    if start is None and end is None:
+        return jsonify({'error': 'Indica year/month o from/to'}), 400
+    doc_type = (request.args.get('type') or 'factura').strip().lower()
+    if doc_type not in ('factura', 'proforma', 'all'):
+        return jsonify({'error': 'type inválido'}), 400
+
+    query = _filter_date_range(db.session.query(Invoice.id), Invoice.date, start, end)
+    if doc_type != 'all':
+        query = query.filter(Invoice.type == doc_type)
+    invoice_ids = [i for (i,) in query.order_by(Invoice.date, Invoice.id)]
+    company = CompanyConfig.query.first() or _company_from_env()
+    window = max(1, min(PDF_RENDER_QUEUE_MAX, max(1, PDF_RENDER_WORKERS) * 2))
+
+    def _prepare(invoice_id):
+        invoice = db.session.get(Invoice, invoice_id, options=[selectinload(Invoice.items), joinedload(Invoice.client)])
+        if invoice is None:
+            return None  # borrada después de listar los ids
+        client, items = invoice.client, invoice.items
+        name = f"{invoice.type}_{invoice.number}.pdf"
+        cache_key = _invoice_pdf_cache_key(invoice, client, company, items)
+        cached_path = _invoice_pdf_cache_path(invoice.id, cache_key)
+        if os.path.isfile(cached_path):
+            return name, invoice_id, cache_key, cached_path
+        fn, args = _invoice_render_job(invoice, client, company, items)
         try:
-            options = {
-                'enable-local-file-access': None,
-                'page-size': 'A4',
-                'margin-top': '0.75in',
-                'margin-right': '0.75in',
-                'margin-bottom': '0.75in',
-                'margin-left': '0.75in',
-                'encoding': 'UTF-8',
-                'no-outline': None,
-                'print-media-type': None,
-                'disable-smart-shrinking': None,
-                'zoom': 1.0,
-                'dpi': 96,
-                'image-quality': 94,
-                'minimum-font-size': 12,
-                'enable-plugins': None,
-                'load-error-handling': 'ignore',
-                'load-media-error-handling': 'ignore'
-            }
-            cfg = _resolve_pdfkit_configuration()
-            pdf_bytes = pdfkit.from_string(rendered, False, options=options, configuration=cfg)
-        except Exception:
-            pdf_bytes = None
-    
-    # Fallback solo si wkhtmltopdf falla
-    if pdf_bytes is None:
-        pdf_bytes = _generate_pdf_fallback(invoice, client, company, items)
-    # Save the PDF to the downloads folder
-    with open(file_path, 'wb') as f:
-        f.write(pdf_bytes)
-    pdf_io = io.BytesIO(pdf_bytes)
-    return send_file(pdf_io, mimetype='application/pdf', as_attachment=True,
-                     download_name=filename)
+            job = _submit_pdf_render(fn, *args)
+        except HTTPException:
+            # Cola llena por otras peticiones: renderizar aquí mismo
+            job = Future()
+            try:
+                job.set_result(fn(*args))
+            except Exception as e:
+                job.set_exception(e)
+        return name, invoice_id, cache_key, job
+
+    failed = []
+
+    def _write(zf, entry):
+        name, invoice_id, cache_key, source = entry
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        if isinstance(source, Future):
+            try:
+                pdf_bytes = source.result(timeout=PDF_RENDER_TIMEOUT)
+            except Exception as e:
+                app.logger.error('ZIP de facturas: no se pudo generar %s: %s', name, e)
+                failed.append(f'{name}: {e}')
+                return
+            _store_invoice_pdf_cache(invoice_id, cache_key, pdf_bytes)
+            zf.writestr(info, pdf_bytes)
+        else:
+            with open(source, 'rb') as src, zf.open(info, 'w') as dest:
+                shutil.copyfileobj(src, dest, 64 * 1024)
+
+    def generate():
+        buf = _ZipStreamBuffer()
+        with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_STORED) as zf:
+            in_flight = deque()
+            for invoice_id in invoice_ids:
+                entry = _prepare(invoice_id)
+                if entry is None:
+                    continue
+                in_flight.append(entry)
+                if len(in_flight) >= window:
+                    _write(zf, in_flight.popleft())
+                    yield buf.pop()
+            while in_flight:
+                _write(zf, in_flight.popleft())
+                yield buf.pop()
+            if failed:
+                zf.writestr('errores.txt', '\n'.join(failed) + '\n')
+        yield buf.pop()
+
+    label = f"{start.isoformat() if start else 'inicio'}_{(end - timedelta(days=1)).isoformat() if end else 'hoy'}"
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="facturas_{label}.zip"'},
+    )
+
+
+@app.route('/api/pdf-jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_pdf_job(job_id):
+    """Estado de un trabajo de renderizado: pending | done | error."""
+    m = re.fullmatch(r'(\d+)-([0-9a-f]{64})', job_id or '')
+    if not m:
+        abort(404)
+    invoice_id, cache_key = int(m.group(1)), m.group(2)
+    status, detail = _pdf_job_status(invoice_id, cache_key)
+    if status is None:
+        abort(404)
+    payload = {'job_id': job_id, 'status': status}
+    if status == 'done':
+        payload['download_url'] = url_for('invoice_pdf', invoice_id=invoice_id)
+    elif status == 'error':
+        payload['error'] = detail or 'Error generando PDF'
+    return jsonify(payload)
 
 
 @app.route('/health', methods=['GET'])
@@ -2543,17 +4845,149 @@ def health():
     return jsonify({
         'status': 'ok',
     'version': os.getenv('APP_VERSION', 'dev'),
-        'pdf_engine': 'wkhtmltopdf' if pdfkit else 'reportlab_fallback',
+        'pdf_engine': PDF_ENGINE if (pdfkit or PDF_ENGINE == 'reportlab') else 'reportlab_fallback',
         'database': app.config.get('SQLALCHEMY_DATABASE_URI', '')
     })
 
 
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+_static_sha256_cache: dict = {}
+_static_sha256_lock = threading.Lock()
+
+
+def _static_file_sha256(path: str) -> str:
+    """SHA-256 of a file on disk, cached per (path, mtime_ns, size)."""
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    sha = _static_sha256_cache.get(key)
+    if sha is None:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in _iter_stream(f):
+                digest.update(chunk)
+        sha = digest.hexdigest()
+        with _static_sha256_lock:
+            if len(_static_sha256_cache) >= 4096:
+                _static_sha256_cache.clear()
+            _static_sha256_cache[key] = sha
+    return sha
+
+
+# -----------------------------
+# Product image variants
+# -----------------------------
+# Cada imagen subida ``<producto>_<timestamp>_<nombre>.<ext>`` genera, fuera
+# del hilo de la petición, ``variants/<stem>.<tamaño>.webp`` (lado mayor
+# limitado, sin ampliar). El original se conserva en su formato. ``images``
+# guarda las URLs ``...?size=<tamaño>``, que sirven el original mientras la
+# variante no exista.
+PRODUCT_IMAGES_DIR = os.path.join(STATIC_FOLDER, 'uploads', 'products')
+PRODUCT_IMAGES_URL = '/static/uploads/products/'
+PRODUCT_IMAGE_VARIANTS = {'thumb': 320, 'medium': 800, 'full': 1600}
+PRODUCT_IMAGE_WEBP_QUALITY = int(os.getenv('PRODUCT_IMAGE_WEBP_QUALITY', '80'))
+_product_image_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='product-images')
+
+
+def _product_variant_path(filename: str, size: str) -> str:
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(PRODUCT_IMAGES_DIR, 'variants', f'{stem}.{size}.webp')
+
+
+def _product_image_entry(filename: str, alt: str) -> dict:
+    url = PRODUCT_IMAGES_URL + filename
+    return {'url': url, 'alt': alt, 'variants': {size: f'{url}?size={size}' for size in PRODUCT_IMAGE_VARIANTS}}
+
+
+def _generate_product_image_variants(filename: str) -> int:
+    """Write the missing/outdated WebP variants of ``filename``; returns how many were written."""
+    if PILImage is None:
+        return 0
+    src = os.path.join(PRODUCT_IMAGES_DIR, filename)
+    src_mtime = os.path.getmtime(src)
+    pending = {size: _product_variant_path(filename, size) for size in PRODUCT_IMAGE_VARIANTS}
+    pending = {size: path for size, path in pending.items()
+               if not (os.path.isfile(path) and os.path.getmtime(path) >= src_mtime)}
+    if not pending:
+        return 0
+    os.makedirs(os.path.dirname(next(iter(pending.values()))), exist_ok=True)
+    with PILImage.open(src) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.mode not in ('RGB', 'RGBA'):
+            im = im.convert('RGBA' if 'A' in im.getbands() or 'transparency' in im.info else 'RGB')
+        # De mayor a menor: cada variante se reduce desde la anterior
+        for size in sorted(pending, key=PRODUCT_IMAGE_VARIANTS.get, reverse=True):
+            im.thumbnail((PRODUCT_IMAGE_VARIANTS[size],) * 2, PILImage.LANCZOS)
+            tmp_path = f'{pending[size]}.{uuid4().hex}.tmp'
+            im.save(tmp_path, 'WEBP', quality=PRODUCT_IMAGE_WEBP_QUALITY, method=4)
+            os.replace(tmp_path, pending[size])
+    return len(pending)
+
+
+def _product_image_variants_job(filename: str) -> None:
+    try:
+        _generate_product_image_variants(filename)
+    except Exception as e:
+        app.logger.warning(f'No se pudieron generar variantes de {filename}: {e}')
+
+
+def _schedule_product_image_variants(filename: str) -> None:
+    if PILImage is not None:
+        _product_image_executor.submit(_product_image_variants_job, filename)
+
+
+@app.cli.command('backfill-product-images')
+def backfill_product_images_command():
+    """Genera las variantes WebP de las imágenes de producto existentes y las añade a ``images``."""
+    from sqlalchemy.orm.attributes import flag_modified
+    if PILImage is None:
+        print('Pillow no está instalado: pip install Pillow')
+        return
+    written = updated = missing = 0
+    for product in Product.query.filter(Product.images.isnot(None)).all():
+        images = []
+        for entry in product.images or []:
+            url = entry.get('url') if isinstance(entry, dict) else entry
+            filename = url[len(PRODUCT_IMAGES_URL):] if isinstance(url, str) and url.startswith(PRODUCT_IMAGES_URL) else None
+            if not filename or not os.path.isfile(os.path.join(PRODUCT_IMAGES_DIR, filename)):
+                missing += bool(filename)
+                images.append(entry)
+                continue
+            written += _generate_product_image_variants(filename)
+            alt = entry.get('alt', filename) if isinstance(entry, dict) else filename
+            images.append({**(entry if isinstance(entry, dict) else {}), **_product_image_entry(filename, alt)})
+        if images != product.images:
+            product.images = images
+            flag_modified(product, 'images')
+            updated += 1
+    db.session.commit()
+    print(f'Variantes escritas: {written}; productos actualizados: {updated}; ficheros ausentes: {missing}')
+
+
 @app.route('/static/uploads/products/<path:filename>', methods=['GET'])
 def serve_product_image(filename):
-    """Sirve imágenes de productos sin autenticación (archivos públicos)."""
-    from flask import send_from_directory
-    products_folder = os.path.join(STATIC_FOLDER, 'uploads', 'products')
-    return send_from_directory(products_folder, filename)
+    """Sirve imágenes de productos sin autenticación (archivos públicos).
+
+    ``?size=thumb|medium|full`` devuelve la variante WebP. Los nombres son
+    únicos por subida (``<producto>_<timestamp>_<nombre>``) y nunca se
+    reescriben, así que se cachean un año como ``immutable``; mientras una
+    variante no existe se sirve el original sin caché de larga duración.
+    """
+    from werkzeug.security import safe_join
+    path = safe_join(PRODUCT_IMAGES_DIR, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    immutable = True
+    size = request.args.get('size')
+    if size in PRODUCT_IMAGE_VARIANTS:
+        variant = _product_variant_path(filename, size)
+        if os.path.isfile(variant):
+            path = variant
+        else:
+            immutable = False
+    resp = send_file(path, etag=_static_file_sha256(path), conditional=True, max_age=STATIC_IMMUTABLE_MAX_AGE)
+    resp.headers['Cache-Control'] = (f'public, max-age={STATIC_IMMUTABLE_MAX_AGE}, immutable' if immutable
+                                     else 'public, no-cache')
+    return resp
 
 
 # -------------------------------------
@@ -2679,12 +5113,8 @@ def generate_contract_pdf():
     
     try:
         # Get template filename
-        template_filename = None
-        if template_id == 'compraventa':
-            template_filename = 'Contrato_Compraventa_Plazos_NIOXTEC_v5.docx'
-        elif template_id == 'renting':
-            template_filename = 'Plantilla_Contrato_Renting_Firma_Datos_v2.docx'
-        else:
+        template_filename = CONTRACT_TEMPLATE_FILES.get(template_id)
+        if template_filename is None:
             return jsonify({'error': 'Invalid template ID'}), 400
         
         # Load and fill DOCX template
@@ -2692,310 +5122,29 @@ def generate_contract_pdf():
         if not os.path.exists(template_path):
             return jsonify({'error': 'Template file not found'}), 404
         
-        # Load DOCX document
-        doc = Document(template_path)
-        
-        # Get original placeholders from template
-        template_info = extract_placeholders_from_docx(template_filename)
-        if 'error' in template_info:
-            return jsonify({'error': template_info['error']}), 400
-        
-        original_tokens = template_info.get('original_tokens', {})
-        
-        # Mapping from document placeholders to form data keys
-        placeholder_mapping = {
-            # Compraventa template - usar solo las claves principales
-            'Nombre completo del cliente': 'nombre_completo_del_cliente',
-            'DNI DEL CLIENTE': 'numero',
-            'Dirección del cliente': 'direccion',
-            'Teléfono del cliente': 'telefono',
-            'Correo del cliente': 'correo',
-            'Modelo del producto': 'modelo',
-            'Pulgadas del producto': 'pulgadas',
-            'Número de serie del producto': 'numero_serie',
-            'importe total en euros, IVA incluido': 'importe_total_en_euros_iva_incluido',
-            'número de plazos': 'numero_de_plazos',
-            'importe de cada cuota': 'importe_de_cada_cuota',
-            'Tabla de interes': 'tabla_de_interes',
-            
-            # Campos duplicados - mapear a las mismas claves principales
-            'Nombre del comprador': 'nombre_completo_del_cliente',  # = Nombre completo del cliente
-            'Dni del comprador': 'numero',  # = DNI DEL CLIENTE
-            'Modelo': 'modelo',  # = Modelo del producto
-            'Pulgadas': 'pulgadas',  # = Pulgadas del producto
-            'Número de Serie': 'numero_serie',  # = Número de serie del producto
-            
-            # Renting template
-            'Nombre de la empresa o persona': 'nombre_de_la_empresa_o_persona',
-            'Número': 'numero',
-            'Dirección': 'direccion',
-            'Nombre representante': 'nombre_representante',
-            'Cargo': 'cargo',
-            'Teléfono': 'telefono',
-            'Correo': 'correo',
-            'Marca': 'marca',
-            'importe en euros': 'importe_en_euros',
-            'plataforma de pago': 'plataforma_de_pago',
-            'IBAN': 'iban',
-            'importe ajustado': 'importe_ajustado',
-            # Fecha actual en formato DD-MM-AAAA (nueva etiqueta en plantillas)
-            'FECHA FORMATO DD-MM-AAAA': 'fecha_formato_dd_mm_aaaa',
-        }
+        # Plantilla parseada en caché; se rellena una copia
+        try:
+            template = _contract_template(template_path)
+        except Exception as e:
+            return jsonify({'error': f'Error processing DOCX: {str(e)}'}), 400
+        doc = template.clone()
 
-        # Asegurar fecha actual si la plantilla la requiere y no viene en el formulario
-        form_data = dict(form_data or {})
-        if 'fecha_formato_dd_mm_aaaa' not in form_data:
-            try:
-                form_data['fecha_formato_dd_mm_aaaa'] = datetime.now().strftime('%d-%m-%Y')
-            except Exception:
-                form_data['fecha_formato_dd_mm_aaaa'] = ''
-        
-        # Interest table mapping based on number of installments
-        def get_interest_text(num_plazos):
-            if 0 <= num_plazos <= 3:
-                return "Sin intereses"
-            elif 4 <= num_plazos <= 6:
-                return "5% interés mensual"
-            elif 7 <= num_plazos <= 12:
-                return "10% interés mensual"
-            elif 13 <= num_plazos <= 18:
-                return "20% interés mensual"
-            elif 19 <= num_plazos <= 24:
-                return "30% interés mensual"
-            else:
-                return "Sin intereses"  # Por defecto
-        
-        # Calculate interest based on number of installments
-        if template_id == 'compraventa' and 'numero_de_plazos' in form_data:
-            num_plazos = int(form_data.get('numero_de_plazos', 3))
-            interest_text = get_interest_text(num_plazos)
-            form_data['tabla_de_interes'] = interest_text
+        values = _contract_generate_values(template_id, template, form_data)
         
         # Debug logging
-        app.logger.info(f"Template placeholders: {list(original_tokens.keys())}")
-        app.logger.info(f"Form data keys: {list(form_data.keys())}")
+        app.logger.info(f"Template placeholders: {list(template.placeholders)}")
+        app.logger.info(f"Form data keys: {list((form_data or {}).keys())}")
         app.logger.info(f"Form data: {form_data}")
-        app.logger.info(f"Placeholder mapping: {placeholder_mapping}")
         
-        # Log which placeholders will be replaced
-        replacements_made = []
-        
-        # Fill placeholders in paragraphs
-        for paragraph in doc.paragraphs:
-            for placeholder_name, placeholder_token in original_tokens.items():
-                # Map placeholder to form data key
-                form_key = placeholder_mapping.get(placeholder_name, placeholder_name)
-                
-                if form_key in form_data:
-                    value = str(form_data[form_key])
-                    if placeholder_token in paragraph.text:
-                        app.logger.info(f"Replacing {placeholder_token} with {value} in paragraph (key: {form_key})")
-                        paragraph.text = paragraph.text.replace(placeholder_token, value)
-                        replacements_made.append(f"{placeholder_name} -> {value}")
-        
-        # Fill placeholders in tables
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        for placeholder_name, placeholder_token in original_tokens.items():
-                            # Map placeholder to form data key
-                            form_key = placeholder_mapping.get(placeholder_name, placeholder_name)
-                            
-                            if form_key in form_data:
-                                value = str(form_data[form_key])
-                                if placeholder_token in paragraph.text:
-                                    app.logger.info(f"Replacing {placeholder_token} with {value} in table cell (key: {form_key})")
-                                    paragraph.text = paragraph.text.replace(placeholder_token, value)
-                                    replacements_made.append(f"{placeholder_name} -> {value}")
+        # Fill placeholders (single pass, keeps run formatting)
+        replacements_made = [f"{name} -> {value}" for name, value in _fill_contract_placeholders(template, doc, values)]
         
         app.logger.info(f"Total replacements made: {len(replacements_made)}")
         app.logger.info(f"Replacements: {replacements_made}")
         
-        # Save filled DOCX temporarily
-        temp_docx_path = os.path.join(DOWNLOAD_FOLDER, f'temp_{secure_filename(filename)}.docx')
-        doc.save(temp_docx_path)
-        
-        # Convert DOCX to PDF using wkhtmltopdf
-        if pdfkit is not None:
-            # Convert DOCX to HTML first (simple approach)
-            html_content = _docx_to_html(temp_docx_path)
-            
-            # Create contract template HTML
-            contract_html = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="UTF-8">
-                <style>
-                    body {{
-                        font-family: "Cambria", "Times New Roman", serif;
-                        line-height: 1.4;
-                        margin: 1.5cm 1.2cm 1.5cm 1.2cm;
-                        font-size: 11pt;
-                        color: #333;
-                    }}
-                    .header {{
-                        display: flex;
-                        justify-content: center;
-                        align-items: center;
-                        text-align: center;
-                        margin-bottom: 1.5em;
-                        page-break-inside: avoid;
-                        width: 100%;
-                    }}
-                    .header img {{
-                        max-height: 70px;
-                        max-width: 160px;
-                        object-fit: contain;
-                        margin: 0 auto;
-                        display: block;
-                    }}
-                    /* Párrafos con mejor espaciado */
-                    p {{
-                        margin: 0.5em 0;
-                        text-align: justify;
-                    }}
-                    /* Negritas destacadas */
-                    strong {{
-                        font-weight: bold;
-                        color: #222;
-                    }}
-                    /* Jerarquía visual mejorada para títulos */
-                    h1, h2, h3 {{
-                        color: #65AAC3;
-                        font-family: "Cambria", "Georgia", "Times New Roman", serif;
-                        font-weight: bold;
-                        page-break-after: avoid;
-                        line-height: 1.2;
-                    }}
-                    h1 {{ 
-                        font-size: 14pt;
-                        margin-top: 0.5em;
-                        margin-bottom: 1.2em;
-                        letter-spacing: 0.5px;
-                        font-family: "Cambria", "Georgia", "Times New Roman", serif;
-                    }}
-                    h2 {{ 
-                        font-size: 12pt;
-                        margin-top: 2em;
-                        margin-bottom: 0.8em;
-                        padding-top: 0.5em;
-                        border-top: 2px solid #65AAC3;
-                        font-family: "Cambria", "Georgia", "Times New Roman", serif;
-                    }}
-                    h3 {{ 
-                        font-size: 10pt;
-                        margin-top: 1.2em;
-                        margin-bottom: 0.6em;
-                        font-family: "Cambria", "Georgia", "Times New Roman", serif;
-                    }}
-                    /* Estilos específicos para títulos del contrato */
-                    .contract-title {{
-                        font-size: 16pt;
-                        color: #65AAC3;
-                        font-weight: bold;
-                        text-align: center;
-                        margin-bottom: 1.5em;
-                        text-transform: uppercase;
-                        letter-spacing: 0.5px;
-                        font-family: "Cambria", "Georgia", "Times New Roman", serif;
-                    }}
-                    .section-title {{
-                        font-size: 14pt;
-                        color: #65AAC3;
-                        font-weight: bold;
-                        margin-top: 2.5em;
-                        margin-bottom: 1em;
-                        padding-top: 0.8em;
-                        padding-bottom: 0.3em;
-                        border-top: 2px solid #65AAC3;
-                        border-bottom: 1px solid #65AAC3;
-                        font-family: "Cambria", "Georgia", "Times New Roman", serif;
-                    }}
-                    .subsection-title {{
-                        font-size: 12pt;
-                        color: #65AAC3;
-                        font-weight: bold;
-                        margin-top: 1.5em;
-                        margin-bottom: 0.7em;
-                        font-family: "Cambria", "Georgia", "Times New Roman", serif;
-                    }}
-                    /* Tablas mejoradas */
-                    table {{
-                        width: 100%;
-                        border-collapse: collapse;
-                        margin: 1.2em 0;
-                        font-family: "Cambria", "Times New Roman", serif;
-                        font-size: 10.5pt;
-                        page-break-inside: avoid;
-                    }}
-                    th, td {{
-                        border: 1px solid #ccc;
-                        padding: 10px 12px;
-                        text-align: left;
-                        font-family: "Cambria", "Times New Roman", serif;
-                    }}
-                    th {{
-                        background-color: #65AAC3;
-                        color: white;
-                        font-weight: bold;
-                        font-size: 11pt;
-                    }}
-                    td {{
-                        background-color: #fafafa;
-                    }}
-                    tr:nth-child(even) td {{
-                        background-color: #f5f5f5;
-                    }}
-                    /* Sección de firma */
-                    .signature-section {{
-                        margin-top: 3em;
-                        page-break-before: auto;
-                        page-break-inside: avoid;
-                    }}
-                    .signature-line {{
-                        border-top: 2px solid #333;
-                        margin-top: 2.5em;
-                        padding-top: 0.8em;
-                        text-align: center;
-                        font-weight: bold;
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="header">
-                    <img src="{Path(os.path.join(STATIC_FOLDER, 'contracts', 'images', 'header-right.png')).resolve().as_uri()}" alt="NIOXTEC Logo" />
-                </div>
-                {html_content}
-            </body>
-            </html>
-            """
-            
-            options = {
-                'enable-local-file-access': None,
-                'page-size': 'A4',
-                'margin-top': '0.75cm',
-                'margin-right': '1.2cm',
-                'margin-bottom': '0.75cm',
-                'margin-left': '1.2cm',
-                'encoding': 'UTF-8',
-                'no-outline': None,
-                'print-media-type': None,
-                'disable-smart-shrinking': None,
-                'zoom': 1.0,
-                'dpi': 96,
-                'minimum-font-size': 10
-            }
-            cfg = _resolve_pdfkit_configuration()
-            pdf_bytes = pdfkit.from_string(contract_html, False, options=options, configuration=cfg)
-        else:
-            # Fallback to reportlab
-            pdf_bytes = _generate_contract_pdf_fallback(_docx_to_text(temp_docx_path))
-        
-        # Clean up temporary DOCX file
-        if os.path.exists(temp_docx_path):
-            os.remove(temp_docx_path)
+        # Convert DOCX to PDF (wkhtmltopdf, or ReportLab without pdfkit) on the render pool
+        fn, args = _contract_pdf_job(doc, template)
+        pdf_bytes = _render_pdf(fn, *args)
         
         # Save PDF to downloads folder
         safe_filename = secure_filename(filename)
@@ -3017,29 +5166,21 @@ def generate_contract_pdf():
                     ).first()
                     
                     if not existing_doc:
-                        # Save to client documents folder
-                        base_dir = _client_upload_dir(client_id)
-                        documents_dir = os.path.join(base_dir, 'documents')
-                        os.makedirs(documents_dir, exist_ok=True)
-                        
-                        unique_name = f"{uuid4().hex}_{safe_filename}"
-                        stored_rel = os.path.join(str(client_id), 'documents', unique_name)
-                        stored_abs = os.path.join(UPLOADS_ROOT, stored_rel)
-                        
-                        with open(stored_abs, 'wb') as f:
-                            f.write(pdf_bytes)
-                        
-                        # Save document record to database
-                        doc_record = ClientDocument(
-                            client_id=client_id,
-                            category='document',
-                            filename=safe_filename,
-                            stored_path=stored_rel,
-                            content_type='application/pdf',
-                            size_bytes=len(pdf_bytes),
-                        )
-                        db.session.add(doc_record)
-                        db.session.commit()
+                        # Save to client documents storage (content-addressed)
+                        with _blob_commit():
+                            sha, _, stored_rel = _blob_put([pdf_bytes])
+                            
+                            # Save document record to database
+                            doc_record = ClientDocument(
+                                client_id=client_id,
+                                category='document',
+                                filename=safe_filename,
+                                stored_path=stored_rel,
+                                sha256=sha,
+                                content_type='application/pdf',
+                                size_bytes=len(pdf_bytes),
+                            )
+                            db.session.add(doc_record)
                         document_saved = True
                         app.logger.info(f"Contract PDF auto-saved as client document: {safe_filename} for client {client_id}")
             except Exception as save_error:
@@ -3073,7 +5214,8 @@ def download_contract_pdf(filename):
         if not os.path.exists(file_path):
             return jsonify({'error': 'File not found'}), 404
         
-        return send_file(file_path, mimetype='application/pdf', as_attachment=True)
+        mimetype = 'application/zip' if file_path.lower().endswith('.zip') else 'application/pdf'
+        return send_file(file_path, mimetype=mimetype, as_attachment=True)
         
     except Exception as e:
         app.logger.error(f"Error downloading contract PDF: {e}")
@@ -3111,12 +5253,8 @@ def save_contract_as_document():
     
     try:
         # Get template filename
-        template_filename = None
-        if template_id == 'compraventa':
-            template_filename = 'Contrato_Compraventa_Plazos_NIOXTEC_v5.docx'
-        elif template_id == 'renting':
-            template_filename = 'Plantilla_Contrato_Renting_Firma_Datos_v2.docx'
-        else:
+        template_filename = CONTRACT_TEMPLATE_FILES.get(template_id)
+        if template_filename is None:
             return jsonify({'error': 'Invalid template ID'}), 400
         
         # Load and fill DOCX template
@@ -3124,55 +5262,12 @@ def save_contract_as_document():
         if not os.path.exists(template_path):
             return jsonify({'error': 'Template file not found'}), 404
         
-        # Load DOCX document
-        doc = Document(template_path)
-        
-        # Get original placeholders from template
-        template_info = extract_placeholders_from_docx(template_filename)
-        if 'error' in template_info:
-            return jsonify({'error': template_info['error']}), 400
-        
-        original_tokens = template_info.get('original_tokens', {})
-        
-        # Mapping from document placeholders to form data keys
-        placeholder_mapping = {
-            # Compraventa template - usar solo las claves principales
-            'Nombre completo del cliente': 'nombre_completo_del_cliente',
-            'DNI DEL CLIENTE': 'numero',
-            'Dirección del cliente': 'direccion',
-            'Teléfono del cliente': 'telefono',
-            'Correo del cliente': 'correo',
-            'Modelo del producto': 'modelo',
-            'Pulgadas del producto': 'pulgadas',
-            'Número de serie del producto': 'numero_serie',
-            'importe total en euros, IVA incluido': 'importe_total_en_euros_iva_incluido',
-            'número de plazos': 'numero_de_plazos',
-            'importe de cada cuota': 'importe_de_cada_cuota',
-            'Tabla de interes': 'tabla_de_interes',
-            
-            # Campos duplicados - mapear a las mismas claves principales
-            'Nombre del comprador': 'nombre_completo_del_cliente',  # = Nombre completo del cliente
-            'Dni del comprador': 'numero',  # = DNI DEL CLIENTE
-            'Modelo': 'modelo',  # = Modelo del producto
-            'Pulgadas': 'pulgadas',  # = Pulgadas del producto
-            'Número de Serie': 'numero_serie',  # = Número de serie del producto
-            
-            # Renting template
-            'Nombre de la empresa o persona': 'nombre_de_la_empresa_o_persona',
-            'Número': 'numero',
-            'Dirección': 'direccion',
-            'Nombre representante': 'nombre_representante',
-            'Cargo': 'cargo',
-            'Teléfono': 'telefono',
-            'Correo': 'correo',
-            'Marca': 'marca',
-            'importe en euros': 'importe_en_euros',
-            'plataforma de pago': 'plataforma_de_pago',
-            'IBAN': 'iban',
-            'importe ajustado': 'importe_ajustado',
-            # Fecha actual en formato DD-MM-AAAA (nueva etiqueta en plantillas)
-            'FECHA FORMATO DD-MM-AAAA': 'fecha_formato_dd_mm_aaaa',
-        }
+        # Plantilla parseada en caché; se rellena una copia
+        try:
+            template = _contract_template(template_path)
+        except Exception as e:
+            return jsonify({'error': f'Error processing DOCX: {str(e)}'}), 400
+        doc = template.clone()
 
         # Asegurar fecha actual si la plantilla la requiere y no viene en el formulario
         form_data = dict(form_data or {})
@@ -3197,58 +5292,27 @@ def save_contract_as_document():
             else:
                 return "30% interés mensual"
         
-        # Fill placeholders in document
-        for paragraph in doc.paragraphs:
-            for placeholder, form_key in placeholder_mapping.items():
-                if placeholder in original_tokens:
-                    original_token = original_tokens[placeholder]
-                    value = form_data.get(form_key, '')
-                    
-                    # Special handling for interest table
-                    if placeholder == 'Tabla de interes':
-                        num_plazos = form_data.get('numero_de_plazos', 0)
-                        try:
-                            num_plazos = int(num_plazos)
-                            value = get_interest_text(num_plazos)
-                        except (ValueError, TypeError):
-                            value = "Sin intereses"
-                    
-                    # Replace placeholder with value
-                    if original_token in paragraph.text:
-                        paragraph.text = paragraph.text.replace(original_token, str(value))
+        # Placeholders mapeados sin dato en el formulario se vacían
+        values = {}
+        for placeholder in template.placeholders:
+            if placeholder in CONTRACT_PLACEHOLDER_MAPPING:
+                values[placeholder] = str(form_data.get(CONTRACT_PLACEHOLDER_MAPPING[placeholder], ''))
         
-        # Fill placeholders in tables
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        for placeholder, form_key in placeholder_mapping.items():
-                            if placeholder in original_tokens:
-                                original_token = original_tokens[placeholder]
-                                value = form_data.get(form_key, '')
-                                
-                                # Special handling for interest table
-                                if placeholder == 'Tabla de interes':
-                                    num_plazos = form_data.get('numero_de_plazos', 0)
-                                    try:
-                                        num_plazos = int(num_plazos)
-                                        value = get_interest_text(num_plazos)
-                                    except (ValueError, TypeError):
-                                        value = "Sin intereses"
-                                
-                                # Replace placeholder with value
-                                if original_token in paragraph.text:
-                                    paragraph.text = paragraph.text.replace(original_token, str(value))
+        # Special handling for interest table
+        if 'Tabla de interes' in values:
+            try:
+                values['Tabla de interes'] = get_interest_text(int(form_data.get('numero_de_plazos', 0)))
+            except (ValueError, TypeError):
+                values['Tabla de interes'] = "Sin intereses"
         
-        # Save filled DOCX temporarily
-        temp_docx_path = os.path.join(DOWNLOAD_FOLDER, f"temp_{uuid4().hex}.docx")
-        doc.save(temp_docx_path)
+        # Fill placeholders (single pass, keeps run formatting)
+        _fill_contract_placeholders(template, doc, values)
         
-        # Generate PDF from filled DOCX
+        # Generate PDF from the filled DOCX (in memory, no temp file)
         cfg = _resolve_pdfkit_configuration()
         if pdfkit and cfg:
             # Convert DOCX to HTML first
-            contract_html = _docx_to_html(temp_docx_path)
+            contract_html = _docx_to_html(doc, template)
             
             # PDF options
             options = {
@@ -3262,16 +5326,10 @@ def save_contract_as_document():
                 'enable-local-file-access': None
             }
             
-            pdf_bytes = pdfkit.from_string(contract_html, False, options=options, configuration=cfg)
+            pdf_bytes = _render_pdf(_html_to_pdf, contract_html, options)
         else:
             # Fallback to reportlab
-            pdf_bytes = _generate_contract_pdf_fallback(_docx_to_text(temp_docx_path))
-        
-        # Clean up temporary DOCX
-        try:
-            os.remove(temp_docx_path)
-        except:
-            pass
+            pdf_bytes = _generate_contract_pdf_fallback(_docx_to_text(doc))
         
         # Save PDF to client documents folder
         safe_filename = secure_filename(filename)
@@ -3285,28 +5343,20 @@ def save_contract_as_document():
         if existing_doc:
             return jsonify({'error': f'Ya existe un documento con el nombre "{safe_filename}" para este cliente'}), 409
         
-        base_dir = _client_upload_dir(client_id)
-        documents_dir = os.path.join(base_dir, 'documents')
-        os.makedirs(documents_dir, exist_ok=True)
-        
-        unique_name = f"{uuid4().hex}_{safe_filename}"
-        stored_rel = os.path.join(str(client_id), 'documents', unique_name)
-        stored_abs = os.path.join(UPLOADS_ROOT, stored_rel)
-        
-        with open(stored_abs, 'wb') as f:
-            f.write(pdf_bytes)
-        
-        # Save document record to database
-        doc_record = ClientDocument(
-            client_id=client_id,
-            category='document',
-            filename=safe_filename,
-            stored_path=stored_rel,
-            content_type='application/pdf',
-            size_bytes=len(pdf_bytes),
-        )
-        db.session.add(doc_record)
-        db.session.commit()
+        with _blob_commit():
+            sha, _, stored_rel = _blob_put([pdf_bytes])
+            
+            # Save document record to database
+            doc_record = ClientDocument(
+                client_id=client_id,
+                category='document',
+                filename=safe_filename,
+                stored_path=stored_rel,
+                sha256=sha,
+                content_type='application/pdf',
+                size_bytes=len(pdf_bytes),
+            )
+            db.session.add(doc_record)
         
         return jsonify({
             'id': doc_record.id,
@@ -3320,6 +5370,148 @@ def save_contract_as_document():
         return jsonify({'error': 'Error saving contract as document'}), 500
 
 
+# Máximo de contratos por petición de /api/contracts/batch
+CONTRACT_BATCH_MAX = int(os.getenv('CONTRACT_BATCH_MAX', '100'))
+
+
+@app.post('/api/contracts/batch')
+@jwt_required()
+@limiter.limit("5 per minute")
+def generate_contracts_batch():
+    """Genera un contrato por cliente y los guarda como documentos del cliente.
+
+    Body: ``{"template_id": "renting", "items": [{"client_id": 1, "form_data": {...},
+    "filename": "opcional.pdf"}, ...], "zip": false}``.  La plantilla se parsea
+    una vez; cada contrato se rellena igual que en ``generate-pdf`` y los PDFs
+    se renderizan en paralelo en el pool.  Todos los ``ClientDocument`` se
+    crean en una sola transacción.  Devuelve el resultado por elemento
+    (``ok`` | ``error``) y, con ``zip``, ``zip_filename`` para descargar todos
+    los PDFs con ``/api/contracts/download/<zip_filename>``.
+    """
+    data = request.get_json(silent=True) or {}
+    template_id = data.get('template_id')
+    items = data.get('items')
+    if not template_id:
+        return jsonify({'error': 'Template ID is required'}), 400
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items debe ser una lista no vacía de {client_id, form_data}'}), 400
+    if len(items) > CONTRACT_BATCH_MAX:
+        return jsonify({'error': f'Máximo {CONTRACT_BATCH_MAX} contratos por lote'}), 400
+    template_filename = CONTRACT_TEMPLATE_FILES.get(template_id)
+    if template_filename is None:
+        return jsonify({'error': 'Invalid template ID'}), 400
+    template_path = os.path.join(STATIC_FOLDER, 'contracts', 'templates', template_filename)
+    if not os.path.exists(template_path):
+        return jsonify({'error': 'Template file not found'}), 404
+    try:
+        template = _contract_template(template_path)
+    except Exception as e:
+        return jsonify({'error': f'Error processing DOCX: {str(e)}'}), 400
+
+    # Clientes y nombres ya usados: dos consultas para todo el lote
+    client_ids = {item.get('client_id') for item in items if isinstance(item, dict)}
+    clients = {c.id: c for c in Client.query.filter(Client.id.in_([i for i in client_ids if isinstance(i, int)]))}
+    taken = set(
+        db.session.query(ClientDocument.client_id, ClientDocument.filename)
+        .filter(ClientDocument.client_id.in_(list(clients)))
+    )
+    today = datetime.now().strftime('%Y%m%d')
+    results = []
+    window = max(1, min(PDF_RENDER_QUEUE_MAX, max(1, PDF_RENDER_WORKERS) * 2))
+
+    def _collect(entry):
+        result, safe_filename, job = entry
+        try:
+            pdf_bytes = job.result(timeout=PDF_RENDER_TIMEOUT)
+        except Exception as e:
+            app.logger.error(f"Error rendering batch contract for client {result['client_id']}: {e}")
+            result.update(status='error', error='Error generating PDF')
+            return
+        result['pdf_bytes'] = pdf_bytes
+
+    in_flight = deque()
+    for index, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        client = clients.get(item.get('client_id'))
+        result = {'index': index, 'client_id': item.get('client_id'), 'status': 'ok'}
+        results.append(result)
+        if client is None:
+            result.update(status='error', error='Client not found')
+            continue
+        safe_filename = secure_filename(item.get('filename') or f'contrato_{template_id}_{client.id}_{today}.pdf')
+        if not safe_filename.lower().endswith('.pdf'):
+            safe_filename += '.pdf'
+        if (client.id, safe_filename) in taken:
+            result.update(status='error', error=f'Ya existe un documento con el nombre "{safe_filename}" para este cliente')
+            continue
+        taken.add((client.id, safe_filename))
+        result['filename'] = safe_filename
+        try:
+            doc = template.clone()
+            _fill_contract_placeholders(template, doc, _contract_generate_values(template_id, template, item.get('form_data')))
+            fn, args = _contract_pdf_job(doc, template)
+        except (ValueError, TypeError) as e:
+            result.update(status='error', error=f'form_data inválido: {e}')
+            continue
+        try:
+            job = _submit_pdf_render(fn, *args)
+        except HTTPException:
+            # Cola llena por otras peticiones: renderizar aquí mismo
+            job = Future()
+            try:
+                job.set_result(fn(*args))
+            except Exception as e:
+                job.set_exception(e)
+        in_flight.append((result, safe_filename, job))
+        if len(in_flight) >= window:
+            _collect(in_flight.popleft())
+    while in_flight:
+        _collect(in_flight.popleft())
+
+    # Blobs y filas en un único commit (si falla, _blob_commit borra los blobs nuevos)
+    written = []
+    records = []
+    try:
+        with _blob_commit():
+            for result in results:
+                pdf_bytes = result.pop('pdf_bytes', None)
+                if pdf_bytes is None:
+                    continue
+                sha, _, stored_rel = _blob_put([pdf_bytes])
+                written.append((result, sha, pdf_bytes))
+                record = ClientDocument(
+                    client_id=result['client_id'],
+                    category='document',
+                    filename=result['filename'],
+                    stored_path=stored_rel,
+                    sha256=sha,
+                    content_type='application/pdf',
+                    size_bytes=len(pdf_bytes),
+                )
+                records.append((result, record))
+            db.session.add_all([record for _, record in records])
+    except Exception as e:
+        app.logger.error(f"Error saving contract batch: {e}")
+        return jsonify({'error': 'Error saving contract batch'}), 500
+    for result, record in records:
+        result['document_id'] = record.id
+        result['size_bytes'] = record.size_bytes
+
+    payload = {
+        'template_id': template_id,
+        'saved': len(records),
+        'failed': len(results) - len(records),
+        'results': results,
+    }
+    if data.get('zip') and written:
+        zip_filename = f'contratos_{template_id}_{uuid4().hex[:12]}.zip'
+        with zipfile.ZipFile(os.path.join(DOWNLOAD_FOLDER, zip_filename), 'w', compression=zipfile.ZIP_STORED) as zf:
+            for result, _, pdf_bytes in written:
+                zf.writestr(f"{result['client_id']}_{result['filename']}", pdf_bytes)
+        payload['zip_filename'] = zip_filename
+    return jsonify(payload), 201 if records else 400
+
+
 @app.get('/static/contracts/images/<filename>')
 def serve_contract_image(filename):
     """
@@ -3332,11 +5524,14 @@ def serve_contract_image(filename):
         Image file
     """
     try:
-        image_path = os.path.join('static', 'contracts', 'images', secure_filename(filename))
-        if not os.path.exists(image_path):
+        image_path = os.path.join(STATIC_FOLDER, 'contracts', 'images', secure_filename(filename))
+        if not os.path.isfile(image_path):
             return jsonify({'error': 'Image not found'}), 404
-        
-        return send_file(image_path)
+
+        # Nombre fijo que puede reemplazarse: revalidar siempre por ETag (304)
+        resp = send_file(image_path, etag=_static_file_sha256(image_path), conditional=True)
+        resp.headers['Cache-Control'] = 'public, no-cache'
+        return resp
         
     except Exception as e:
         app.logger.error(f"Error serving contract image: {e}")
@@ -3354,8 +5549,437 @@ def slugify(text):
     text = re.sub(r'[-\s]+', '_', text)
     return text.strip('_')
 
+_PLACEHOLDER_RE = re.compile(r'\[(.+?)\]')
+
+
+class _ContractTemplate:
+    """A contract DOCX parsed once per (path, mtime) and reused by every request.
+
+    ``document`` is the pristine parse and must never be mutated: callers fill
+    a private copy from ``clone()`` (an in-memory deep copy, no zip/XML
+    re-parse).  ``paragraph_map`` holds, for each paragraph that contains
+    placeholders, its location — ``(i,)`` in the body or ``(table, row, cell,
+    paragraph)`` in a table — and the tokens found in it.  ``paragraph_styles``
+    and ``heading_kinds`` let ``_docx_to_html`` skip python-docx style
+    lookups and heading classification on every render.
+    """
+    __slots__ = ('path', 'stamp', 'document', 'placeholders', 'original_tokens', 'paragraph_map',
+                 'paragraph_styles', 'heading_kinds', 'filled_paragraphs')
+
+    def __init__(self, path: str, stamp: tuple):
+        self.path = path
+        self.stamp = stamp
+        self.document = Document(path)
+        placeholders = {}
+        paragraph_map = []
+        for i, paragraph in enumerate(self.document.paragraphs):
+            tokens = self._tokens(paragraph.text, placeholders)
+            if tokens:
+                paragraph_map.append(((i,), tokens))
+        seen = set()
+        for t, table in enumerate(self.document.tables):
+            for r, row in enumerate(table.rows):
+                for c, cell in enumerate(row.cells):
+                    # Las celdas combinadas se repiten en row.cells: visitar cada párrafo una vez
+                    for k, paragraph in enumerate(cell.paragraphs):
+                        if id(paragraph._p) in seen:
+                            continue
+                        seen.add(id(paragraph._p))
+                        tokens = self._tokens(paragraph.text, placeholders)
+                        if tokens:
+                            paragraph_map.append(((t, r, c, k), tokens))
+        self.placeholders = tuple(placeholders)
+        self.original_tokens = {name: f'[{name}]' for name in self.placeholders}
+        self.paragraph_map = tuple(paragraph_map)
+        # Para _docx_to_html: (nombre, negrita) por id de estilo de párrafo (None = estilo por defecto),
+        # tipo de título de cada párrafo del cuerpo y párrafos cuyo texto cambia al rellenar
+        self.paragraph_styles = {None: self._style_info(self.document.styles.default(WD_STYLE_TYPE.PARAGRAPH))}
+        for style in self.document.styles:
+            if style.type == WD_STYLE_TYPE.PARAGRAPH:
+                self.paragraph_styles[style.style_id] = self._style_info(style)
+        self.heading_kinds = tuple(
+            _classify_contract_paragraph(p.text.strip(), self.style_of(p)[0]) for p in self.document.paragraphs
+        )
+        self.filled_paragraphs = frozenset(location[0] for location, _ in paragraph_map if len(location) == 1)
+
+    @staticmethod
+    def _tokens(text: str, placeholders: dict) -> tuple:
+        names = []
+        for match in _PLACEHOLDER_RE.findall(text):
+            name = match.strip()
+            placeholders.setdefault(name, None)  # dict: orden de aparición
+            names.append(name)
+        return tuple(dict.fromkeys(names))
+
+    @staticmethod
+    def _style_info(style) -> tuple:
+        if style is None:
+            return '', False
+        try:
+            bold = bool(style.font.bold)
+        except Exception:
+            bold = False
+        return style.name, bold
+
+    def style_of(self, paragraph) -> tuple:
+        """``(style name, bold by style)`` of a paragraph without python-docx's per-call style lookup."""
+        return self.paragraph_styles.get(paragraph._p.style, self.paragraph_styles[None])
+
+    def clone(self):
+        """Private, mutable copy of the pristine document."""
+        return copy.deepcopy(self.document)
+
+    def paragraphs(self, doc):
+        """Yield ``(paragraph, placeholder_names)`` of ``doc`` (a clone) that hold placeholders."""
+        for location, names in self.paragraph_map:
+            if len(location) == 1:
+                yield doc.paragraphs[location[0]], names
+            else:
+                t, r, c, k = location
+                yield doc.tables[t].rows[r].cells[c].paragraphs[k], names
+
+
+def _fill_contract_placeholders(template: _ContractTemplate, doc, values: dict) -> list:
+    """Replace ``[placeholder]`` tokens in ``doc`` (a ``template.clone()``) in a single pass.
+
+    ``values`` maps placeholder names to replacement text; tokens without an
+    entry are left as they are.  Only the paragraphs in
+    ``template.paragraph_map`` are visited, each with one regex scan.  Edits
+    are applied to the runs — a token split across runs is rewritten into
+    its first run and trimmed from the rest — so bold/italic survive.
+    Returns the ``(name, value)`` pairs replaced.
+    """
+    replaced = []
+    for paragraph, _names in template.paragraphs(doc):
+        runs = paragraph.runs
+        texts = [run.text for run in runs]
+        full = ''.join(texts)
+        matches = []
+        for m in _PLACEHOLDER_RE.finditer(full):
+            name = m.group(1).strip()
+            if name in values:
+                matches.append((m.start(), m.end(), values[name]))
+                replaced.append((name, values[name]))
+        if not matches:
+            continue
+        if full != paragraph.text:
+            # Hipervínculos: su texto no está en paragraph.runs; se reescribe el párrafo entero
+            paragraph.text = _PLACEHOLDER_RE.sub(
+                lambda m: values.get(m.group(1).strip(), m.group(0)), paragraph.text)
+            continue
+        offsets = []
+        pos = 0
+        for text in texts:
+            offsets.append(pos)
+            pos += len(text)
+        new_texts = list(texts)
+        # De derecha a izquierda, así los offsets originales siguen siendo válidos.
+        # bisect_right salta los runs vacíos (comparten offset con el siguiente).
+        for begin, stop, value in reversed(matches):
+            i = bisect.bisect_right(offsets, begin) - 1
+            j = bisect.bisect_right(offsets, stop - 1) - 1
+            head = new_texts[i][:begin - offsets[i]]
+            if i == j:
+                new_texts[i] = head + value + new_texts[i][stop - offsets[i]:]
+            else:
+                new_texts[i] = head + value
+                for k in range(i + 1, j):
+                    new_texts[k] = ''
+                new_texts[j] = new_texts[j][stop - offsets[j]:]
+        for run, old, new in zip(runs, texts, new_texts):
+            if new != old:
+                run.text = new
+    return replaced
+
+
+# template_id -> fichero en static/contracts/templates
+CONTRACT_TEMPLATE_FILES = {
+    'compraventa': 'Contrato_Compraventa_Plazos_NIOXTEC_v5.docx',
+    'renting': 'Plantilla_Contrato_Renting_Firma_Datos_v2.docx',
+}
+
+# Placeholder de la plantilla -> clave de form_data (generate-pdf y save-as-document)
+CONTRACT_PLACEHOLDER_MAPPING = {
+    # Compraventa template - usar solo las claves principales
+    'Nombre completo del cliente': 'nombre_completo_del_cliente',
+    'DNI DEL CLIENTE': 'numero',
+    'Dirección del cliente': 'direccion',
+    'Teléfono del cliente': 'telefono',
+    'Correo del cliente': 'correo',
+    'Modelo del producto': 'modelo',
+    'Pulgadas del producto': 'pulgadas',
+    'Número de serie del producto': 'numero_serie',
+    'importe total en euros, IVA incluido': 'importe_total_en_euros_iva_incluido',
+    'número de plazos': 'numero_de_plazos',
+    'importe de cada cuota': 'importe_de_cada_cuota',
+    'Tabla de interes': 'tabla_de_interes',
+
+    # Campos duplicados - mapear a las mismas claves principales
+    'Nombre del comprador': 'nombre_completo_del_cliente',  # = Nombre completo del cliente
+    'Dni del comprador': 'numero',  # = DNI DEL CLIENTE
+    'Modelo': 'modelo',  # = Modelo del producto
+    'Pulgadas': 'pulgadas',  # = Pulgadas del producto
+    'Número de Serie': 'numero_serie',  # = Número de serie del producto
+
+    # Renting template
+    'Nombre de la empresa o persona': 'nombre_de_la_empresa_o_persona',
+    'Número': 'numero',
+    'Dirección': 'direccion',
+    'Nombre representante': 'nombre_representante',
+    'Cargo': 'cargo',
+    'Teléfono': 'telefono',
+    'Correo': 'correo',
+    'Marca': 'marca',
+    'importe en euros': 'importe_en_euros',
+    'plataforma de pago': 'plataforma_de_pago',
+    'IBAN': 'iban',
+    'importe ajustado': 'importe_ajustado',
+    # Fecha actual en formato DD-MM-AAAA (nueva etiqueta en plantillas)
+    'FECHA FORMATO DD-MM-AAAA': 'fecha_formato_dd_mm_aaaa',
+}
+
+
+def _contract_interest_text(num_plazos: int) -> str:
+    """Interest table text by number of installments (generate-pdf and batch)."""
+    if 0 <= num_plazos <= 3:
+        return "Sin intereses"
+    elif 4 <= num_plazos <= 6:
+        return "5% interés mensual"
+    elif 7 <= num_plazos <= 12:
+        return "10% interés mensual"
+    elif 13 <= num_plazos <= 18:
+        return "20% interés mensual"
+    elif 19 <= num_plazos <= 24:
+        return "30% interés mensual"
+    else:
+        return "Sin intereses"  # Por defecto
+
+
+def _contract_generate_values(template_id: str, template, form_data) -> dict:
+    """Placeholder -> text for generate-pdf and the batch endpoint.
+
+    Adds today's date and, for compraventa, the interest text; placeholders
+    without data in the form are left as they are in the document.  Raises
+    ValueError if ``numero_de_plazos`` is not a number.
+    """
+    # Asegurar fecha actual si la plantilla la requiere y no viene en el formulario
+    form_data = dict(form_data or {})
+    if 'fecha_formato_dd_mm_aaaa' not in form_data:
+        form_data['fecha_formato_dd_mm_aaaa'] = datetime.now().strftime('%d-%m-%Y')
+    # Calculate interest based on number of installments
+    if template_id == 'compraventa' and 'numero_de_plazos' in form_data:
+        form_data['tabla_de_interes'] = _contract_interest_text(int(form_data['numero_de_plazos']))
+    values = {}
+    for placeholder_name in template.placeholders:
+        form_key = CONTRACT_PLACEHOLDER_MAPPING.get(placeholder_name, placeholder_name)
+        if form_key in form_data:
+            values[placeholder_name] = str(form_data[form_key])
+    return values
+
+
+def _contract_pdf_job(doc, template) -> tuple:
+    """Return ``(fn, args)`` to render a filled contract on the PDF pool.
+
+    wkhtmltopdf with the corporate header when pdfkit is installed, the plain
+    ReportLab fallback otherwise.  The HTML is built here, in the caller.
+    """
+    if pdfkit is not None:
+        # Convert DOCX to HTML first (simple approach)
+        html_content = _docx_to_html(doc, template)
+
+        # Create contract template HTML
+        contract_html = f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="UTF-8">
+            <style>
+                body {{
+                    font-family: "Cambria", "Times New Roman", serif;
+                    line-height: 1.4;
+                    margin: 1.5cm 1.2cm 1.5cm 1.2cm;
+                    font-size: 11pt;
+                    color: #333;
+                }}
+                .header {{
+                    display: flex;
+                    justify-content: center;
+                    align-items: center;
+                    text-align: center;
+                    margin-bottom: 1.5em;
+                    page-break-inside: avoid;
+                    width: 100%;
+                }}
+                .header img {{
+                    max-height: 70px;
+                    max-width: 160px;
+                    object-fit: contain;
+                    margin: 0 auto;
+                    display: block;
+                }}
+                /* Párrafos con mejor espaciado */
+                p {{
+                    margin: 0.5em 0;
+                    text-align: justify;
+                }}
+                /* Negritas destacadas */
+                strong {{
+                    font-weight: bold;
+                    color: #222;
+                }}
+                /* Jerarquía visual mejorada para títulos */
+                h1, h2, h3 {{
+                    color: #65AAC3;
+                    font-family: "Cambria", "Georgia", "Times New Roman", serif;
+                    font-weight: bold;
+                    page-break-after: avoid;
+                    line-height: 1.2;
+                }}
+                h1 {{ 
+                    font-size: 14pt;
+                    margin-top: 0.5em;
+                    margin-bottom: 1.2em;
+                    letter-spacing: 0.5px;
+                    font-family: "Cambria", "Georgia", "Times New Roman", serif;
+                }}
+                h2 {{ 
+                    font-size: 12pt;
+                    margin-top: 2em;
+                    margin-bottom: 0.8em;
+                    padding-top: 0.5em;
+                    border-top: 2px solid #65AAC3;
+                    font-family: "Cambria", "Georgia", "Times New Roman", serif;
+                }}
+                h3 {{ 
+                    font-size: 10pt;
+                    margin-top: 1.2em;
+                    margin-bottom: 0.6em;
+                    font-family: "Cambria", "Georgia", "Times New Roman", serif;
+                }}
+                /* Estilos específicos para títulos del contrato */
+                .contract-title {{
+                    font-size: 16pt;
+                    color: #65AAC3;
+                    font-weight: bold;
+                    text-align: center;
+                    margin-bottom: 1.5em;
+                    text-transform: uppercase;
+                    letter-spacing: 0.5px;
+                    font-family: "Cambria", "Georgia", "Times New Roman", serif;
+                }}
+                .section-title {{
+                    font-size: 14pt;
+                    color: #65AAC3;
+                    font-weight: bold;
+                    margin-top: 2.5em;
+                    margin-bottom: 1em;
+                    padding-top: 0.8em;
+                    padding-bottom: 0.3em;
+                    border-top: 2px solid #65AAC3;
+                    border-bottom: 1px solid #65AAC3;
+                    font-family: "Cambria", "Georgia", "Times New Roman", serif;
+                }}
+                .subsection-title {{
+                    font-size: 12pt;
+                    color: #65AAC3;
+                    font-weight: bold;
+                    margin-top: 1.5em;
+                    margin-bottom: 0.7em;
+                    font-family: "Cambria", "Georgia", "Times New Roman", serif;
+                }}
+                /* Tablas mejoradas */
+                table {{
+                    width: 100%;
+                    border-collapse: collapse;
+                    margin: 1.2em 0;
+                    font-family: "Cambria", "Times New Roman", serif;
+                    font-size: 10.5pt;
+                    page-break-inside: avoid;
+                }}
+                th, td {{
+                    border: 1px solid #ccc;
+                    padding: 10px 12px;
+                    text-align: left;
+                    font-family: "Cambria", "Times New Roman", serif;
+                }}
+                th {{
+                    background-color: #65AAC3;
+                    color: white;
+                    font-weight: bold;
+                    font-size: 11pt;
+                }}
+                td {{
+                    background-color: #fafafa;
+                }}
+                tr:nth-child(even) td {{
+                    background-color: #f5f5f5;
+                }}
+                /* Sección de firma */
+                .signature-section {{
+                    margin-top: 3em;
+                    page-break-before: auto;
+                    page-break-inside: avoid;
+                }}
+                .signature-line {{
+                    border-top: 2px solid #333;
+                    margin-top: 2.5em;
+                    padding-top: 0.8em;
+                    text-align: center;
+                    font-weight: bold;
+                }}
+            </style>
+        </head>
+        <body>
+            <div class="header">
+                <img src="{Path(os.path.join(STATIC_FOLDER, 'contracts', 'images', 'header-right.png')).resolve().as_uri()}" alt="NIOXTEC Logo" />
+            </div>
+            {html_content}
+        </body>
+        </html>
+        """
+
+        options = {
+            'enable-local-file-access': None,
+            'page-size': 'A4',
+            'margin-top': '0.75cm',
+            'margin-right': '1.2cm',
+            'margin-bottom': '0.75cm',
+            'margin-left': '1.2cm',
+            'encoding': 'UTF-8',
+            'no-outline': None,
+            'print-media-type': None,
+            'disable-smart-shrinking': None,
+            'zoom': 1.0,
+            'dpi': 96,
+            'minimum-font-size': 10
+        }
+        return _html_to_pdf, (contract_html, options)
+    # Fallback to reportlab
+    return _generate_contract_pdf_fallback, (_docx_to_text(doc),)
+
+_contract_template_cache: dict = {}
+_contract_template_lock = threading.Lock()
+
+
+def _contract_template(template_path: str) -> _ContractTemplate:
+    """Cached ``_ContractTemplate`` for ``template_path``; re-parsed only when the file changes.
+
+    Raises OSError if the file does not exist and whatever python-docx raises
+    if it is not a valid DOCX.
+    """
+    st = os.stat(template_path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _contract_template_cache.get(template_path)
+    if cached is not None and cached.stamp == stamp:
+        return cached
+    template = _ContractTemplate(template_path, stamp)
+    with _contract_template_lock:
+        _contract_template_cache[template_path] = template
+    return template
+
+
 def extract_placeholders_from_docx(filename):
-    """Extract placeholders from DOCX file."""
+    """Extract placeholders from DOCX file (served from the template cache)."""
     try:
         # Path to the template file
         template_path = os.path.join(STATIC_FOLDER, 'contracts', 'templates', filename)
@@ -3363,50 +5987,32 @@ def extract_placeholders_from_docx(filename):
         if not os.path.exists(template_path):
             return {'error': f'Template file not found: {filename}'}
         
-        doc = Document(template_path)
-        placeholders = set()
-        
-        # Process paragraphs
-        for paragraph in doc.paragraphs:
-            text = paragraph.text
-            # Find all placeholders in the paragraph
-            matches = re.findall(r'\[(.+?)\]', text)
-            for match in matches:
-                placeholders.add(match.strip())
-        
-        # Process tables
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    text = cell.text
-                    # Find all placeholders in the cell
-                    matches = re.findall(r'\[(.+?)\]', text)
-                    for match in matches:
-                        placeholders.add(match.strip())
-        
+        template = _contract_template(template_path)
         return {
-            'placeholders': list(placeholders),
-            'original_tokens': {placeholder: f'[{placeholder}]' for placeholder in placeholders}
+            'placeholders': list(template.placeholders),
+            'original_tokens': dict(template.original_tokens),
         }
         
     except Exception as e:
         return {'error': f'Error processing DOCX: {str(e)}'}
 
-def _format_paragraph_with_bold(paragraph):
+def _format_paragraph_with_bold(paragraph, paragraph_has_bold_style=None):
     """
     Format paragraph text preserving bold formatting from DOCX.
     Returns HTML with <strong> tags for bold text.
     Handles bold that can be: True (explicit), False (explicit), or None (inherited from style).
+    ``paragraph_has_bold_style`` may be passed precomputed (see ``_ContractTemplate.style_of``).
     """
     html_parts = []
     
     # Check if paragraph style has bold by default
-    paragraph_has_bold_style = False
-    try:
-        if paragraph.style.font.bold:
-            paragraph_has_bold_style = True
-    except:
-        pass
+    if paragraph_has_bold_style is None:
+        paragraph_has_bold_style = False
+        try:
+            if paragraph.style.font.bold:
+                paragraph_has_bold_style = True
+        except:
+            pass
     
     for run in paragraph.runs:
         text = run.text
@@ -3432,69 +6038,82 @@ def _format_paragraph_with_bold(paragraph):
     
     return ''.join(html_parts) if html_parts else paragraph.text.replace('\n', '<br>')
 
-def _docx_to_html(docx_path):
-    """Convert DOCX to HTML for PDF generation."""
-    doc = Document(docx_path)
+# Clasificación de títulos en DOCX→HTML: tablas en vez de una cadena de if/elif
+CONTRACT_HTML_DEBUG = os.getenv('CONTRACT_HTML_DEBUG', 'false').lower() in ('1', 'true', 'yes')
+
+_CONTRACT_HEADING_HTML = {
+    # Título principal del contrato de compraventa
+    'title': '<h1 class="contract-title" style="font-size: 14pt; color: #65AAC3; font-weight: bold; text-align: center; margin-bottom: 0.5em;">{}</h1>',
+    # Título principal del contrato de renting
+    'title_renting': '<h1 class="contract-title" style="font-size: 14pt; color: #65AAC3; font-weight: bold; text-align: center; margin-bottom: 1.5em; text-transform: uppercase; letter-spacing: 0.5px;">{}</h1>',
+    'section': '<h2 class="section-title" style="font-size: 13pt; color: #65AAC3; font-weight: bold; margin-top: 2.5em; margin-bottom: 1em; padding-top: 0.8em; padding-bottom: 0.3em; border-top: 2px solid #65AAC3; border-bottom: 1px solid #65AAC3;">{}</h2>',
+    'subsection': '<h3 class="subsection-title" style="font-size: 12pt; color: #65AAC3; font-weight: bold; margin-top: 1.5em; margin-bottom: 0.7em;">{}</h3>',
+}
+
+# text.upper() -> tipo de título
+_CONTRACT_HEADINGS = {
+    'CONTRATO DE COMPRAVENTA A PLAZOS SIN INTERESES': 'title',
+    'CONTRATO DE RENTING DE PANTALLA PUBLICITARIA': 'title_renting',
+    'PARTES INTERVINIENTES': 'section',
+    'CLAUSULAS': 'section',
+    'CLÁUSULAS': 'section',
+    'ACEPTACIÓN DEL CONTRATO': 'section',
+    # Subsecciones del contrato de compraventa
+    **dict.fromkeys(['VENDEDOR', 'COMPRADOR', 'OBJETO DEL CONTRATO', 'GARANTÍA', 'IMPAGO', 'PROTECCIÓN DE DATOS',
+                     'JURISDICCIÓN', 'ENTREGA'], 'subsection'),
+    # Subsecciones del contrato de renting (títulos antiguos)
+    **dict.fromkeys(['1. OBJETO DEL CONTRATO', '2. DURACIÓN MÍNIMA DEL RENTING', '3. CUOTA DE RENTING Y FORMA DE PAGO',
+                     '4. CESIÓN DE PROPIEDAD', '5. USO, INSTALACIÓN Y CONTENIDOS', '6. SERVICIO TÉCNICO Y SOPORTE',
+                     '7. RESPONSABILIDAD Y BUENAS PRÁCTICAS', '8. FORMA DE PAGO Y AUTORIZACIÓN SEPA',
+                     '9. CANCELACIÓN ANTICIPADA', '10. JURISDICCIÓN'], 'subsection'),
+}
+
+# Nuevas subsecciones H3 del renting: por estilo de Word o por patrón de texto
+_CONTRACT_H3_STYLES = frozenset({'Heading 3', 'Título 3', 'Heading3', 'Titulo 3'})
+_CONTRACT_H3_PREFIXES = ('3.', '4.', '5. Servicio técnico', '6. Responsabilidad', '7. Cancelación', '8. Jurisdicción')
+_CONTRACT_H3_TEXTS = frozenset({'Calendario de recobro'})
+
+
+def _classify_contract_paragraph(text: str, style_name: str):
+    """Heading kind (key of ``_CONTRACT_HEADING_HTML``) for a stripped paragraph, or None for body text."""
+    kind = _CONTRACT_HEADINGS.get(text.upper())
+    if kind is not None:
+        return kind
+    if style_name in _CONTRACT_H3_STYLES or text in _CONTRACT_H3_TEXTS or text.startswith(_CONTRACT_H3_PREFIXES):
+        return 'subsection'
+    return None
+
+
+def _docx_to_html(doc, template=None):
+    """Convert a (filled, in-memory) DOCX ``Document`` to HTML for PDF generation.
+
+    With ``template`` (the ``_ContractTemplate`` ``doc`` was cloned from) the
+    heading kinds precomputed at template load are reused; only paragraphs
+    that held placeholders are classified again.
+    """
     html_parts = []
     
-    for paragraph in doc.paragraphs:
-        if paragraph.text.strip():
-            text = paragraph.text.strip()
-            
-            # Check if paragraph has a heading style
-            is_heading_3 = paragraph.style.name in ['Heading 3', 'Título 3', 'Heading3', 'Titulo 3']
-            
-            # Debug logging
-            app.logger.info(f"Processing paragraph: '{text}' (length: {len(text)}, style: {paragraph.style.name})")
-            
-            # Detectar títulos basándose en el contenido y formato
-            if text.upper() == "CONTRATO DE COMPRAVENTA A PLAZOS SIN INTERESES":
-                # Título principal del contrato de compraventa
-                app.logger.info(f"Detected main title: {text}")
-                html_parts.append(f'<h1 class="contract-title" style="font-size: 14pt; color: #65AAC3; font-weight: bold; text-align: center; margin-bottom: 0.5em;">{text}</h1>')
-            elif text.upper() == "CONTRATO DE RENTING DE PANTALLA PUBLICITARIA":
-                # Título principal del contrato de renting
-                app.logger.info(f"Detected main title: {text}")
-                html_parts.append(f'<h1 class="contract-title" style="font-size: 14pt; color: #65AAC3; font-weight: bold; text-align: center; margin-bottom: 1.5em; text-transform: uppercase; letter-spacing: 0.5px;">{text}</h1>')
-            elif text.upper() == "PARTES INTERVINIENTES":
-                # Sección principal del contrato de compraventa
-                app.logger.info(f"Detected section title: {text}")
-                html_parts.append(f'<h2 class="section-title" style="font-size: 13pt; color: #65AAC3; font-weight: bold; margin-top: 2.5em; margin-bottom: 1em; padding-top: 0.8em; padding-bottom: 0.3em; border-top: 2px solid #65AAC3; border-bottom: 1px solid #65AAC3;">{text}</h2>')
-            elif text.upper() in ["CLAUSULAS", "CLÁUSULAS"]:
-                # Sección principal del contrato de renting
-                app.logger.info(f"Detected section title: {text}")
-                html_parts.append(f'<h2 class="section-title" style="font-size: 13pt; color: #65AAC3; font-weight: bold; margin-top: 2.5em; margin-bottom: 1em; padding-top: 0.8em; padding-bottom: 0.3em; border-top: 2px solid #65AAC3; border-bottom: 1px solid #65AAC3;">{text}</h2>')
-            elif text.upper() == "ACEPTACIÓN DEL CONTRATO":
-                # Sección principal del contrato de renting
-                app.logger.info(f"Detected section title: {text}")
-                html_parts.append(f'<h2 class="section-title" style="font-size: 13pt; color: #65AAC3; font-weight: bold; margin-top: 2.5em; margin-bottom: 1em; padding-top: 0.8em; padding-bottom: 0.3em; border-top: 2px solid #65AAC3; border-bottom: 1px solid #65AAC3;">{text}</h2>')
-            elif text.upper() in ["VENDEDOR", "COMPRADOR", "OBJETO DEL CONTRATO", "GARANTÍA", "IMPAGO", "PROTECCIÓN DE DATOS", "JURISDICCIÓN", "ENTREGA"]:
-                # Subsecciones del contrato de compraventa
-                # Verificar que sea un título independiente (no parte de una frase)
-                if len(text.split()) <= 3 and not any(char in text for char in ['.', ',', ':', ';']):
-                    app.logger.info(f"Detected subsection title: {text}")
-                    html_parts.append(f'<h3 class="subsection-title" style="font-size: 12pt; color: #65AAC3; font-weight: bold; margin-top: 1.5em; margin-bottom: 0.7em;">{text}</h3>')
-                else:
-                    # Es parte de una frase, tratarlo como texto normal
-                    app.logger.info(f"Title word found in sentence, treating as normal text: {text}")
-                    text = text.replace('\n', '<br>')
-                    html_parts.append(f'<p style="margin: 0.5em 0; text-align: justify;">{text}</p>')
-            elif text.upper() in ["1. OBJETO DEL CONTRATO", "2. DURACIÓN MÍNIMA DEL RENTING", "3. CUOTA DE RENTING Y FORMA DE PAGO", "4. CESIÓN DE PROPIEDAD", "5. USO, INSTALACIÓN Y CONTENIDOS", "6. SERVICIO TÉCNICO Y SOPORTE", "7. RESPONSABILIDAD Y BUENAS PRÁCTICAS", "8. FORMA DE PAGO Y AUTORIZACIÓN SEPA", "9. CANCELACIÓN ANTICIPADA", "10. JURISDICCIÓN"]:
-                # Subsecciones del contrato de renting (títulos antiguos)
-                app.logger.info(f"Detected subsection title: {text}")
-                html_parts.append(f'<h3 class="subsection-title" style="font-size: 12pt; color: #65AAC3; font-weight: bold; margin-top: 1.5em; margin-bottom: 0.7em;">{text}</h3>')
-            # Detectar títulos H3 por estilo de Word o por patrón de texto
-            elif is_heading_3 or (text.startswith("3.") or text.startswith("4.") or 
-                  text.startswith("5. Servicio técnico") or text.startswith("6. Responsabilidad") or 
-                  text.startswith("7. Cancelación") or text.startswith("8. Jurisdicción") or
-                  text == "Calendario de recobro"):
-                # Nuevas subsecciones del contrato de renting H3
-                app.logger.info(f"Detected new H3 subsection title: {text} (is_heading_3={is_heading_3})")
-                html_parts.append(f'<h3 class="subsection-title" style="font-size: 12pt; color: #65AAC3; font-weight: bold; margin-top: 1.5em; margin-bottom: 0.7em;">{text}</h3>')
+    for i, paragraph in enumerate(doc.paragraphs):
+        text = paragraph.text.strip()
+        if not text:
+            continue
+        if template is None:
+            bold_style = None
+            kind = _classify_contract_paragraph(text, paragraph.style.name)
+        else:
+            style_name, bold_style = template.style_of(paragraph)
+            if i in template.filled_paragraphs:
+                kind = _classify_contract_paragraph(text, style_name)
             else:
-                # Texto normal - detectar negritas en runs del párrafo
-                formatted_text = _format_paragraph_with_bold(paragraph)
-                html_parts.append(f'<p style="margin: 0.5em 0; text-align: justify;">{formatted_text}</p>')
+                kind = template.heading_kinds[i]
+        if CONTRACT_HTML_DEBUG:
+            app.logger.info(f"Processing paragraph: '{text}' (length: {len(text)}, heading: {kind})")
+        if kind is not None:
+            html_parts.append(_CONTRACT_HEADING_HTML[kind].format(text))
+        else:
+            # Texto normal - detectar negritas en runs del párrafo
+            formatted_text = _format_paragraph_with_bold(paragraph, bold_style)
+            html_parts.append(f'<p style="margin: 0.5em 0; text-align: justify;">{formatted_text}</p>')
     
     for table in doc.tables:
         html_parts.append('<table border="1" style="width: 100%; border-collapse: collapse; margin: 1em 0;">')
@@ -3505,7 +6124,8 @@ def _docx_to_html(docx_path):
                 cell_html_parts = []
                 for paragraph in cell.paragraphs:
                     if paragraph.text.strip():
-                        formatted_text = _format_paragraph_with_bold(paragraph)
+                        bold_style = template.style_of(paragraph)[1] if template is not None else None
+                        formatted_text = _format_paragraph_with_bold(paragraph, bold_style)
                         cell_html_parts.append(formatted_text)
                 
                 cell_content = '<br>'.join(cell_html_parts) if cell_html_parts else ''
@@ -3515,9 +6135,8 @@ def _docx_to_html(docx_path):
     
     return '\n'.join(html_parts)
 
-def _docx_to_text(docx_path):
-    """Convert DOCX to plain text for fallback PDF generation."""
-    doc = Document(docx_path)
+def _docx_to_text(doc):
+    """Convert a DOCX ``Document`` to plain text for fallback PDF generation."""
     text_parts = []
     
     for paragraph in doc.paragraphs:
@@ -3541,7 +6160,8 @@ def _generate_contract_pdf_fallback(content):
         raise Exception("No PDF generation available")
     
     buffer = io.BytesIO()
-    doc = canvas.Canvas(buffer, pagesize=A4)
+    # invariant: sin fecha de creación ni id aleatorio, el mismo contrato da los mismos bytes (dedupe)
+    doc = canvas.Canvas(buffer, pagesize=A4, invariant=1)
     width, height = A4
     
     # Simple text rendering
@@ -657,9 +657,11 @@ const ProductDetailModal = ({ isOpen, onClose, product, onSave, onEdit, onArchiv
                             (location.hostname === 'localhost' && location.port === '5173' 
                               ? `${location.protocol}//${location.hostname}:5001` 
                               : '')).replace(/\/$/, '')
+                          const withBase = (url) => (url.startsWith('/') ? `${apiBase}${url}` : url)
                           const imageUrl = image.url || image
                           // Si la URL es relativa, agregar el apiBase
-                          const fullImageUrl = imageUrl.startsWith('/') ? `${apiBase}${imageUrl}` : imageUrl
+                          const fullImageUrl = withBase(image.variants?.full || imageUrl)
+                          const galleryImageUrl = withBase(image.variants?.medium || imageUrl)
                           
                           return (
                           <div
@@ -670,11 +672,11 @@ const ProductDetailModal = ({ isOpen, onClose, product, onSave, onEdit, onArchiv
                             onClick={() => setSelectedImage(fullImageUrl)}
                           >
                             <img
-                              src={fullImageUrl}
+                              src={galleryImageUrl}
                               alt={image.alt || `Imagen ${idx + 1}`}
                               className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-300"
                               onError={(e) => {
-                                console.error('❌ Error cargando imagen:', fullImageUrl)
+                                console.error('❌ Error cargando imagen:', galleryImageUrl)
                                 e.target.src = 'data:image/svg+xml,%3Csvg xmlns="http://www.w3.org/2000/svg" width="100" height="100"%3E%3Crect fill="%23333" width="100" height="100"/%3E%3Ctext fill="%23999" x="50%25" y="50%25" text-anchor="middle" dy=".3em"%3EError%3C/text%3E%3C/svg%3E'
                               }}
                             />
@@ -161,6 +161,56 @@ export async function apiPatch(path, body, token) {
   return res.json()
 }
 
+/**
+ * Upload a large file through the resumable init/append/commit protocol.
+ *
+ * The file is sent in slices of the size suggested by the server; after a
+ * network error or an offset mismatch (409) it asks the server how much it
+ * already has and continues from there.
+ *
+ * @param {string} path - Uploads endpoint (e.g. `/clients/1/documents/uploads`)
+ * @param {File} file - File to upload
+ * @param {string} token - JWT token for authentication
+ * @param {(sent: number, total: number) => void} onProgress - Optional progress callback
+ * @returns {Promise<Object>} JSON response of the commit (e.g. `{ id }`)
+ * @throws {Error} API error message
+ */
+export async function apiUploadResumable(path, file, token, onProgress = null) {
+  const session = await apiPost(path, { filename: file.name, size: file.size }, token)
+  const url = `${API_BASE}/api${path}/${session.upload_id}`
+  const auth = token ? { Authorization: `Bearer ${token}` } : {}
+  let offset = session.offset
+  let retries = 0
+  while (offset < file.size) {
+    const end = Math.min(file.size, offset + session.chunk_size)
+    let res = null
+    try {
+      res = await fetch(`${url}?offset=${offset}`, {
+        method: 'PUT',
+        headers: { ...auth, 'Content-Type': 'application/octet-stream' },
+        credentials: 'include',
+        body: file.slice(offset, end),
+      })
+    } catch (err) {
+      if (++retries > 5) throw err
+    }
+    if (res && res.ok) {
+      offset = (await res.json()).offset
+      retries = 0
+      if (onProgress) onProgress(offset, file.size)
+      continue
+    }
+    if (res && res.status !== 409 && res.status < 500) {
+      const e = new Error(await safeError(res))
+      e.status = res.status
+      throw e
+    }
+    if (res && ++retries > 5) throw new Error(await safeError(res))
+    offset = (await apiGet(`${path}/${session.upload_id}`, token)).offset
+  }
+  return apiPost(`${path}/${session.upload_id}/commit`, {}, token)
+}
+
 /**
  * Extract error message from API response.
  * 
@@ -4,7 +4,7 @@ import { motion, AnimatePresence, useReducedMotion } from 'framer-motion'
 import { MOTION } from '../styles/motion'
 import { formatDateES } from '../lib/format'
 import { useStore } from '../store/store'
-import { apiGet, apiPost, apiDelete, apiGetBlob, apiPut } from '../lib/api'
+import { apiGet, apiPost, apiDelete, apiGetBlob, apiPut, apiUploadResumable } from '../lib/api'
 import toast from 'react-hot-toast'
 import ContractGeneratorModal from '../features/contracts/components/ContractGeneratorModal'
 import CustomSkeleton from "../components/CustomSkeleton"
@@ -14,6 +14,9 @@ import DataCard from "../components/DataCard"
 import Pagination from "../components/Pagination"
 import AuthenticatedImage from "../components/AuthenticatedImage"
 
+// Por encima de este tamaño se usa la subida reanudable por trozos
+const RESUMABLE_UPLOAD_THRESHOLD = 8 * 1024 * 1024
+
 export default function Clientes() {
   const { 
     clients, 
@@ -188,15 +191,20 @@ export default function Clientes() {
     }
     setUploading(true)
     try {
-      const formData = new FormData()
-      formData.append('file', file)
-      const res = await fetch(`${apiBase}/api/clients/${selectedClient.id}/documents`, {
-        method: 'POST',
-        headers: { Authorization: token ? `Bearer ${token}` : '' },
-        credentials: 'include',
-        body: formData,
-      })
-      if (!res.ok) throw new Error((await res.json()).error || res.statusText)
+      if (file.size > RESUMABLE_UPLOAD_THRESHOLD) {
+        // Escaneos grandes: subida por trozos reanudable (el túnel limita el tamaño por petición)
+        await apiUploadResumable(`/clients/${selectedClient.id}/documents/uploads`, file, token)
+      } else {
+        const formData = new FormData()
+        formData.append('file', file)
+        const res = await fetch(`${apiBase}/api/clients/${selectedClient.id}/documents`, {
+          method: 'POST',
+          headers: { Authorization: token ? `Bearer ${token}` : '' },
+          credentials: 'include',
+          body: formData,
+        })
+        if (!res.ok) throw new Error((await res.json()).error || res.statusText)
+      }
       toast.success('Archivo subido')
       await loadClientDocs(selectedClient.id)
     } catch (err) {
@@ -834,8 +834,12 @@ export default function Productos() {
                       {product.images && product.images.length > 0 ? (
                         <div className="aspect-video w-full rounded-lg overflow-hidden mb-3 bg-white dark:bg-gray-900">
                           <img
-                            src={product.images[0].url}
+                            src={product.images[0].variants?.thumb || product.images[0].url}
+                            srcSet={product.images[0].variants
+                              ? `${product.images[0].variants.thumb} 1x, ${product.images[0].variants.medium} 2x`
+                              : undefined}
                             alt={product.model}
+                            loading="lazy"
                             className="w-full h-full object-contain"
                           />
                         </div>
@@ -32,30 +32,19 @@ export default function Reportes() {
   const [showCard1Menu, setShowCard1Menu] = useState(false)
   const [showCard2Menu, setShowCard2Menu] = useState(false)
 
+  // Un único endpoint con ETag: resumen anual, totales del mes y heatmap
   useEffect(() => {
     async function load() {
       setLoadingCombined(true)
+      setLoadingHeatmap(true)
       try {
-        const data = await apiGet(`/reports/combined_summary?year=${year}`, token)
+        const data = await apiGet(`/reports/dashboard?year=${year}&month=${month}`, token)
         setCombinedData(data)
+        setHeatmap({ year: data.year, month: data.month, by_day: data.heatmap?.income || {} })
       } catch (error) {
-        console.error('Error loading combined summary:', error)
+        console.error('Error loading dashboard:', error)
       } finally {
         setLoadingCombined(false)
-      }
-    }
-    if (token) load()
-  }, [token, year])
-
-  useEffect(() => {
-    async function load() {
-      setLoadingHeatmap(true)
-      try {
-        const data = await apiGet(`/reports/heatmap?year=${year}&month=${month}`, token)
-        setHeatmap(data)
-      } catch (error) {
-        console.error('Error loading heatmap:', error)
-      } finally {
         setLoadingHeatmap(false)
       }
     }
@@ -200,6 +189,8 @@ export default function Reportes() {
   const downloadClients = () => downloadXlsx('/clients/export_xlsx', 'clientes.xlsx')
   const downloadInvoices = () => downloadXlsx('/invoices/export_xlsx', 'facturas.xlsx')
   const downloadExpenses = () => downloadXlsx('/expenses/export_xlsx', 'gastos.xlsx')
+  const downloadAccounting = () => downloadXlsx(`/reports/accounting_xlsx?year=${year}&month=${month}`,
+    `contabilidad_${year}-${String(month).padStart(2,'0')}.xlsx`)
 
   // Custom tooltip for the chart
   const CustomTooltip = ({ active, payload, label }) => {
@@ -394,6 +385,12 @@ export default function Reportes() {
           >
             Exportar facturas XLSX
           </button>
+          <button 
+            onClick={downloadAccounting} 
+            className="border border-gray-400 text-gray-300 px-3 py-2 rounded hover:bg-gray-700 hover:border-gray-300 transition-all duration-200 text-sm whitespace-nowrap w-full"
+          >
+            Exportar contabilidad XLSX ({months[month-1]} {year})
+          </button>
         </div>
       </section>
 
@@ -0,0 +1,11 @@
+"""
+Configuración de gunicorn (se carga sola desde el directorio de trabajo; en
+Docker, /app).  Los parámetros de arranque siguen en el CMD de Dockerfile.backend.
+"""
+
+
+def post_worker_init(worker):
+    # Pool de render de PDFs creado con fork mientras el worker solo tiene un
+    # hilo: app ya está importada y los hilos de --threads aún no existen.
+    from app import warm_pdf_render_pool
+    warm_pdf_render_pool()
@@ -0,0 +1,56 @@
+"""Add report_rollup table (pre-aggregated daily totals for reports)
+
+Revision ID: 0006_report_rollups
+Revises: 0005_add_product_images
+Create Date: 2026-10-18
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0006_report_rollups'
+down_revision = '0005_add_product_images'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    rollup = op.create_table(
+        'report_rollup',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('kind', sa.String(length=16), nullable=False),
+        sa.Column('year', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.UniqueConstraint('kind', 'year', 'month', 'day', name='uq_report_rollup_period'),
+    )
+
+    # Backfill: un GROUP BY date por tabla origen
+    conn = op.get_bind()
+    now = datetime.utcnow()
+    sources = {
+        'income': "SELECT date, SUM(total), COUNT(id) FROM invoice "
+                  "WHERE type = 'factura' AND paid = :paid GROUP BY date",
+        'expense': "SELECT date, SUM(total), COUNT(id) FROM expense GROUP BY date",
+    }
+    for kind, sql in sources.items():
+        rows = conn.execute(sa.text(sql), {'paid': True}).fetchall()
+        payload = []
+        for d, total, count in rows:
+            if d is None:
+                continue
+            y, m, dd = (int(part) for part in str(d)[:10].split('-'))
+            payload.append({'kind': kind, 'year': y, 'month': m, 'day': dd,
+                            'total': float(total or 0), 'count': int(count), 'updated_at': now})
+        if payload:
+            op.bulk_insert(rollup, payload)
+
+
+def downgrade():
+    op.drop_table('report_rollup')
@@ -0,0 +1,79 @@
+"""Add search_index (FTS5 trigram on SQLite, pg_trgm GIN on Postgres)
+
+Revision ID: 0007_search_index
+Revises: 0006_report_rollups
+Create Date: 2026-10-18
+
+"""
+import unicodedata
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0007_search_index'
+down_revision = '0006_report_rollups'
+branch_labels = None
+depends_on = None
+
+ENTITIES = ('client', 'invoice', 'product', 'expense')
+
+# Mismas columnas que _search_index_rows en app.py: (id, title, subtitle, resto...)
+SOURCES = {
+    'client': 'SELECT id, name, cif, email, phone FROM client',
+    'invoice': 'SELECT invoice.id, invoice.number, client.name FROM invoice JOIN client ON client.id = invoice.client_id',
+    'product': 'SELECT id, model, category, sku FROM product',
+    'expense': 'SELECT id, description, supplier, category FROM expense',
+}
+
+
+def _normalize(value) -> str:
+    value = unicodedata.normalize('NFD', str(value or ''))
+    return ''.join(c for c in value if not unicodedata.combining(c)).casefold()
+
+
+def upgrade():
+    conn = op.get_bind()
+    sqlite = conn.dialect.name == 'sqlite'
+    if sqlite:
+        op.execute(
+            "CREATE VIRTUAL TABLE search_index USING fts5("
+            "entity UNINDEXED, entity_id UNINDEXED, title UNINDEXED, subtitle UNINDEXED, body, "
+            "tokenize='trigram')"
+        )
+    else:
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_table(
+            'search_index',
+            sa.Column('entity', sa.String(length=16), nullable=False),
+            sa.Column('entity_id', sa.Integer(), nullable=False),
+            sa.Column('title', sa.Text()),
+            sa.Column('subtitle', sa.Text()),
+            sa.Column('body', sa.Text(), nullable=False),
+            sa.PrimaryKeyConstraint('entity', 'entity_id'),
+        )
+        op.execute('CREATE INDEX ix_search_index_body_trgm ON search_index USING gin (body gin_trgm_ops)')
+
+    # Backfill
+    if sqlite:
+        insert = sa.text('INSERT INTO search_index (rowid, entity, entity_id, title, subtitle, body) '
+                         'VALUES (:rowid, :entity, :entity_id, :title, :subtitle, :body)')
+    else:
+        insert = sa.text('INSERT INTO search_index (entity, entity_id, title, subtitle, body) '
+                         'VALUES (:entity, :entity_id, :title, :subtitle, :body)')
+    for entity, sql in SOURCES.items():
+        payload = []
+        for row in conn.execute(sa.text(sql)):
+            row_id, *fields = row
+            payload.append({
+                'rowid': row_id * len(ENTITIES) + ENTITIES.index(entity),
+                'entity': entity, 'entity_id': row_id,
+                'title': fields[0] or '', 'subtitle': fields[1] or '',
+                'body': _normalize(' '.join(str(f) for f in fields if f)),
+            })
+        if payload:
+            conn.execute(insert, payload)
+
+
+def downgrade():
+    op.execute('DROP TABLE search_index')
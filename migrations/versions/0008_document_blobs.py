@@ -0,0 +1,125 @@
+"""Content-addressed storage for client documents (stored_blob + client_document.sha256)
+
+Revision ID: 0008_document_blobs
+Revises: 0007_search_index
+Create Date: 2026-10-18
+
+Los ficheros existentes (instance/uploads/<client_id>/{documents,images}/<uuid>_<nombre>)
+se enlazan (hard link, o copia si no se puede) en instance/uploads/blobs/<sha[:2]>/<sha>:
+los duplicados quedan en un único blob con ref_count = número de documentos
+que lo usan.  Las filas cuyo fichero no existe se dejan como están (sha256 NULL).
+
+La migración no borra ni mueve ficheros: si la revisión falla y se deshace,
+las filas siguen apuntando a los originales, y repetirla reutiliza los blobs
+ya creados.  Una vez aplicada, ``flask --app app prune-legacy-uploads`` borra
+los originales que ya no referencia ninguna fila.  Igualmente, la bajada deja
+``blobs/`` en su sitio (bórralo a mano tras confirmarla).
+"""
+import hashlib
+import os
+import shutil
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+# revision identifiers, used by Alembic.
+revision = '0008_document_blobs'
+down_revision = '0007_search_index'
+branch_labels = None
+depends_on = None
+
+BLOBS_DIR = 'blobs'
+
+
+def _uploads_root() -> str:
+    # Igual que UPLOADS_ROOT en app.py (env.py ya empuja el app context)
+    return os.path.join(current_app.instance_path, 'uploads')
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _place_blob(src: str, dst: str) -> None:
+    """Hard-link (or copy) ``src`` to ``dst`` atomically, leaving ``src`` untouched."""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = f'{dst}.{os.getpid()}.tmp'
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def upgrade():
+    # Idempotente: en SQLite el DDL de un intento fallido no se deshace
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if 'stored_blob' not in inspector.get_table_names():
+        op.create_table(
+            'stored_blob',
+            sa.Column('sha256', sa.String(length=64), primary_key=True),
+            sa.Column('size_bytes', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+        )
+    if 'sha256' not in {c['name'] for c in inspector.get_columns('client_document')}:
+        with op.batch_alter_table('client_document') as batch:
+            batch.add_column(sa.Column('sha256', sa.String(length=64), nullable=True))
+            batch.create_index('ix_client_document_sha256', ['sha256'])
+    blob = sa.table('stored_blob', sa.column('sha256'), sa.column('size_bytes'), sa.column('ref_count'),
+                    sa.column('created_at'))
+
+    # Dedupe de los ficheros existentes
+    root = _uploads_root()
+    blobs = {}  # sha -> [size, refs]
+    rows = conn.execute(sa.text('SELECT id, stored_path FROM client_document WHERE sha256 IS NULL')).fetchall()
+    for doc_id, stored_path in rows:
+        old_abs = os.path.join(root, stored_path)
+        if not os.path.isfile(old_abs):
+            continue
+        sha = _sha256(old_abs)
+        new_rel = os.path.join(BLOBS_DIR, sha[:2], sha)
+        new_abs = os.path.join(root, new_rel)
+        if not os.path.isfile(new_abs):
+            _place_blob(old_abs, new_abs)
+        entry = blobs.setdefault(sha, [os.path.getsize(new_abs), 0])
+        entry[1] += 1
+        conn.execute(sa.text('UPDATE client_document SET stored_path = :p, sha256 = :s WHERE id = :i'),
+                     {'p': new_rel, 's': sha, 'i': doc_id})
+    now = datetime.utcnow()
+    if blobs:
+        op.bulk_insert(blob, [
+            {'sha256': sha, 'size_bytes': size, 'ref_count': refs, 'created_at': now}
+            for sha, (size, refs) in blobs.items()
+        ])
+
+
+def downgrade():
+    # Cada documento vuelve a tener su propia copia en <client_id>/<documents|images>/
+    conn = op.get_bind()
+    root = _uploads_root()
+    rows = conn.execute(sa.text(
+        'SELECT id, client_id, category, filename, stored_path FROM client_document WHERE sha256 IS NOT NULL'
+    )).fetchall()
+    for doc_id, client_id, category, filename, stored_path in rows:
+        src = os.path.join(root, stored_path)
+        if not os.path.isfile(src):
+            continue
+        subdir = 'documents' if category == 'document' else 'images'
+        new_rel = os.path.join(str(client_id), subdir, f'{doc_id:08d}_{filename}')
+        os.makedirs(os.path.join(root, str(client_id), subdir), exist_ok=True)
+        with open(src, 'rb') as fsrc, open(os.path.join(root, new_rel), 'wb') as fdst:
+            for chunk in iter(lambda: fsrc.read(64 * 1024), b''):
+                fdst.write(chunk)
+        conn.execute(sa.text('UPDATE client_document SET stored_path = :p WHERE id = :i'), {'p': new_rel, 'i': doc_id})
+    with op.batch_alter_table('client_document') as batch:
+        batch.drop_index('ix_client_document_sha256')
+        batch.drop_column('sha256')
+    op.drop_table('stored_blob')
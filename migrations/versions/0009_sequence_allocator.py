@@ -0,0 +1,75 @@
+"""Unique (doc_type, year, month) index on document_sequence for the upsert allocator
+
+Revision ID: 0009_sequence_allocator
+Revises: 0008_document_blobs
+Create Date: 2026-10-18
+
+0002 intentaba crear la restricción con ALTER TABLE, que SQLite no admite (el
+error se ignoraba), así que en SQLite podía haber filas duplicadas por periodo.
+Se fusionan (queda la de menor id con el mayor last_number), se sube cada
+contador al mayor número ya emitido en invoice y se crea el índice único que
+usa ``INSERT ... ON CONFLICT``.
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0009_sequence_allocator'
+down_revision = '0008_document_blobs'
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = 'uq_docseq_type_year_month'
+_NUMBER_RE = re.compile(r'^([FP])(\d{2})(\d{2})(\d{3,})$')
+
+
+def _has_unique(inspector) -> bool:
+    names = {ix['name'] for ix in inspector.get_indexes('document_sequence') if ix.get('unique')}
+    try:
+        names |= {uc['name'] for uc in inspector.get_unique_constraints('document_sequence')}
+    except NotImplementedError:
+        pass
+    return INDEX_NAME in names
+
+
+def upgrade():
+    conn = op.get_bind()
+    conn.execute(sa.text(
+        "UPDATE document_sequence SET last_number = ("
+        " SELECT MAX(s2.last_number) FROM document_sequence s2"
+        " WHERE s2.doc_type = document_sequence.doc_type AND s2.year = document_sequence.year"
+        " AND s2.month = document_sequence.month)"))
+    conn.execute(sa.text(
+        "DELETE FROM document_sequence WHERE id NOT IN ("
+        " SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM document_sequence"
+        " GROUP BY doc_type, year, month) keep)"))
+
+    # Contadores por detrás de números ya emitidos (FAAMM### / PAAMM###)
+    issued = {}
+    for (number,) in conn.execute(sa.text("SELECT number FROM invoice")):
+        match = _NUMBER_RE.match(number or '')
+        if match:
+            prefix, yy, mm, seq = match.groups()
+            key = ('factura' if prefix == 'F' else 'proforma', 2000 + int(yy), int(mm))
+            issued[key] = max(issued.get(key, 0), int(seq))
+    current = {(t, y, m): n for t, y, m, n in conn.execute(sa.text(
+        "SELECT doc_type, year, month, last_number FROM document_sequence"))}
+    for (doc_type, year, month), last in issued.items():
+        params = {'t': doc_type, 'y': year, 'm': month, 'n': last}
+        if (doc_type, year, month) not in current:
+            conn.execute(sa.text("INSERT INTO document_sequence (doc_type, year, month, last_number) "
+                                 "VALUES (:t, :y, :m, :n)"), params)
+        elif current[(doc_type, year, month)] < last:
+            conn.execute(sa.text("UPDATE document_sequence SET last_number = :n "
+                                 "WHERE doc_type = :t AND year = :y AND month = :m"), params)
+
+    if not _has_unique(sa.inspect(conn)):
+        op.create_index(INDEX_NAME, 'document_sequence', ['doc_type', 'year', 'month'], unique=True)
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    if INDEX_NAME in {ix['name'] for ix in inspector.get_indexes('document_sequence')}:
+        op.drop_index(INDEX_NAME, table_name='document_sequence')
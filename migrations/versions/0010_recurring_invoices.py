@@ -0,0 +1,53 @@
+"""Recurring invoice templates and their emitted periods
+
+Revision ID: 0010_recurring_invoices
+Revises: 0009_sequence_allocator
+Create Date: 2026-10-18
+
+``recurring_invoice`` guarda la plantilla (JSON) y la próxima fecha de
+emisión; ``recurring_invoice_run`` una fila por (plantilla, periodo YYYY-MM)
+emitido, con restricción única para que el programador sea idempotente.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0010_recurring_invoices'
+down_revision = '0009_sequence_allocator'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'recurring_invoice',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('client_id', sa.Integer(), sa.ForeignKey('client.id'), nullable=False),
+        sa.Column('name', sa.String(length=128), nullable=False),
+        sa.Column('template', sa.JSON(), nullable=False),
+        sa.Column('interval_months', sa.Integer(), nullable=False, server_default='1'),
+        sa.Column('next_run', sa.Date(), nullable=False),
+        sa.Column('end_date', sa.Date(), nullable=True),
+        sa.Column('active', sa.Boolean(), nullable=False, server_default=sa.true()),
+        sa.Column('prerender_pdf', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('last_run_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+    )
+    op.create_index('ix_recurring_invoice_client_id', 'recurring_invoice', ['client_id'])
+    op.create_index('ix_recurring_invoice_next_run', 'recurring_invoice', ['next_run'])
+    op.create_table(
+        'recurring_invoice_run',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('recurring_id', sa.Integer(), sa.ForeignKey('recurring_invoice.id'), nullable=False),
+        sa.Column('period', sa.String(length=7), nullable=False),
+        sa.Column('invoice_id', sa.Integer(), sa.ForeignKey('invoice.id'), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.UniqueConstraint('recurring_id', 'period', name='uq_recurring_run_period'),
+    )
+
+
+def downgrade():
+    op.drop_table('recurring_invoice_run')
+    op.drop_index('ix_recurring_invoice_next_run', table_name='recurring_invoice')
+    op.drop_index('ix_recurring_invoice_client_id', table_name='recurring_invoice')
+    op.drop_table('recurring_invoice')
@@ -91,6 +91,91 @@ def get_openapi_spec(base_url: str = "") -> Dict[str, Any]:
                     },
                 }
             },
+            "/api/invoices/bulk": {
+                "post": {
+                    "summary": "Crear muchas facturas/proformas en un lote (un commit)",
+                    "security": [{"bearerAuth": []}],
+                    "requestBody": {
+                        "required": True,
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "type": "object",
+                                    "properties": {
+                                        "invoices": {
+                                            "type": "array",
+                                            "items": {"$ref": "#/components/schemas/InvoiceCreateRequest"},
+                                        },
+                                        "atomic": {"type": "boolean", "default": False},
+                                    },
+                                    "required": ["invoices"],
+                                }
+                            }
+                        },
+                    },
+                    "responses": {
+                        "201": {"description": "Lote procesado: resultado por fila (id y número, o error)"},
+                        "400": {"$ref": "#/components/responses/BadRequest"},
+                        "401": {"$ref": "#/components/responses/Unauthorized"},
+                        "409": {"description": "Lote atómico con filas sin stock"},
+                    },
+                }
+            },
+            "/api/recurring-invoices": {
+                "get": {
+                    "summary": "Listar plantillas de facturas recurrentes",
+                    "security": [{"bearerAuth": []}],
+                    "parameters": [{"name": "client_id", "in": "query", "schema": {"type": "integer"}}],
+                    "responses": {
+                        "200": {"description": "OK"},
+                        "401": {"$ref": "#/components/responses/Unauthorized"},
+                    },
+                },
+                "post": {
+                    "summary": "Crear plantilla de factura recurrente (o copiarla de una factura)",
+                    "security": [{"bearerAuth": []}],
+                    "requestBody": {
+                        "required": True,
+                        "content": {
+                            "application/json": {
+                                "schema": {
+                                    "type": "object",
+                                    "properties": {
+                                        "client_id": {"type": "integer"},
+                                        "name": {"type": "string"},
+                                        "template": {
+                                            "type": "object",
+                                            "description": "InvoiceCreateRequest sin date ni client_id",
+                                        },
+                                        "from_invoice_id": {"type": "integer"},
+                                        "interval_months": {"type": "integer", "default": 1},
+                                        "next_run": {"type": "string", "format": "date"},
+                                        "end_date": {"type": "string", "format": "date"},
+                                        "prerender_pdf": {"type": "boolean", "default": False},
+                                    },
+                                    "required": ["next_run"],
+                                }
+                            }
+                        },
+                    },
+                    "responses": {
+                        "201": {"description": "Creado"},
+                        "400": {"$ref": "#/components/responses/BadRequest"},
+                        "401": {"$ref": "#/components/responses/Unauthorized"},
+                    },
+                },
+            },
+            "/api/recurring-invoices/run": {
+                "post": {
+                    "summary": "Emitir ahora las facturas recurrentes vencidas (idempotente por periodo)",
+                    "security": [{"bearerAuth": []}],
+                    "responses": {
+                        "200": {"description": "Resumen: emitidas, ya emitidas, con error"},
+                        "400": {"$ref": "#/components/responses/BadRequest"},
+                        "401": {"$ref": "#/components/responses/Unauthorized"},
+                    },
+                }
+            },
         },
         "components": {
             "securitySchemes": {
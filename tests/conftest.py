@@ -0,0 +1,61 @@
+"""
+Arranque común de las pruebas en proceso (sin servidor).
+
+``app`` se importa una sola vez por sesión de pytest y lee su configuración
+al importarse, así que el entorno se fija aquí, antes que cualquier módulo:
+SQLite y caché de PDFs en un directorio temporal, motor ReportLab y render
+en línea (sin pool).  ``TEST_DATABASE_URL`` (base VACÍA) ejecuta las mismas
+pruebas contra Postgres, p. ej. las de concurrencia.  Cada módulo crea solo
+sus propios datos con las fixtures ``api_client``, ``auth_headers`` y
+``make_client``.
+``test_phase3_api.py`` no las usa: va contra un servidor levantado.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+TMP = tempfile.mkdtemp(prefix='facturer-tests-')
+os.environ['DATABASE_URL'] = os.getenv('TEST_DATABASE_URL') or f"sqlite:///{os.path.join(TMP, 'tests.db')}"
+os.environ['PDF_CACHE_DIR'] = os.path.join(TMP, 'pdf_cache')
+os.environ['PDF_ENGINE'] = 'reportlab'
+os.environ['PDF_RENDER_WORKERS'] = '0'
+os.environ['ENABLE_TALISMAN'] = 'false'
+os.environ.setdefault('JWT_SECRET_KEY', 'facturer-tests-' + 'x' * 32)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+try:
+    import app as facturer
+except ImportError:  # dependencias del backend no instaladas: los módulos se saltan con importorskip
+    facturer = None
+
+
+@pytest.fixture(scope='session')
+def auth_headers():
+    from flask_jwt_extended import create_access_token
+    with facturer.app.app_context():
+        token = create_access_token(identity='tests')
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture(scope='module')
+def api_client():
+    """Flask test client with rate limiting off for the module (restored on teardown, even after failures)."""
+    facturer.limiter.enabled = False
+    yield facturer.app.test_client()
+    facturer.limiter.enabled = True
+
+
+@pytest.fixture(scope='module')
+def make_client(api_client, auth_headers):
+    """Create a customer through the API and return its id."""
+    def _make(name: str) -> int:
+        r = api_client.post('/api/clients', json={
+            'name': name, 'cif': 'B00000000', 'address': 'Calle 1', 'email': 'tests@example.com',
+            'phone': '600000000',
+        }, headers=auth_headers)
+        assert r.status_code == 201, r.get_json()
+        return r.get_json()['id']
+    return _make
@@ -0,0 +1,237 @@
+"""
+Almacenamiento de documentos de cliente por contenido (SHA-256 + ref_count).
+
+En proceso contra un SQLite y un ``UPLOADS_ROOT`` temporales: subir el mismo
+fichero a dos clientes guarda un único blob, y el fichero solo se borra al
+eliminar el último documento que lo referencia, después del commit y si
+ninguna subida ha vuelto a usar ese contenido.  Una subida vacía no deja
+blob, y una subida reanudable solo caduca tras ``UPLOAD_SESSION_TTL`` sin
+recibir trozos.  Si el commit de una subida falla, el blob nuevo no se queda
+en disco.
+
+Ejecutar:
+  pytest -q tests/test_document_storage.py
+"""
+
+import hashlib
+import io
+import os
+import time
+
+import pytest
+
+facturer = pytest.importorskip('app')
+
+
+@pytest.fixture()
+def api(api_client, auth_headers, make_client, monkeypatch, tmp_path):
+    monkeypatch.setattr(facturer, 'UPLOADS_ROOT', str(tmp_path))
+    return api_client, auth_headers, [make_client('Blob A'), make_client('Blob B')]
+
+
+def _upload(client, headers, client_id, data, name='doc.pdf'):
+    r = client.post(f'/api/clients/{client_id}/documents', headers=headers, content_type='multipart/form-data',
+                    data={'file': (io.BytesIO(data), name, 'application/pdf')})
+    assert r.status_code == 201, r.get_json()
+    return r.get_json()['id']
+
+
+def _blob(sha):
+    with facturer.app.app_context():
+        return facturer.db.session.get(facturer.StoredBlob, sha)
+
+
+def test_identical_uploads_share_one_blob(api):
+    client, headers, (a, b) = api
+    data = b'%PDF-1.4 shared ' * 4096
+    first = _upload(client, headers, a, data)
+    second = _upload(client, headers, b, data, 'copia.pdf')
+    with facturer.app.app_context():
+        docs = [facturer.db.session.get(facturer.ClientDocument, i) for i in (first, second)]
+        paths = {d.stored_path for d in docs}
+        sha = docs[0].sha256
+    assert len(paths) == 1 and docs[1].sha256 == sha
+    assert _blob(sha).ref_count == 2
+    assert client.get(f'/api/clients/{b}/documents/{second}', headers=headers).data == data
+
+
+def test_blob_file_removed_with_last_reference(api):
+    client, headers, (a, b) = api
+    data = b'%PDF-1.4 released ' * 512
+    first = _upload(client, headers, a, data)
+    second = _upload(client, headers, b, data)
+    with facturer.app.app_context():
+        doc = facturer.db.session.get(facturer.ClientDocument, first)
+        sha, path = doc.sha256, os.path.join(facturer.UPLOADS_ROOT, doc.stored_path)
+
+    assert client.delete(f'/api/clients/{a}/documents/{first}', headers=headers).status_code == 200
+    assert os.path.isfile(path) and _blob(sha).ref_count == 1
+    assert client.delete(f'/api/clients/{b}/documents/{second}', headers=headers).status_code == 200
+    assert not os.path.exists(path) and _blob(sha) is None
+
+
+def test_document_conditional_and_range_get(api):
+    client, headers, (a, _) = api
+    data = b'%PDF-1.4 ranged ' * 1024
+    doc_id = _upload(client, headers, a, data)
+    url = f'/api/clients/{a}/documents/{doc_id}'
+
+    full = client.get(url, headers=headers)
+    etag = full.headers['ETag']
+    assert etag == f'"{_blob(etag.strip(chr(34))).sha256}"'
+    assert full.headers['Accept-Ranges'] == 'bytes'
+
+    assert client.get(url, headers={**headers, 'If-None-Match': etag}).status_code == 304
+    part = client.get(url, headers={**headers, 'Range': 'bytes=100-199', 'If-Range': etag})
+    assert part.status_code == 206 and part.data == data[100:200]
+    stale = client.get(url, headers={**headers, 'Range': 'bytes=100-199', 'If-Range': '"otro"'})
+    assert stale.status_code == 200 and stale.data == data
+
+
+def test_upload_type_sniffed_and_size_capped(api, monkeypatch):
+    client, headers, (a, _) = api
+    fake = client.post(f'/api/clients/{a}/documents', headers=headers, content_type='multipart/form-data',
+                       data={'file': (io.BytesIO(b'MZ\x90\x00 not a pdf'), 'factura.pdf', 'application/pdf')})
+    assert fake.status_code == 415
+
+    png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+    raw = client.post(f'/api/clients/{a}/documents?filename=foto.bin', headers=headers, data=png,
+                      content_type='application/octet-stream')
+    assert raw.status_code == 201
+    with facturer.app.app_context():
+        doc = facturer.db.session.get(facturer.ClientDocument, raw.get_json()['id'])
+        assert (doc.category, doc.content_type, doc.size_bytes) == ('image', 'image/png', len(png))
+
+    monkeypatch.setattr(facturer, 'CLIENT_DOC_MAX_BYTES', 1024)
+    big = client.post(f'/api/clients/{a}/documents?filename=grande.pdf', headers=headers,
+                      data=b'%PDF-1.4 ' + b'x' * 2048, content_type='application/pdf')
+    assert big.status_code == 413
+    assert os.listdir(os.path.join(facturer.UPLOADS_ROOT, facturer.BLOBS_DIR, 'tmp')) == []
+
+
+def test_empty_upload_leaves_no_blob(api):
+    client, headers, (a, _) = api
+    raw = client.post(f'/api/clients/{a}/documents?filename=vacio.pdf', headers=headers, data=b'',
+                      content_type='application/pdf')
+    form = client.post(f'/api/clients/{a}/documents', headers=headers, content_type='multipart/form-data',
+                       data={'file': (io.BytesIO(b''), 'vacio.pdf', 'application/pdf')})
+    assert raw.status_code == form.status_code == 400
+    assert raw.get_json()['error'] == 'Fichero vacío'
+    blobs_dir = os.path.join(facturer.UPLOADS_ROOT, facturer.BLOBS_DIR)
+    assert [f for _, _, files in os.walk(blobs_dir) for f in files] == []
+    assert _blob(hashlib.sha256(b'').hexdigest()) is None
+
+
+def test_resumable_upload(api):
+    client, headers, (a, b) = api
+    data = b'%PDF-1.4 scan ' * 10000
+    base = f'/api/clients/{a}/documents/uploads'
+    r = client.post(base, json={'filename': 'escaneo.pdf', 'size': len(data)}, headers=headers)
+    assert r.status_code == 201
+    upload_id = r.get_json()['upload_id']
+    url = f'{base}/{upload_id}'
+
+    half = len(data) // 2
+    assert client.put(f'{url}?offset=0', data=data[:half], headers=headers).get_json()['offset'] == half
+    stale = client.put(f'{url}?offset=0', data=data[:half], headers=headers)
+    assert stale.status_code == 409 and stale.get_json()['offset'] == half
+    assert client.get(f'/api/clients/{b}/documents/uploads/{upload_id}', headers=headers).status_code == 404
+    assert client.post(f'{url}/commit', headers=headers).status_code == 409
+    assert client.get(url, headers=headers).get_json()['offset'] == half
+    client.put(f'{url}?offset={half}', data=data[half:], headers=headers)
+
+    done = client.post(f'{url}/commit', headers=headers)
+    assert done.status_code == 201
+    doc_id = done.get_json()['id']
+    assert client.get(f'/api/clients/{a}/documents/{doc_id}', headers=headers).data == data
+    assert client.get(url, headers=headers).status_code == 404
+    # Mismo contenido subido de golpe: comparte el blob de la subida por trozos
+    again = _upload(client, headers, b, data)
+    with facturer.app.app_context():
+        shas = {facturer.db.session.get(facturer.ClientDocument, i).sha256 for i in (doc_id, again)}
+    assert len(shas) == 1 and _blob(shas.pop()).ref_count == 2
+
+
+def test_upload_session_expires_by_last_activity(api):
+    client, headers, (a, _) = api
+    r = client.post(f'/api/clients/{a}/documents/uploads', json={'filename': 'lento.pdf'}, headers=headers)
+    url = f"/api/clients/{a}/documents/uploads/{r.get_json()['upload_id']}"
+    meta_path, part_path = facturer._upload_session_paths(r.get_json()['upload_id'])
+    expired = time.time() - facturer.UPLOAD_SESSION_TTL - 60
+
+    # Abierta hace más del TTL pero recibiendo trozos: sigue viva
+    os.utime(meta_path, (expired, expired))
+    assert client.put(f'{url}?offset=0', data=b'%PDF-1.4 ' * 100, headers=headers).status_code == 200
+    with facturer.app.app_context():
+        facturer._purge_stale_upload_sessions()
+    assert client.get(url, headers=headers).get_json()['offset'] == 900
+
+    os.utime(part_path, (expired, expired))
+    with facturer.app.app_context():
+        facturer._purge_stale_upload_sessions()
+    assert client.get(url, headers=headers).status_code == 404
+    assert not os.path.exists(meta_path) and not os.path.exists(part_path)
+
+
+def test_failed_delete_keeps_blob_file(api, monkeypatch):
+    client, headers, (a, _) = api
+    data = b'%PDF-1.4 kept ' * 512
+    doc_id = _upload(client, headers, a, data)
+    with facturer.app.app_context():
+        doc = facturer.db.session.get(facturer.ClientDocument, doc_id)
+        sha, path = doc.sha256, os.path.join(facturer.UPLOADS_ROOT, doc.stored_path)
+
+    def failing_commit():
+        raise facturer.OperationalError('COMMIT', {}, Exception('conexión perdida'))
+
+    with monkeypatch.context() as patch:
+        patch.setattr(facturer.db.session, 'commit', failing_commit)
+        assert client.delete(f'/api/clients/{a}/documents/{doc_id}', headers=headers).status_code == 500
+    assert os.path.isfile(path) and _blob(sha).ref_count == 1
+    assert client.get(f'/api/clients/{a}/documents/{doc_id}', headers=headers).data == data
+
+
+def test_blob_reused_between_commit_and_unlink_is_kept(api):
+    client, headers, (a, b) = api
+    data = b'%PDF-1.4 reused ' * 512
+    doc_id = _upload(client, headers, a, data)
+    with facturer.app.app_context():
+        doc = facturer.db.session.get(facturer.ClientDocument, doc_id)
+        path = os.path.join(facturer.UPLOADS_ROOT, doc.stored_path)
+        released = facturer._blob_release(doc)
+        facturer.db.session.delete(doc)
+        facturer.db.session.commit()
+    # Otra subida del mismo contenido antes de borrar el fichero
+    again = _upload(client, headers, b, data)
+    with facturer.app.app_context():
+        facturer._blob_unlink(released)
+    assert os.path.isfile(path)
+    assert client.get(f'/api/clients/{b}/documents/{again}', headers=headers).data == data
+
+
+def test_failed_upload_commit_removes_new_blob(api, monkeypatch):
+    client, headers, (a, b) = api
+    shared = b'%PDF-1.4 existing ' * 512
+    _upload(client, headers, a, shared)
+    fresh = b'%PDF-1.4 fresh ' * 512
+    paths = {data: os.path.join(facturer.UPLOADS_ROOT, facturer._blob_rel_path(hashlib.sha256(data).hexdigest()))
+             for data in (shared, fresh)}
+    commit = facturer.db.session.commit
+    calls = []
+
+    def commit_fails_once():
+        calls.append(1)
+        if len(calls) == 1:
+            raise facturer.OperationalError('COMMIT', {}, Exception('conexión perdida'))
+        commit()
+
+    for data in (fresh, shared):
+        calls.clear()
+        with monkeypatch.context() as patch:
+            patch.setattr(facturer.db.session, 'commit', commit_fails_once)
+            r = client.post(f'/api/clients/{b}/documents', headers=headers, content_type='multipart/form-data',
+                            data={'file': (io.BytesIO(data), 'doc.pdf', 'application/pdf')})
+        assert r.status_code == 500
+    # El blob nuevo se borra con su fila; el que ya existía conserva fichero y referencias
+    assert not os.path.exists(paths[fresh]) and _blob(hashlib.sha256(fresh).hexdigest()) is None
+    assert os.path.isfile(paths[shared]) and _blob(hashlib.sha256(shared).hexdigest()).ref_count == 1
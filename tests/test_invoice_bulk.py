@@ -0,0 +1,106 @@
+"""
+Alta de facturas por lotes (``POST /api/invoices/bulk``).
+
+En proceso contra un SQLite temporal: el stock se descuenta entre filas del
+mismo lote, un lote mixto de facturas y proformas reserva cada serie (tipo +
+mes) por separado y en orden de fecha, y con ``atomic: true`` cualquier error
+deja el lote sin insertar (409 si todas las filas fallan por stock, 400 si
+alguna es inválida).
+
+Ejecutar:
+  pytest -q tests/test_invoice_bulk.py
+"""
+
+import pytest
+
+facturer = pytest.importorskip('app')
+
+
+@pytest.fixture(scope='module')
+def api(api_client, auth_headers, make_client):
+    return api_client, auth_headers, make_client('Lotes')
+
+
+def _product(client, headers, model, stock):
+    r = client.post('/api/products', headers=headers, json={
+        'category': 'Pantallas', 'model': model, 'price_net': 10, 'tax_rate': 21, 'stock_qty': stock})
+    assert r.status_code in (200, 201), r.get_json()
+    return r.get_json()['id']
+
+
+def _row(client_id, day, doc_type='factura', product_id=None, units=1):
+    return {'date': day, 'type': doc_type, 'client_id': client_id,
+            'items': [{'description': 'Pantalla', 'units': units, 'unit_price': 10, 'tax_rate': 21,
+                       'product_id': product_id}]}
+
+
+def _stock(product_id):
+    with facturer.app.app_context():
+        return facturer.db.session.get(facturer.Product, product_id).stock_qty
+
+
+def _numbers(prefix):
+    with facturer.app.app_context():
+        return sorted(n for (n,) in facturer.db.session.query(facturer.Invoice.number)
+                      .filter(facturer.Invoice.number.like(f'{prefix}%')))
+
+
+def test_stock_consumed_across_rows(api):
+    client, headers, client_id = api
+    product_id = _product(client, headers, 'Lote stock', 3)
+    rows = [_row(client_id, '2034-03-01', product_id=product_id, units=2),
+            _row(client_id, '2034-03-02', product_id=product_id, units=2),
+            _row(client_id, '2034-03-03', product_id=product_id, units=1)]
+    r = client.post('/api/invoices/bulk', headers=headers, json={'invoices': rows})
+    assert r.status_code == 201, r.get_json()
+    body = r.get_json()
+    assert (body['created'], body['failed']) == (2, 1)
+    assert [res['status'] for res in body['results']] == ['ok', 'error', 'ok']
+    assert body['results'][1]['code'] == 409
+    assert [res['number'] for res in body['results'] if res['status'] == 'ok'] == ['F3403001', 'F3403002']
+    assert _stock(product_id) == 0
+    with facturer.app.app_context():
+        moved = facturer.db.session.query(facturer.db.func.sum(facturer.StockMovement.qty)).filter_by(
+            product_id=product_id, type='sale').scalar()
+    assert moved == -3
+
+
+def test_mixed_series_reserved_per_type_and_month(api):
+    client, headers, client_id = api
+    rows = [_row(client_id, '2034-02-10'),
+            _row(client_id, '2034-01-15', 'proforma'),
+            _row(client_id, '2034-01-20'),
+            _row(client_id, '2034-01-05', 'proforma'),
+            _row(client_id, '2034-01-03')]
+    r = client.post('/api/invoices/bulk', headers=headers, json={'invoices': rows})
+    assert r.status_code == 201, r.get_json()
+    # Cada serie numera en orden de fecha, no en orden de entrada
+    assert [res['number'] for res in r.get_json()['results']] == [
+        'F3402001', 'P3401002', 'F3401002', 'P3401001', 'F3401001']
+    with facturer.app.app_context():
+        last = {(s.doc_type, s.month): s.last_number
+                for s in facturer.DocumentSequence.query.filter_by(year=2034).filter(
+                    facturer.DocumentSequence.month.in_([1, 2]))}
+    assert last == {('factura', 1): 2, ('factura', 2): 1, ('proforma', 1): 2}
+
+
+def test_atomic_batch_rolls_back(api):
+    client, headers, client_id = api
+    product_id = _product(client, headers, 'Lote atómico', 1)
+    short = [_row(client_id, '2034-05-01', product_id=product_id),
+             _row(client_id, '2034-05-02', product_id=product_id)]
+    r = client.post('/api/invoices/bulk', headers=headers, json={'invoices': short, 'atomic': True})
+    assert r.status_code == 409, r.get_json()
+    assert r.get_json()['created'] == 0 and [e['index'] for e in r.get_json()['results']] == [1]
+
+    bad_client = [_row(client_id, '2034-05-03', product_id=product_id), _row(999999, '2034-05-04'),
+                  _row(client_id, '2034-05-05', product_id=product_id)]
+    r = client.post('/api/invoices/bulk', headers=headers, json={'invoices': bad_client, 'atomic': True})
+    assert r.status_code == 400, r.get_json()
+    assert sorted(e['code'] for e in r.get_json()['results']) == [400, 409]
+
+    # Nada insertado: ni facturas, ni stock descontado, ni números consumidos
+    assert _numbers('F3405') == [] and _stock(product_id) == 1
+    r = client.post('/api/invoices/bulk', headers=headers, json={'invoices': short[:1], 'atomic': True})
+    assert r.status_code == 201 and r.get_json()['results'][0]['number'] == 'F3405001'
+    assert _stock(product_id) == 0
@@ -0,0 +1,105 @@
+"""
+Numeración de facturas con el asignador por upsert (`_allocate_sequence`).
+
+En proceso contra un SQLite temporal: varios hilos crean facturas a la vez y
+cada serie queda sin huecos ni duplicados; la reserva por bloques devuelve
+números consecutivos y un "database is locked" de SQLite se reintenta con
+espera (otros errores no). Prueba de carga completa:
+  python DEVELOPER/scripts/benchmarks/stress_invoice_numbers.py
+
+Ejecutar:
+  pytest -q tests/test_invoice_numbers.py
+"""
+
+import sqlite3
+import threading
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+facturer = pytest.importorskip('app')
+
+
+def test_concurrent_invoices_get_contiguous_numbers(api_client, auth_headers, make_client):
+    headers = auth_headers
+    client_id = make_client('Numeración')
+    statuses = []
+
+    def worker():
+        http = facturer.app.test_client()
+        for _ in range(25):
+            resp = http.post('/api/invoices', headers=headers, json={
+                'date': '2031-05-20', 'type': 'factura', 'client_id': client_id,
+                'items': [{'description': 'x', 'units': 1, 'unit_price': 10, 'tax_rate': 21}]})
+            statuses.append(resp.status_code)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert statuses == [201] * 200
+    with facturer.app.app_context():
+        numbers = sorted(n for (n,) in facturer.db.session.query(facturer.Invoice.number)
+                         .filter(facturer.Invoice.number.like('F3105%')))
+        last = facturer.DocumentSequence.query.filter_by(doc_type='factura', year=2031, month=5).one().last_number
+    assert numbers == [f'F3105{i:03d}' for i in range(1, 201)] and last == 200
+
+
+def test_reserve_block_is_consecutive():
+    at = datetime(2031, 7, 1)
+    with facturer.app.app_context():
+        first = facturer._next_sequence_atomic('proforma', at)
+        block = facturer._reserve_sequence_numbers('proforma', at, 3)
+        after = facturer._next_sequence_atomic('proforma', at)
+        facturer.db.session.rollback()
+        # Una transacción revertida devuelve los números
+        assert facturer._next_sequence_atomic('proforma', at) == first
+        facturer.db.session.rollback()
+    assert [first, *block, after] == [f'P3107{i:03d}' for i in range(1, 6)]
+
+
+def _failing_execute(monkeypatch, message, failures):
+    """Make the first ``failures`` session.execute calls raise OperationalError(message)."""
+    calls, sleeps = [], []
+    execute = facturer.db.session.execute
+
+    def flaky(*args, **kwargs):
+        calls.append(1)
+        if len(calls) <= failures:
+            raise OperationalError('INSERT INTO document_sequence', {}, sqlite3.OperationalError(message))
+        return execute(*args, **kwargs)
+
+    monkeypatch.setattr(facturer.db.session, 'execute', flaky)
+    monkeypatch.setattr(facturer.time, 'sleep', sleeps.append)
+    return calls, sleeps
+
+
+def test_locked_database_is_retried(monkeypatch):
+    with facturer.app.app_context():
+        if facturer.db.session.get_bind().dialect.name != 'sqlite' or not facturer._SQLITE_UPSERT_RETURNING:
+            pytest.skip('reintento solo en SQLite con upsert + RETURNING')
+        calls, sleeps = _failing_execute(monkeypatch, 'database is locked', failures=2)
+        assert facturer._allocate_sequence('factura', 2031, 9) == 1
+        facturer.db.session.rollback()
+        assert (len(calls), sleeps) == (3, [0.05, 0.1])
+
+        # Bloqueo persistente: se rinde tras SEQUENCE_RETRIES intentos
+        calls, sleeps = _failing_execute(monkeypatch, 'database is locked', failures=99)
+        with pytest.raises(OperationalError):
+            facturer._allocate_sequence('factura', 2031, 9)
+        assert (len(calls), len(sleeps)) == (facturer.SEQUENCE_RETRIES, facturer.SEQUENCE_RETRIES - 1)
+        facturer.db.session.rollback()
+
+
+def test_other_operational_errors_are_not_retried(monkeypatch):
+    with facturer.app.app_context():
+        if facturer.db.session.get_bind().dialect.name == 'sqlite' and not facturer._SQLITE_UPSERT_RETURNING:
+            pytest.skip('SQLite < 3.35 usa _allocate_sequence_fallback')
+        calls, sleeps = _failing_execute(monkeypatch, 'disk I/O error', failures=1)
+        with pytest.raises(OperationalError):
+            facturer._allocate_sequence('factura', 2031, 9)
+        assert (len(calls), sleeps) == (1, [])
+        facturer.db.session.rollback()
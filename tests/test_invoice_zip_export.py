@@ -0,0 +1,85 @@
+"""
+Exportación de PDFs en ZIP (``GET /api/invoices/export_pdf_zip``).
+
+En proceso contra un SQLite temporal: una factura borrada mientras se
+descarga el ZIP se omite, y un render que falla (también el de reserva en
+línea cuando la cola del pool está llena) no corta el ZIP: la factura se
+lista en ``errores.txt``.
+
+Ejecutar:
+  pytest -q tests/test_invoice_zip_export.py
+"""
+
+import io
+import zipfile
+
+import pytest
+
+facturer = pytest.importorskip('app')
+
+
+@pytest.fixture(scope='module')
+def api(api_client, auth_headers, make_client):
+    return api_client, auth_headers, make_client('ZIP')
+
+
+def _invoices(client, headers, client_id, month, count):
+    numbers = {}
+    for day in range(1, count + 1):
+        r = client.post('/api/invoices', headers=headers, json={
+            'date': f'2035-{month:02d}-{day:02d}', 'type': 'factura', 'client_id': client_id,
+            'items': [{'description': 'Cuota', 'units': 1, 'unit_price': 10, 'tax_rate': 21}]})
+        assert r.status_code == 201, r.get_json()
+        numbers[r.get_json()['id']] = f"factura_{r.get_json()['number']}.pdf"
+    return numbers
+
+
+def _zip(client, headers, month, stream=None):
+    r = client.get('/api/invoices/export_pdf_zip', headers=headers, query_string={'year': 2035, 'month': month},
+                   buffered=False)
+    assert r.status_code == 200
+    chunks = iter(r.response)
+    data = next(chunks)
+    if stream:
+        stream()
+    data += b''.join(chunks)
+    r.close()
+    return zipfile.ZipFile(io.BytesIO(data))
+
+
+def test_invoice_deleted_during_export_is_skipped(api):
+    client, headers, client_id = api
+    numbers = _invoices(client, headers, client_id, 1, 4)
+    last = max(numbers)
+
+    def delete_last():
+        assert facturer.app.test_client().delete(f'/api/invoices/{last}', headers=headers).status_code == 200
+
+    zf = _zip(client, headers, 1, stream=delete_last)
+    assert zf.testzip() is None
+    assert sorted(zf.namelist()) == sorted(name for i, name in numbers.items() if i != last)
+
+
+def test_failed_render_listed_instead_of_truncating(api, monkeypatch):
+    client, headers, client_id = api
+    numbers = _invoices(client, headers, client_id, 2, 3)
+    broken = min(numbers)
+    render_job = facturer._invoice_render_job
+
+    def failing_render():
+        raise RuntimeError('wkhtmltopdf murió')
+
+    def job(invoice, *args):
+        return (failing_render, ()) if invoice.id == broken else render_job(invoice, *args)
+
+    def queue_full(fn, *args):
+        facturer.abort(503)
+
+    monkeypatch.setattr(facturer, '_invoice_render_job', job)
+    monkeypatch.setattr(facturer, '_submit_pdf_render', queue_full)
+    zf = _zip(client, headers, 2)
+    assert zf.testzip() is None
+    names = zf.namelist()
+    assert sorted(n for n in names if n != 'errores.txt') == sorted(n for i, n in numbers.items() if i != broken)
+    assert zf.read('errores.txt').decode() == f'{numbers[broken]}: wkhtmltopdf murió\n'
+    assert all(zf.read(n).startswith(b'%PDF-') for n in names if n != 'errores.txt')
@@ -0,0 +1,58 @@
+"""
+Pool de render PDF: un proceso hijo muerto no deja el pool roto.
+
+En proceso, con un pool real de un solo hijo (``PDF_RENDER_WORKERS=1`` solo
+en estas pruebas): se mata el hijo con SIGKILL a mitad de un render (ese
+trabajo falla con ``BrokenProcessPool``) o en reposo, y el siguiente render
+funciona en un pool nuevo.
+
+Ejecutar:
+  pytest -q tests/test_pdf_render_pool.py
+"""
+
+import os
+import signal
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+facturer = pytest.importorskip('app')
+
+pytestmark = pytest.mark.skipif(not hasattr(signal, 'SIGKILL'), reason='requiere SIGKILL (POSIX)')
+
+
+@pytest.fixture()
+def pool(monkeypatch):
+    monkeypatch.setattr(facturer, 'PDF_RENDER_WORKERS', 1)
+    monkeypatch.setattr(facturer, '_pdf_pool', None)
+    yield
+    if facturer._pdf_pool is not None:
+        facturer._pdf_pool.shutdown(wait=True)
+
+
+def test_killed_child_does_not_break_later_renders(pool):
+    child = facturer._render_pdf(os.getpid)
+    assert child != os.getpid()
+    broken = facturer._pdf_pool
+
+    job = facturer._submit_pdf_render(time.sleep, 30)
+    os.kill(child, signal.SIGKILL)
+    assert isinstance(job.exception(timeout=30), BrokenProcessPool)
+
+    assert facturer._render_pdf(int) == 0
+    assert facturer._pdf_pool is not broken
+    assert facturer._render_pdf(os.getpid) not in (child, os.getpid())
+
+
+def test_killed_idle_child_resubmits_on_fresh_pool(pool):
+    child = facturer._render_pdf(os.getpid)
+    broken = facturer._pdf_pool
+    os.kill(child, signal.SIGKILL)
+    deadline = time.monotonic() + 30
+    while not broken._broken and time.monotonic() < deadline:  # el hilo de gestión detecta la muerte
+        time.sleep(0.01)
+    assert broken._broken
+
+    assert facturer._render_pdf(int) == 0
+    assert facturer._pdf_pool is not broken
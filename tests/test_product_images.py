@@ -0,0 +1,40 @@
+"""
+Variantes WebP de imágenes de producto.
+
+En proceso contra un SQLite y un directorio de imágenes temporales: la subida
+devuelve las URLs ``?size=`` al momento, las variantes se generan en el hilo de
+fondo y ``serve_product_image`` las sirve (el original mientras no existan).
+
+Ejecutar:
+  pytest -q tests/test_product_images.py
+"""
+
+import io
+
+import pytest
+
+PIL = pytest.importorskip('PIL.Image')
+facturer = pytest.importorskip('app')
+
+
+def test_upload_generates_webp_variants(api_client, auth_headers, monkeypatch, tmp_path):
+    monkeypatch.setattr(facturer, 'PRODUCT_IMAGES_DIR', str(tmp_path))
+    client, headers = api_client, auth_headers
+    r = client.post('/api/products', json={'category': 'tv', 'model': 'Panel 55', 'price_net': 100, 'tax_rate': 21,
+                                           'stock_qty': 1}, headers=headers)
+    assert r.status_code == 201, r.get_json()
+    png = io.BytesIO()
+    PIL.new('RGB', (2400, 1000), (10, 120, 200)).save(png, 'PNG')
+    png.seek(0)
+    r = client.post('/api/products/upload-image', headers=headers, content_type='multipart/form-data',
+                    data={'file': (png, 'panel.png'), 'product_id': str(r.get_json()['id'])})
+    entry = r.get_json()
+    assert set(entry['variants']) == set(facturer.PRODUCT_IMAGE_VARIANTS)
+
+    facturer._product_image_executor.submit(lambda: None).result()  # esperar al hilo de variantes
+    for size, max_side in facturer.PRODUCT_IMAGE_VARIANTS.items():
+        resp = client.get(entry['variants'][size])
+        assert resp.mimetype == 'image/webp'
+        assert max(PIL.open(io.BytesIO(resp.data)).size) == max_side
+        assert 'immutable' in resp.headers['Cache-Control']
+    assert client.get(entry['url']).mimetype == 'image/png'
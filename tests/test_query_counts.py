@@ -0,0 +1,108 @@
+"""
+Presupuesto de consultas SQL por petición (regresiones N+1).
+
+A diferencia de ``test_phase3_api.py`` no necesita servidor: importa la app
+contra un SQLite temporal y cuenta las sentencias que emite cada petición
+(evento ``before_cursor_execute``).  Las rutas de detalle, PDF y conversión
+de proformas deben costar lo mismo con 2 líneas que con 100.
+
+Ejecutar:
+  pytest -q tests/test_query_counts.py
+"""
+
+from contextlib import contextmanager
+
+import pytest
+
+facturer = pytest.importorskip('app')
+from sqlalchemy import event  # noqa: E402
+
+
+@contextmanager
+def count_queries():
+    """Yield a list that collects every SQL statement run inside the block."""
+    statements = []
+
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with facturer.app.app_context():
+        engine = facturer.db.engine
+    event.listen(engine, 'before_cursor_execute', _before)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', _before)
+
+
+@pytest.fixture(scope='module')
+def api(api_client, auth_headers, make_client):
+    client_id = make_client('Cliente QC')
+    products = []
+    for i in range(100):
+        r = api_client.post('/api/products', json={
+            'category': 'Pantallas', 'model': f'QC {i}', 'sku': f'QC-{i}', 'price_net': 10, 'tax_rate': 21, 'stock_qty': 1000,
+        }, headers=auth_headers)
+        assert r.status_code in (200, 201), r.get_json()
+        products.append(r.get_json()['id'])
+    return api_client, auth_headers, products, client_id
+
+
+def _payload(client_id, products, lines, doc_type):
+    return {
+        'date': '2026-03-04', 'type': doc_type, 'client_id': client_id, 'paid': False,
+        'items': [
+            {'description': f'L{i}', 'units': 1, 'unit_price': 10, 'tax_rate': 21, 'product_id': products[i]}
+            for i in range(lines)
+        ],
+    }
+
+
+def _cost(client, method, url, headers, **kwargs):
+    with count_queries() as statements:
+        r = getattr(client, method)(url, headers=headers, **kwargs)
+    assert r.status_code < 400, (url, r.status_code, r.get_data(as_text=True)[:200])
+    return len(statements), r
+
+
+@pytest.mark.parametrize('doc_type', ['factura', 'proforma'])
+def test_create_invoice_constant_queries(api, doc_type):
+    client, headers, products, client_id = api
+    _cost(client, 'post', '/api/invoices', headers, json=_payload(client_id, products, 1, doc_type))  # crea la secuencia del mes
+    small, _ = _cost(client, 'post', '/api/invoices', headers, json=_payload(client_id, products, 2, doc_type))
+    large, _ = _cost(client, 'post', '/api/invoices', headers, json=_payload(client_id, products, 100, doc_type))
+    assert large == small
+
+
+def test_detail_pdf_and_convert_constant_queries(api):
+    client, headers, products, client_id = api
+    costs = {}
+    for lines in (1, 2, 100):  # 1: calentamiento (crea las secuencias del mes)
+        invoice_id = client.post('/api/invoices', headers=headers,
+                                 json=_payload(client_id, products, lines, 'proforma')).get_json()['id']
+        costs[lines] = (
+            _cost(client, 'get', f'/api/invoices/{invoice_id}', headers)[0],
+            _cost(client, 'get', f'/api/invoices/{invoice_id}/pdf', headers)[0],
+            _cost(client, 'patch', f'/api/invoices/{invoice_id}/convert', headers, json={})[0],
+        )
+    assert costs[100] == costs[2]
+    detail, pdf, _ = costs[100]
+    assert detail <= 2
+    assert pdf <= 3
+
+
+def test_bulk_invoices_constant_queries(api):
+    client, headers, products, client_id = api
+
+    def bulk(count):
+        rows = [_payload(client_id, products, 3, 'factura') for _ in range(count)]
+        rows[0]['client_id'] = 999999  # error por fila: no cancela el lote
+        cost, r = _cost(client, 'post', '/api/invoices/bulk', headers, json={'invoices': rows})
+        body = r.get_json()
+        assert (body['created'], body['failed']) == (count - 1, 1)
+        return cost, [res['number'] for res in body['results'][1:]]
+
+    small, _ = bulk(3)
+    large, numbers = bulk(60)
+    assert large == small
+    assert len(set(numbers)) == 59 and numbers == sorted(numbers)
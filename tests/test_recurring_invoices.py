@@ -0,0 +1,99 @@
+"""
+Facturas recurrentes (renting): plantilla + ``flask run-recurring-invoices``.
+
+En proceso contra un SQLite temporal: el programador emite cada periodo
+vencido una sola vez (repetir la ejecución no duplica), se pone al día si
+estuvo parado (facturas con la fecha de la ejecución y el periodo en las
+notas), deja en su periodo la plantilla que falla por stock y puede dejar
+los PDFs emitidos en la caché.
+
+Ejecutar:
+  pytest -q tests/test_recurring_invoices.py
+"""
+
+from datetime import date
+
+import pytest
+
+facturer = pytest.importorskip('app')
+
+RENTING = {'type': 'factura', 'payment_method': 'transferencia', 'notes': 'Cuota renting',
+           'items': [{'description': 'Cuota mensual TV', 'units': 1, 'unit_price': 45, 'tax_rate': 21}]}
+
+
+@pytest.fixture()
+def api(api_client, auth_headers, make_client):
+    return api_client, auth_headers, make_client('Renting')
+
+
+def _run(on: str):
+    result = facturer.app.test_cli_runner().invoke(args=['run-recurring-invoices', '--date', on])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def _issued(recurring_id):
+    with facturer.app.app_context():
+        return sorted((run.period, facturer.db.session.get(facturer.Invoice, run.invoice_id).number)
+                      for run in facturer.RecurringInvoiceRun.query.filter_by(recurring_id=recurring_id))
+
+
+def _emitted(recurring_id, period):
+    with facturer.app.app_context():
+        run = facturer.RecurringInvoiceRun.query.filter_by(recurring_id=recurring_id, period=period).one()
+        invoice = facturer.db.session.get(facturer.Invoice, run.invoice_id)
+        return invoice.date, invoice.notes
+
+
+def test_due_periods_emitted_once(api):
+    client, headers, client_id = api
+    r = client.post('/api/recurring-invoices', headers=headers, json={
+        'client_id': client_id, 'name': 'TV salón', 'template': RENTING, 'next_run': '2032-01-05',
+        'end_date': '2032-04-30'})
+    assert r.status_code == 201, r.get_json()
+    recurring_id = r.get_json()['id']
+    assert client.post('/api/recurring-invoices', headers=headers, json={
+        'client_id': client_id, 'name': 'Día 31', 'template': RENTING, 'next_run': '2032-01-31'}).status_code == 400
+
+    assert 'emitidas 0;' in _run('2032-01-04')
+    assert 'emitidas 1;' in _run('2032-01-05')
+    assert 'emitidas 0;' in _run('2032-01-05')
+    # Parado dos meses: se emiten febrero y marzo en la misma ejecución
+    assert 'emitidas 2;' in _run('2032-03-20')
+    assert [p for p, _ in _issued(recurring_id)] == ['2032-01', '2032-02', '2032-03']
+    # Ambas con la fecha de la ejecución; el periodo que cubren va en las notas
+    assert _emitted(recurring_id, '2032-02') == (date(2032, 3, 20), 'Cuota renting\nPeriodo 2032-02')
+    assert _emitted(recurring_id, '2032-03') == (date(2032, 3, 20), 'Cuota renting\nPeriodo 2032-03')
+
+    # next_run retrocedido a mano: el periodo ya emitido no se repite
+    client.put(f'/api/recurring-invoices/{recurring_id}', headers=headers, json={'next_run': '2032-03-05'})
+    out = _run('2032-04-05')
+    assert 'emitidas 1; ya emitidas 1;' in out
+    with facturer.app.app_context():
+        recurring = facturer.db.session.get(facturer.RecurringInvoice, recurring_id)
+        assert (recurring.next_run, recurring.active) == (date(2032, 5, 5), False)
+        run = facturer.RecurringInvoiceRun.query.filter_by(recurring_id=recurring_id, period='2032-04').one()
+        invoice = facturer.db.session.get(facturer.Invoice, run.invoice_id)
+        assert (invoice.date, invoice.total, invoice.payment_method) == (date(2032, 4, 5), 54.45, 'transferencia')
+
+
+def test_failed_template_stays_due_and_prerender(api):
+    client, headers, client_id = api
+    product_id = client.post('/api/products', headers=headers, json={
+        'category': 'tv', 'model': 'Renting 55', 'price_net': 45, 'tax_rate': 21, 'stock_qty': 0}).get_json()['id']
+    source = client.post('/api/invoices', headers=headers, json={**RENTING, 'date': '2032-06-01',
+                                                                 'client_id': client_id}).get_json()
+    ok = client.post('/api/recurring-invoices', headers=headers, json={
+        'from_invoice_id': source['id'], 'next_run': '2032-07-01', 'prerender_pdf': True}).get_json()
+    assert ok['client_id'] == client_id and ok['template']['items'][0]['unit_price'] == 45
+    no_stock = client.post('/api/recurring-invoices', headers=headers, json={
+        'client_id': client_id, 'name': 'Venta a plazos', 'next_run': '2032-07-01',
+        'template': {**RENTING, 'items': [{**RENTING['items'][0], 'product_id': product_id}]}}).get_json()
+
+    out = _run('2032-07-01')
+    assert 'con error 1;' in out and 'PDFs en caché 1' in out and 'Sin stock suficiente' in out
+    assert [p for p, _ in _issued(ok['id'])] == ['2032-07'] and _issued(no_stock['id']) == []
+    listed = {r['id']: r for r in client.get('/api/recurring-invoices', headers=headers,
+                                             query_string={'client_id': client_id}).get_json()['items']}
+    assert listed[no_stock['id']]['next_run'] == '2032-07-01' and listed[ok['id']]['next_run'] == '2032-08-01'
+    assert client.delete(f'/api/clients/{client_id}', headers=headers).status_code == 409
@@ -0,0 +1,63 @@
+"""
+Agregados diarios de informes (``report_rollup``) bajo escrituras concurrentes.
+
+Varios escritores crean a la vez facturas pagadas y gastos del mismo día,
+cuya fila de agregado aún no existe: todas las peticiones responden 201 y
+el total y la cuenta coinciden con la suma de la tabla origen.  SQLite
+serializa los escritores; la carrera real (READ COMMITTED) solo aparece en
+Postgres.
+
+Ejecutar:
+  pytest -q tests/test_report_rollups.py
+  TEST_DATABASE_URL=postgresql+psycopg://u:p@host/db_vacia pytest -q tests/test_report_rollups.py
+"""
+
+import threading
+from datetime import date
+
+import pytest
+
+facturer = pytest.importorskip('app')
+
+DAY = date(2033, 2, 14)
+
+
+def _rollup(kind):
+    with facturer.app.app_context():
+        row = facturer.ReportRollup.query.filter_by(kind=kind, year=DAY.year, month=DAY.month, day=DAY.day).first()
+        return (round(row.total, 2), row.count) if row else None
+
+
+def test_concurrent_writers_same_day(api_client, auth_headers, make_client):
+    client_id = make_client('Agregados')
+    invoice = {'date': DAY.isoformat(), 'type': 'factura', 'client_id': client_id, 'paid': True,
+               'items': [{'description': 'Cuota', 'units': 1, 'unit_price': 100, 'tax_rate': 21}]}
+    expense = {'date': DAY.isoformat(), 'category': 'Suministros', 'description': 'Luz', 'supplier': 'Eléctrica',
+               'base_amount': 100, 'tax_rate': 21}
+    writers = [('/api/invoices', invoice)] * 2 + [('/api/expenses', expense)] * 2
+    barrier = threading.Barrier(len(writers))
+    statuses = []
+
+    def worker(url, payload):
+        http = facturer.app.test_client()
+        barrier.wait()
+        for _ in range(20):
+            statuses.append(http.post(url, json=payload, headers=auth_headers).status_code)
+
+    threads = [threading.Thread(target=worker, args=w) for w in writers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert statuses == [201] * 80
+    assert _rollup('income') == (4840.0, 40)
+    assert _rollup('expense') == (4840.0, 40)
+
+    with facturer.app.app_context():
+        ids = [i for (i,) in facturer.db.session.query(facturer.Invoice.id).filter_by(date=DAY)]
+    for invoice_id in ids[:-1]:
+        assert api_client.delete(f'/api/invoices/{invoice_id}', headers=auth_headers).status_code == 200
+    assert _rollup('income') == (121.0, 1)
+    api_client.delete(f'/api/invoices/{ids[-1]}', headers=auth_headers)
+    assert _rollup('income') is None